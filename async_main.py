@@ -1,181 +1,67 @@
 import asyncio
-import csv
 import logging
-import os
-import random
 import re
-from typing import List
-
-import aiofiles
-from aiohttp import ClientSession, ClientError
-from bs4 import BeautifulSoup, SoupStrainer, Tag, NavigableString
-
-from tools.logging_utils import log_set
-from tools.pydantic_types import ContractModel, ConversionOldContractModel, MainContractModel
-from tools.tools import headers_list, clean_contents, match_info, get_fileid, flatten_dict
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, Callable, List, Optional, Tuple
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+from tools.IP_proxy import ProxyPool
+from tools.attachments import AttachmentDownloader
+from tools.cache import ResponseCache
+from tools.coordinator import LeaseStore, LeaseWorker
+from tools.fetcher import Fetcher, Page
+from tools.logging_utils import SuccessLog, log_set, pool_logging
+from tools.memory import BudgetHold, ByteBudget, start_tracing, stop_tracing
+from tools.metrics import log_summary, metrics, start_metrics_server
+from tools.parser import detail_fragment_hash, parse_contract_task
+from tools.rate_limit import AIMDRateController
+from tools.records import ContractRecord
+from tools.retry import CircuitBreaker, DeadLetter, RetryPolicy, with_retry
+from tools.scheduler import DateWindow, ListingScheduler
+from tools.search_index import SearchIndex, index_records
+from tools.sink import CsvSink, contract_columns, make_sink, write_records
+from tools.state import CrawlState, PageTracker, PageVersion
 from tools.tools import match_clean
 
 PRICE_DETAIL_API = "http://htgs.ccgp.gov.cn/GS8/contractpublish"
 
-log_set(logging.INFO, True, "ccgp.log")
-
-
-async def write_csv(export_path: str, queue, headers: List[str] = None, flush_every: int = 400):
-    async with aiofiles.open(export_path, mode='w', encoding='utf-8', newline='') as file:
-        logging.debug(f"Event loop: {asyncio.get_running_loop()}")
-        writer = None
-        item_index = 0
-
-        while True:
-            if writer is None:
-                # 首次写入，创建writer并写入表头
-                writer = csv.DictWriter(file, fieldnames=headers)
-                await writer.writeheader()
-
-            data = await queue.get()
-            if data is None:
-                # None作为结束信号
-                break
-            await writer.writerow(data)
-            item_index += 1
-            queue.task_done()
-
-            if item_index % flush_every == 0:
-                await file.flush()
-                os.fsync(file.fileno())
-
-
-async def parse_contract(_html_content: str) -> ContractModel:
-    # 使用 BeautifulSoup 解析 HTML
-    soup = BeautifulSoup(_html_content, 'lxml', parse_only=SoupStrainer("div", attrs={"class": "vT_detail_main"}))
-
-    result_lst = []
-
-    if soup.find("div", attrs={"class": "content_2020"}):
-        for tag in soup.find("div", attrs={"class": "content_2020"}).contents:
-            if isinstance(tag, Tag):
-                # 过滤空内容
-                tag_text = match_clean(tag.text)
-                if tag_text == "" or "免责声明" in tag_text:
-                    continue
-                tag_contents = clean_contents(tag.contents)
-                if isinstance(tag_contents[0], NavigableString):
-                    # 取得上一位主键
-                    target = result_lst[-1]
-                    if isinstance(target["value"], dict):
-                        matched = match_info(match_clean(tag.text))
-                        if matched["key"] != "本合同对应的中标成交公告":
-                            if matched["key"] != "附件":
-                                if matched["key"] not in target["value"].keys():
-                                    target["value"][matched["key"]] = matched["value"]
-                                else:
-                                    target["value"][f"{matched['key']}_2"] = matched["value"]
-                            else:
-                                result_lst.append(matched)
-                        logging.debug(f"p_tag: {matched}", )
-                elif isinstance(tag_contents[0], Tag):
-                    # 主健
-                    if tag.name == "p":
-                        # 主键
-                        try:
-                            matched = match_info(match_clean(tag.strong.text))
-                            result_lst.append(matched)
-                            logging.debug(matched)
-                        except Exception as e:
-                            logging.error(f"Failed to match_info: {e}")
-                    elif tag.name == "ul":
-                        # 文件下载
-                        li_body = tag.find("li", attrs={"class": "fileInfo"})
-                        cleaned_contents = clean_contents(li_body.contents)
-                        if len(cleaned_contents) == 1:
-                            # 直接提取文件名和 href
-                            filename = li_body.find("a").text
-                            href = li_body.find("a")["href"]
-                        else:
-                            # 提取文件名和 href
-                            filename = match_clean(cleaned_contents[0].text)
-                            href = get_fileid(li_body.find("a")["onclick"])
-                            if href:
-                                href = f"https://download.ccgp.gov.cn/oss/download?uuid={href}"
-                        target = result_lst[-1]
-                        if isinstance(target["value"], dict):
-                            target["value"]["filename"] = filename
-                            target["value"]["href"] = href
-                        logging.debug(f"filename: {filename}, href: {href}")
-
-        # 使用key和value构建字典
-        export_dict = {item["key"]: item["value"] for item in result_lst}
-        export_dict["中标合同"] = export_dict.pop("其他补充事宜")  # 重命名
-
-        # 展平字典
-        try:
-            contract_dict = ContractModel(**flatten_dict(export_dict))
-            logging.debug(contract_dict)
-            return contract_dict
-        except Exception as e:
-            logging.error(f"Failed to parse contract: {e}")
-            return ContractModel()
-
-    elif soup.find("table", attrs={"id": "queryTable"}):
-        # 旧版
-        for tr in soup.find("table", attrs={"id": "queryTable"}).find_all("tr"):
-            matched_info = match_info(match_clean(tr.text))
-            if "免责声明" not in matched_info["key"]:
-                if matched_info["key"] not in ["中标、成交公告", "合同附件"]:
-                    result_lst.append(matched_info)
-                    logging.debug(f"matched_info: {matched_info}")
-                if tr.find("li", attrs={"class": "fileInfo"}):
-                    # 文件下载
-                    li_body = tr.find("li", attrs={"class": "fileInfo"})
-                    cleaned_contents = clean_contents(li_body.contents)
-                    if len(cleaned_contents) == 1:
-                        # 直接提取文件名和 href
-                        filename = li_body.find("a").text
-                        href = li_body.find("a")["href"]
-                    else:
-                        # 提取文件名和 href
-                        filename = match_clean(cleaned_contents[0].text)
-                        href = get_fileid(li_body.find("a")["onclick"])
-                        if href:
-                            href = f"https://download.ccgp.gov.cn/oss/download?uuid={href}"
-                    if matched_info["key"] == "中标、成交公告":
-                        result_lst.append({"key": "中标、成交公告", "value": {"filename": filename, "href": href}})
-                    else:
-                        result_lst.append({"key": "合同附件", "value": {"filename": filename, "href": href}})
-                    logging.debug(f"key: {matched_info['key']}, filename: {filename}, href: {href}")
-
-        # 使用key和value构建字典
-        export_dict = {item["key"]: item["value"] for item in result_lst}
-        # 展平字典
-        export_dict = flatten_dict(export_dict)
-        try:
-            contract_dict = ConversionOldContractModel(**flatten_dict(export_dict))
-            logging.debug(contract_dict)
-            return contract_dict
-        except Exception as e:
-            logging.error(f"Failed to parse contract: {e}")
-            return ContractModel()
-
-
-async def get_subPage(url: str):
-    async with ClientSession(trust_env=False) as session:
-        # 异步delay
-        await asyncio.sleep(random.uniform(1.0, 3.0))
-        async with session.get(
-                url=url,
-                headers=random.choice(headers_list),
-                proxy=None,
-        ) as response:
-            response.raise_for_status()
-            # 记录响应状态码和头信息
-            logging.debug(f"Response Status: {response.status}")
-            logging.debug(f"Response Headers: {response.headers}")
-
-            # 获取响应数据
-            html_data = await response.text()
-            logging.info(f"Successfully get sub html data, url: {response.url}, status: {response.status}")
-
-            return html_data
+# 限速器中的请求优先级 (越小越优先), 列表页优先, 避免详情页 worker 等待新的 URL
+LISTING_PRIORITY = 0
+DETAIL_PRIORITY = 1
+
+# 成功请求按周期汇总输出, 不再每个请求一行日志
+success_log = SuccessLog()
+
+
+async def write_csv(export_path: str, queue, headers: List[str] = None, flush_every: int = 400,
+                    append: bool = False, on_flush: Optional[Callable[[List[dict]], None]] = None) -> int:
+    """写入单个CSV文件, 每 flush_every 行批量写入并落盘"""
+    sink = CsvSink(export_path, headers or contract_columns(), append=append)
+    return await write_records(queue, sink, batch_size=flush_every, on_flush=on_flush)
+
+
+async def get_subPage(url: str, fetcher: Fetcher, budget: Optional[BudgetHold] = None,
+                      version: Optional[PageVersion] = None) -> Page:
+    """
+    获取详情页; 传入上次的版本时不读缓存, 使用条件请求, 未修改时 Page.text 为None
+    budget 只在 Fetcher.fetch 中预留 (预算用尽时在那里等待), 命中缓存时直接计入
+    """
+    # 优先读取本地缓存
+    html_data = await fetcher.get_cached(url) if version is None else None
+    if html_data is not None:
+        logging.debug("Cache hit, url: %s", url)
+        metrics.inc("cache_hits_total", kind="detail")
+        if budget is not None:
+            # 缓存按字符数计入
+            budget.charge(len(html_data))
+        return Page(url, 200, html_data)
+    with metrics.timer("stage_seconds", stage="detail_fetch"):
+        page = await fetcher.fetch(url=url, priority=DETAIL_PRIORITY, budget=budget,
+                                   etag=version.etag if version is not None else None,
+                                   last_modified=version.last_modified if version is not None else None)
+    success_log.record("detail", url)
+    return page
 
 
 async def get_page_max(html_data: str) -> int:
@@ -191,101 +77,566 @@ async def get_page_max(html_data: str) -> int:
         return 0
 
 
-async def get_ccgp_detail(html_data: str, queue: asyncio.Queue) -> None:
-    """获取详情页"""
+async def get_ccgp_detail(html_data: str) -> List[dict]:
+    """解析列表页, 获取详情页链接及基础信息"""
     # 使用bs4实例化并过滤 class='main_list'
     soup = BeautifulSoup(html_data, "lxml", parse_only=SoupStrainer("div", attrs={"class": "main_list"}))
     lst_main = soup.find("ul", attrs={"class": "ulst"}).find_all("li")[1:]  # 去掉第一个元素
 
-    async def fetch_detail(item):
-        base_data = {
+    base_lst = [
+        {
             'signing_date': match_clean(item.find('div').span.text),
             'contract_URL': f"{PRICE_DETAIL_API}/{item.find('a')['href']}",
             'contract_title': match_clean(item.find('a').text),
         }
+        for item in lst_main
+    ]
+    soup.decompose()
+    return base_lst
 
-        # 组装子URL
-        logging.debug(f"sub_url: {base_data['contract_URL']}")
-        sub_html_data = await get_subPage(base_data['contract_URL'])
-        subpage_info = await parse_contract(sub_html_data)
-
-        # 将处理好的数据放入队列
-        write_data = {**base_data, **subpage_info.model_dump()}
-        await queue.put(write_data)
-
-    tasks = [fetch_detail(item) for item in lst_main]
-    await asyncio.gather(*tasks)
-
-
-async def get_ccgp_main(index: int = 1) -> str:
-    """获取主页"""
-    async with ClientSession(trust_env=False) as session:
-        async with session.get(
-                url=f"{PRICE_DETAIL_API}/{'index' if index == 1 else f'index_{index}'}",
-                # url=f"http://ip-api.com/json",
-                headers=random.choice(headers_list),
-                proxy=None,
-        ) as response:
-            response.raise_for_status()
-            # 记录响应状态码和头信息
-            logging.debug(f"Response Status: {response.status}")
-            logging.debug(f"Response Headers: {response.headers}")
-
-            # 获取响应数据
-            html_data = await response.text()
-            logging.info(f"Successfully get main html data, url: {response.url}, status: {response.status}")
 
-            return html_data
+def listing_url(index: int) -> str:
+    """列表页URL"""
+    return f"{PRICE_DETAIL_API}/{'index' if index == 1 else f'index_{index}'}"
 
 
-async def task_main(queue: asyncio.Queue, semaphore: asyncio.Semaphore = asyncio.Semaphore(10),  index: int = 1,
-                    delay: float = random.uniform(1.0, 3.0), retry_count: int = 10):
-    if retry_count <= 0:
-        logging.error("Maximum retry attempts reached. Failed to Get XinFaDi Price Detail.")
-        # raise RuntimeError("Failed to Get XinFaDi Price Detail.")
-    try:
-        async with semaphore:
-            # 异步delay
-            await asyncio.sleep(delay)
-            await get_ccgp_detail(html_data=await get_ccgp_main(index=index), queue=queue)
-
-    except ClientError as e:
-        logging.warning(f"aiohttp request error, retry count: {retry_count}, error: {e}")
-        await asyncio.sleep(3)
-        return await task_main(queue, semaphore, index, delay, retry_count - 1)
-    except Exception as e:
-        logging.warning(f"Get XinFaDi Price Detail failed, retry count: {retry_count}, error: {e}")
-        await asyncio.sleep(3)
-        return await task_main(queue, semaphore, index, delay, retry_count - 1)
+async def get_ccgp_main(fetcher: Fetcher, index: int = 1, cache_max_age: Optional[float] = 0) -> str:
+    """获取主页, cache_max_age 秒内的缓存直接使用 (列表页随时间变化, 默认不读缓存)"""
+    url = listing_url(index)
+    if cache_max_age is None or cache_max_age > 0:
+        html_data = await fetcher.get_cached(url, max_age=cache_max_age)
+        if html_data is not None:
+            logging.debug("Cache hit, url: %s", url)
+            metrics.inc("cache_hits_total", kind="listing")
+            return html_data
+    with metrics.timer("stage_seconds", stage="listing_fetch"):
+        html_data = await fetcher.get_text(url=url, priority=LISTING_PRIORITY)
+    success_log.record("listing", url)
+    return html_data
 
 
-async def main(export_path: str = "ccgp.csv"):
-    # 获取最大页数
-    # await get_ccgp_main(index=1)
-    # max_pages = await get_page_max(await get_ccgp_main(index=1))
-    # logging.debug(f"max_pages: {max_pages}")
+async def fetch_listing(fetcher: Fetcher, index: int, cache_max_age: Optional[float] = 0) -> List[dict]:
+    """获取并解析列表页"""
+    return await get_ccgp_detail(await get_ccgp_main(fetcher=fetcher, index=index, cache_max_age=cache_max_age))
 
-    max_pages = 1
 
-    # 创建队列
-    queue = asyncio.Queue()
+def new_parse_executor(parse_workers: int) -> Optional[ProcessPoolExecutor]:
+    """解析进程池, parse_workers 为 0 时返回None (内联解析); 子进程的日志交给主进程的 handler 输出"""
+    if parse_workers <= 0:
+        return None
+    initializer, initargs = pool_logging()
+    return ProcessPoolExecutor(max_workers=parse_workers, initializer=initializer, initargs=initargs)
 
-    # 写入表头
-    csv_headers = list(MainContractModel().model_dump().keys())
-    writer_task = asyncio.create_task(write_csv(export_path=export_path, queue=queue, headers=csv_headers))
 
-    # 创建异步任务
-    semaphore = asyncio.Semaphore(100)
-    tasks = [
-        task_main(queue=queue, semaphore=semaphore, index=index, delay=random.uniform(1.0, 5.0), retry_count=15)
-        for index in range(1, max_pages + 1)
-    ]
+async def parse_detail(base_data: dict, sub_html_data: str, parse_executor: Optional[ProcessPoolExecutor] = None,
+                       parser_backend: str = "bs4", strict_validation: bool = False) -> ContractRecord:
+    """解析详情页, 与基础信息合并"""
+    try:
+        if parse_executor is None:
+            # 内联模式
+            layout, record, elapsed = parse_contract_task(sub_html_data, parser_backend, strict_validation)
+        else:
+            # 进程池模式, 子进程只返回定长元组
+            layout, record, elapsed = await asyncio.get_running_loop().run_in_executor(
+                parse_executor, parse_contract_task, sub_html_data, parser_backend, strict_validation)
+    except Exception:
+        # 解析过程中抛出的异常 (版式变化导致的 IndexError 等), 版式未知
+        metrics.inc("parse_failures_total", layout="error")
+        raise
+    metrics.observe("stage_seconds", elapsed, stage="parse")
+    metrics.inc("parsed_total", layout=layout)
+    if record is None:
+        metrics.inc("parse_failures_total", layout=layout)
+        if layout == "unknown":
+            raise ValueError(f"Unknown detail page layout, url: {base_data['contract_URL']}")
+        record = ContractRecord()
+    return record.update(base_data).normalize()
+
+
+async def cancel_tasks(tasks: List[asyncio.Task]) -> None:
+    """取消并等待任务结束, 已结束的任务不受影响"""
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def close_stage(queue: asyncio.Queue, task: asyncio.Task):
+    """发送None结束信号并等待阶段任务处理完队列中剩余的数据; 任务已异常退出时直接抛出其异常"""
+    if not task.done():
+        await queue.put(None)
+    return await task
+
+
+async def abort_stage(queue: asyncio.Queue, task: asyncio.Task) -> None:
+    """出错时结束阶段任务: 仍在运行时照常处理完队列中剩余的数据; 已退出或关闭失败时只记录日志, 不覆盖原来的异常"""
+    if task.done():
+        return
+    try:
+        await close_stage(queue, task)
+    except Exception as e:
+        logging.error(f"Failed to close stage, error: {e!r}")
 
-    await asyncio.gather(*tasks)
 
-    await queue.put(None)  # 发送None结束写入任务
+async def supervise(task: asyncio.Task, stages: List[Optional[asyncio.Task]]):
+    """
+    等待 task 完成并返回其结果; 期间任一阶段任务异常退出时取消 task 并抛出该阶段的异常,
+    避免下游阶段失败后上游一直阻塞在已满的队列上. 正常结束的阶段 (如收到结束信号的 worker) 不影响 task
+    """
+    watched = {task, *(stage for stage in stages if stage is not None)}
+    try:
+        while True:
+            done, watched = await asyncio.wait(watched, return_when=asyncio.FIRST_COMPLETED)
+            if task in done:
+                return task.result()
+            for stage in done:
+                # 阶段异常退出或被取消时抛出
+                stage.result()
+    finally:
+        await cancel_tasks([task])
+
+
+class CrawlContext:
+    """各阶段 worker 共享的组件与配置"""
+
+    def __init__(self, fetcher: Fetcher, tracker: PageTracker, dead_letter: DeadLetter,
+                 listing_retry: RetryPolicy, detail_retry: RetryPolicy, breaker: CircuitBreaker,
+                 parse_executor: Optional[ProcessPoolExecutor] = None, parser_backend: str = "bs4",
+                 listing_cache_ttl: Optional[float] = 0, attachments: Optional[AttachmentDownloader] = None,
+                 strict_validation: bool = False, budget: Optional[ByteBudget] = None,
+                 index_queue: Optional[asyncio.Queue] = None):
+        self.fetcher = fetcher
+        self.tracker = tracker
+        self.dead_letter = dead_letter
+        self.listing_retry = listing_retry
+        self.detail_retry = detail_retry
+        self.breaker = breaker
+        self.parse_executor = parse_executor
+        self.parser_backend = parser_backend
+        self.listing_cache_ttl = listing_cache_ttl
+        self.attachments = attachments
+        self.strict_validation = strict_validation
+        self.budget = budget
+        self.index_queue = index_queue
+
+
+async def fetch_listing_page(index: int, ctx: CrawlContext) -> Optional[List[dict]]:
+    """获取列表页 (含重试), 最终失败时写入 dead letter 并返回None"""
+    try:
+        return await with_retry(fetch_listing, ctx.fetcher, index, ctx.listing_cache_ttl, policy=ctx.listing_retry,
+                                breaker=ctx.breaker, desc=f"Get listing page {index}")
+    except Exception as e:
+        ctx.dead_letter.add("listing", index, e)
+        return None
+
+
+async def discover_pages(ctx: CrawlContext) -> Tuple[int, Optional[List[dict]]]:
+    """
+    请求第 1 页获取总页数, 同时返回第 1 页的解析结果; 失败时抛出异常 (不能当作没有列表页,
+    否则本次运行会被记为完成, dead letter 也会被清空)
+    """
+    html_data = await with_retry(get_ccgp_main, ctx.fetcher, 1, ctx.listing_cache_ttl, policy=ctx.listing_retry,
+                                 breaker=ctx.breaker, desc="Get listing page 1")
+    max_pages = await get_page_max(html_data)
+    if max_pages <= 0:
+        raise ValueError("Failed to get page max value from listing page 1")
+    return max_pages, await get_ccgp_detail(html_data)
+
+
+async def listing_feeder(scheduler: ListingScheduler, detail_queue: asyncio.Queue, ctx: CrawlContext,
+                         window: Optional[DateWindow] = None):
+    """按页码顺序消费预取的列表页: 过滤日期窗口与已爬取的合同后放入详情页队列"""
+    async for index, base_lst in scheduler:
+        if base_lst is None or ctx.tracker.should_stop(index):
+            # 已停止翻页或请求失败 (已写入 dead letter)
+            ctx.tracker.abandon_page(index)
+            continue
+        if window is not None:
+            total = len(base_lst)
+            base_lst, past = window.filter(base_lst)
+            metrics.inc("listing_rows_skipped_total", total - len(base_lst), reason="date_window")
+            if past:
+                ctx.tracker.stop_at(index, f"is older than {window}")
+        for base_data in ctx.tracker.filter_new(index, base_lst):
+            # 队列有界, 详情页处理不过来时在此阻塞, 预取的列表页在后台继续请求
+            await detail_queue.put(base_data)
+
+
+async def fetch_detail(base_data: dict, ctx: CrawlContext) -> Optional[ContractRecord]:
+    """
+    下载并解析详情页; HTML 只在此函数内持有, 返回时即释放, 同时归还占用的在途字节预算
+
+    重新检查已爬取的合同时, 服务器返回 304 或正文哈希与上次相同则不解析也不写入, 返回None
+    """
+    url = base_data['contract_URL']
+    previous = ctx.tracker.page_version(url)
+    hold = ctx.budget.hold() if ctx.budget is not None else None
+    try:
+        # 只重试下载本身, 不会重复请求列表页或其他详情页
+        page = await with_retry(get_subPage, url, fetcher=ctx.fetcher, budget=hold, version=previous,
+                                policy=ctx.detail_retry, breaker=ctx.breaker, desc=f"Get contract {url}")
+        ctx.tracker.mark_fetched(url)
+        if page.not_modified:
+            metrics.inc("detail_changes_total", result="not_modified")
+            ctx.tracker.unchanged(url, page.etag, page.last_modified)
+            return None
+        version = None
+        if ctx.tracker.state is not None:
+            version = PageVersion(page.etag, page.last_modified, detail_fragment_hash(page.text))
+            if previous is not None and previous.content_hash == version.content_hash:
+                metrics.inc("detail_changes_total", result="unchanged")
+                ctx.tracker.unchanged(url, page.etag, page.last_modified)
+                return None
+        try:
+            record = await parse_detail(base_data, page.text, ctx.parse_executor, ctx.parser_backend,
+                                        ctx.strict_validation)
+        except Exception as e:
+            # 下载失败已由 with_retry 记录, 这里只记录解析失败
+            logging.error(f"Failed to parse contract {url}, error: {e!r}")
+            raise
+        if version is not None:
+            # 落盘后才保存新版本
+            ctx.tracker.stage_version(url, version, previous)
+            if previous is not None:
+                metrics.inc("detail_changes_total", result="changed")
+                logging.info(f"Contract changed: {url}")
+        return record
+    finally:
+        if hold is not None:
+            hold.release()
+
+
+async def detail_worker(detail_queue: asyncio.Queue, write_queue: asyncio.Queue, ctx: CrawlContext):
+    """详情页 worker: 详情页基础信息 -> 下载 -> 解析 -> 写入队列"""
+    while True:
+        base_data = await detail_queue.get()
+        try:
+            if base_data is None:
+                break
+            url = base_data['contract_URL']
+            logging.debug("sub_url: %s", url)
+            try:
+                write_data = await fetch_detail(base_data, ctx)
+            except Exception as e:
+                # 失败原因已在 with_retry / fetch_detail 中记录, 这里只写入 dead letter
+                ctx.dead_letter.add("detail", base_data, e)
+                ctx.tracker.discard(url)
+                continue
+            if write_data is None:
+                # 合同未变更
+                continue
+            # 队列有界, 写入跟不上时在此阻塞
+            await write_queue.put(write_data)
+            if ctx.index_queue is not None:
+                await ctx.index_queue.put(write_data)
+            if ctx.attachments is not None:
+                await ctx.attachments.submit(write_data)
+        finally:
+            detail_queue.task_done()
+
+
+async def main(export_path: str = "ccgp.csv", max_pages: Optional[int] = None, listing_workers: int = 2,
+               listing_lookahead: int = 4, detail_workers: int = 10, queue_size: int = 100, parse_workers: int = 0,
+               parser_backend: str = "bs4", strict_validation: bool = False, state_path: Optional[str] = None,
+               resume: bool = True,
+               cache_dir: Optional[str] = None, cache_max_bytes: int = 2 * 1024 ** 3,
+               listing_cache_ttl: Optional[float] = 0, initial_rate: float = 2.0, max_rate: float = 20.0,
+               listing_retry: Optional[RetryPolicy] = None, detail_retry: Optional[RetryPolicy] = None,
+               breaker_threshold: int = 10, breaker_recovery: float = 60.0,
+               dead_letter_path: str = "ccgp_dead_letter.jsonl", retry_dead_letter: bool = True,
+               output_format: str = "csv", compression: Optional[str] = None, shard_max_rows: Optional[int] = None,
+               shard_max_bytes: Optional[int] = None, write_batch_size: int = 400,
+               proxy_provider_url: Optional[str] = None, proxy_min_size: int = 5,
+               metrics_port: Optional[int] = None, stats_interval: float = 30.0,
+               lease_store: Optional[LeaseStore] = None, worker_id: Optional[str] = None, lease_pages: int = 50,
+               lease_ttl: float = 300.0, attachment_dir: Optional[str] = None, attachment_workers: int = 4,
+               signed_after=None, signed_before=None, max_inflight_bytes: Optional[int] = None,
+               trace_memory: bool = False, index_path: Optional[str] = None, recheck: bool = False):
+    """
+    流水线: 列表页 -> 详情页URL -> 下载/解析 -> 写入, 爬取前 max_pages 个列表页, 为None时从第 1 页读取总页数
+
+    各阶段之间使用有界队列连接, 每个阶段使用固定数量的 worker,
+    内存占用不随爬取页数增长, 吞吐量通过 worker 数量调节
+    列表页按顺序调度, 最多 listing_workers 个并发请求, 预取 listing_lookahead 页; 限速时列表页请求优先于详情页
+    signed_after / signed_before 指定时只保留签订日期 (signing_date) 在窗口内的合同, 整页早于 signed_after 时停止翻页
+
+    parse_workers > 0 时使用进程池解析详情页, 为 0 时在事件循环内联解析 (便于调试)
+    parser_backend 可选 bs4 / lxml, 两者输出一致, lxml 更快; strict_validation 时使用 pydantic 完整校验每条记录,
+    默认使用预编译的字段映射; 金额统一转为 Decimal (元), 日期转为 ISO 格式
+    state_path 指定时启用持久化索引: 跳过已爬取的合同, 遇到整页已知合同时停止翻页, 中断后可续爬;
+    同时保存每个详情页的 ETag / Last-Modified 及正文哈希. recheck 时重新检查已爬取的合同 (用于发现合同变更, 通常配合
+    signed_after 或 max_pages 限定范围): 使用条件请求, 304 或正文未变的合同不解析、不写入, 变更的合同重新写入一条记录
+    并记入 state 的 changes 表
+    cache_dir 指定时缓存全部原始响应, 详情页优先读取缓存, 列表页仅读取 listing_cache_ttl 秒内的缓存
+    请求速率由 AIMD 限速器按 host 自适应调整, 从 initial_rate 开始, 不超过 max_rate (请求/秒)
+    列表页/详情页分别按 listing_retry / detail_retry 重试, 连续 breaker_threshold 次站点级错误后暂停
+    breaker_recovery 秒; 最终失败的请求写入 dead_letter_path, retry_dead_letter 时下次运行会重新处理
+    output_format 可选 csv / parquet / sqlite, csv 可用 gzip / zstd 压缩; 设置 shard_max_rows / shard_max_bytes 时分片输出
+    proxy_provider_url 指定时使用代理池, 每个请求轮换代理
+    metrics_port 指定时在本地提供 Prometheus 格式的 /metrics 接口, 每 stats_interval 秒输出一行汇总日志
+    lease_store 指定时为分布式模式: 前 max_pages 页按 lease_pages 页划分为租约, 多个节点各自领取/续约 (lease_ttl 秒),
+    每个节点使用各自的 export_path, 全部完成后用 tools.sink.merge_outputs 合并
+    max_inflight_bytes 指定时限制已下载但未解析完成的详情页 HTML 总字节数, 超出时暂停下载, 内存占用可预期;
+    trace_memory 时使用 tracemalloc 跟踪内存分配, 结束时输出峰值 (会降低运行速度)
+    index_path 指定时增量更新检索索引 (供应商/采购人/标的/项目名称的二元组倒排表及金额/日期), 见 tools.search_index
+    attachment_dir 指定时下载合同附件 (流式写入, 断点续传, 按 uuid 去重), 使用 attachment_workers 个独立的下载连接
+    """
+    if recheck and not state_path:
+        raise ValueError("recheck requires state_path")
+    metrics.start()
+    if trace_memory:
+        start_tracing()
+    window = DateWindow(signed_after, signed_before) if signed_after or signed_before else None
+
+    # 创建有界队列
+    detail_queue = asyncio.Queue(maxsize=queue_size)
+    write_queue = asyncio.Queue(maxsize=queue_size)
+
+    # 统计
+    metrics.set_gauge("queue_depth", detail_queue.qsize, queue="detail")
+    metrics.set_gauge("queue_depth", write_queue.qsize, queue="write")
+    budget = ByteBudget(max_inflight_bytes) if max_inflight_bytes else None
+    if budget is not None:
+        metrics.set_gauge("inflight_html_bytes", lambda: budget.used)
+    metrics_runner = await start_metrics_server(metrics_port) if metrics_port else None
+    summary_task = asyncio.create_task(log_summary(stats_interval))
+
+    # 已爬取索引
+    state = CrawlState(state_path) if state_path else None
+    if state is not None:
+        state.start_run(resume=resume)
+    tracker = PageTracker(state, recheck=recheck)
+    completed_pages = tracker.completed_pages()
+
+    # 上次运行失败的请求
+    dead_letter = DeadLetter(dead_letter_path)
+    # 未启用附件下载时, 附件的失败记录留在 dead letter 中
+    retry_kinds = ("listing", "detail", "attachment") if attachment_dir else ("listing", "detail")
+    retry_entries = dead_letter.take(retry_kinds) if retry_dead_letter else []
+
+    # 写入端; 启用 state 时已有的输出是之前运行写入的 (state 中记为已爬取, 不会再次爬取), 只能追加
+    sink = make_sink(export_path, output_format, compression=compression, append=state is not None,
+                     max_rows=shard_max_rows, max_bytes=shard_max_bytes)
+    writer_task = asyncio.create_task(write_records(write_queue, sink, batch_size=write_batch_size,
+                                                    on_flush=tracker.on_flush))
+
+    search_index = index_queue = index_task = parse_executor = cache = proxy_pool = attachments = lease_worker = None
+    finished = False
+    try:
+        # 检索索引, 与写入端并行
+        if index_path:
+            search_index = SearchIndex(index_path)
+            index_queue = asyncio.Queue(maxsize=queue_size)
+            index_task = asyncio.create_task(index_records(index_queue, search_index, batch_size=write_batch_size))
+            metrics.set_gauge("queue_depth", index_queue.qsize, queue="index")
+
+        parse_executor = new_parse_executor(parse_workers)
+        cache = ResponseCache(cache_dir, max_bytes=cache_max_bytes) if cache_dir else None
+
+        rate_controller = AIMDRateController(initial_rate=initial_rate, max_rate=max_rate)
+        if proxy_provider_url:
+            proxy_pool = ProxyPool(proxy_provider_url, min_size=proxy_min_size)
+            await proxy_pool.start()
+
+        if attachment_dir:
+            attachments = AttachmentDownloader(attachment_dir, workers=attachment_workers, dead_letter=dead_letter)
+            await attachments.start()
+
+        # 所有请求共享同一个连接池
+        async with Fetcher(cache=cache, rate_controller=rate_controller, proxy_pool=proxy_pool) as fetcher:
+            ctx = CrawlContext(
+                fetcher=fetcher, tracker=tracker, dead_letter=dead_letter,
+                listing_retry=listing_retry or RetryPolicy(max_attempts=8, base_delay=2.0, retry_all_errors=True),
+                detail_retry=detail_retry or RetryPolicy(max_attempts=5, base_delay=1.0),
+                breaker=CircuitBreaker(failure_threshold=breaker_threshold, recovery_time=breaker_recovery),
+                parse_executor=parse_executor, parser_backend=parser_backend, listing_cache_ttl=listing_cache_ttl,
+                attachments=attachments, strict_validation=strict_validation, budget=budget, index_queue=index_queue,
+            )
+            detail_tasks = [
+                asyncio.create_task(detail_worker(detail_queue, write_queue, ctx)) for _ in range(detail_workers)
+            ]
+            # 列表页 -> 详情页队列, 结束后向 worker 发送结束信号并等待其处理完成
+            async def crawl():
+                nonlocal max_pages, lease_worker
+                # 先重新处理上次失败的请求
+                retry_pages, retry_details = [], []
+                for entry in retry_entries:
+                    if entry["kind"] == "detail":
+                        retry_details.append(entry["payload"])
+                    elif entry["kind"] == "listing":
+                        retry_pages.append(entry["payload"])
+                    elif entry["kind"] == "attachment":
+                        await attachments.put(entry["payload"])
+                # 在列表页之前登记, 列表页中再次出现的同一合同不会重复写入
+                for base_data in tracker.filter_retry(retry_details):
+                    await detail_queue.put(base_data)
+                if retry_entries:
+                    logging.info(f"Retry {len(retry_entries)} dead letter entries.")
+
+                # 获取最大页数
+                first_page = None
+                if max_pages is None:
+                    max_pages, first_page = await discover_pages(ctx)
+                    logging.info(f"max_pages: {max_pages}")
+
+                # 分布式模式, 页码来自租约
+                if lease_store is not None:
+                    await asyncio.to_thread(lease_store.setup, max_pages, lease_pages)
+                    lease_worker = LeaseWorker(lease_store, worker_id=worker_id, ttl=lease_ttl)
+                    tracker.on_page_done = lease_worker.page_done
+
+                async def listing_pages() -> AsyncIterator[int]:
+                    for index in retry_pages:
+                        yield index
+                    if lease_worker is not None:
+                        async for index in lease_worker.pages():
+                            if index in completed_pages or tracker.should_stop(index):
+                                tracker.abandon_page(index)
+                                continue
+                            yield index
+                    else:
+                        for index in range(1, max_pages + 1):
+                            if tracker.should_stop(index):
+                                break
+                            if index in completed_pages:
+                                # 断点续爬, 跳过已完成的列表页
+                                continue
+                            yield index
+
+                scheduler = ListingScheduler(lambda index: fetch_listing_page(index, ctx), listing_pages(),
+                                             lookahead=listing_lookahead, concurrency=listing_workers,
+                                             should_stop=tracker.should_stop)
+                if first_page is not None:
+                    scheduler.seed(1, first_page)
+                metrics.set_gauge("queue_depth", scheduler.buffered, queue="page")
+                await listing_feeder(scheduler, detail_queue, ctx, window)
+
+                for _ in range(detail_workers):
+                    await detail_queue.put(None)
+                await asyncio.gather(*detail_tasks)
+
+            try:
+                # 写入端/索引/详情页 worker 任一异常退出时停止爬取并抛出其异常, 不会阻塞在已满的队列上
+                await supervise(asyncio.create_task(crawl()), [writer_task, index_task, *detail_tasks])
+            finally:
+                # 出错或被取消时先停止详情页 worker 再关闭 Fetcher, 避免 worker 继续使用已关闭的连接池
+                await cancel_tasks(detail_tasks)
+        logging.info(f"Final request rates: {rate_controller.rates()}")
+        # 剩余的记录落盘, 写入失败时本次运行不记为完成
+        await close_stage(write_queue, writer_task)
+        if index_task is not None:
+            await close_stage(index_queue, index_task)
+        finished = True
+    finally:
+        if attachments is not None:
+            # 出错或被取消时不再等待剩余附件下载, 未完成的附件写入 dead letter
+            await attachments.close(drain=finished)
+        if proxy_pool is not None:
+            await proxy_pool.close()
+        if parse_executor is not None:
+            parse_executor.shutdown(wait=True)
+        if cache is not None:
+            cache.close()
+
+        if not finished:
+            # 已进入写入队列的记录照常落盘, 出错时也不会丢失
+            await abort_stage(write_queue, writer_task)
+            if index_task is not None:
+                await abort_stage(index_queue, index_task)
+        if search_index is not None:
+            search_index.close()
+        if finished:
+            # 出错时保留 dead letter, 下次运行再次处理
+            dead_letter.done()
+        if lease_worker is not None:
+            # 写入端关闭后最后一批记录已落盘, 其余未完成的租约交还给其他节点
+            await lease_worker.close()
+
+        if state is not None:
+            if finished:
+                state.finish_run()
+            state.close()
+
+        summary_task.cancel()
+        success_log.flush()
+        if budget is not None:
+            logging.info(f"In-flight HTML peak: {budget.peak / 1024:.1f}KB / {budget.max_bytes / 1024:.1f}KB")
+        if trace_memory:
+            stop_tracing()
+        logging.info(f"Crawl stats: {metrics.summary()}")
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+
+
+def listing_index(url: str) -> int:
+    """列表页URL -> 页码"""
+    match = re.search(r"/index(?:_(\d+))?$", url)
+    return int(match.group(1) or 1) if match else 0
+
+
+async def replay(export_path: str = "ccgp.csv", cache_dir: str = "ccgp_cache", parse_workers: int = 0,
+                 parser_backend: str = "bs4", strict_validation: bool = False, queue_size: int = 100,
+                 output_format: str = "csv", compression: Optional[str] = None, shard_max_rows: Optional[int] = None,
+                 shard_max_bytes: Optional[int] = None):
+    """离线回放: 不访问网络, 使用缓存中的列表页与详情页重新生成完整CSV"""
+    cache = ResponseCache(cache_dir)
+    parse_executor = new_parse_executor(parse_workers)
+
+    write_queue = asyncio.Queue(maxsize=queue_size)
+    sink = make_sink(export_path, output_format, compression=compression, max_rows=shard_max_rows,
+                     max_bytes=shard_max_bytes)
+    writer_task = asyncio.create_task(write_records(write_queue, sink))
+
+    failed = 0
+
+    async def replay_detail(base_data: dict, sub_html_data: str):
+        nonlocal failed
+        try:
+            record = await parse_detail(base_data, sub_html_data, parse_executor, parser_backend, strict_validation)
+        except Exception as e:
+            # 尽力回放, 单个详情页失败不影响其余合同
+            failed += 1
+            logging.error(f"Failed to replay contract {base_data['contract_URL']}, error: {e!r}")
+            return
+        await write_queue.put(record)
+
+    # 按页码顺序回放列表页, 同时解析的详情页数量有上限
+    listing_urls = sorted((url for url in cache.urls(f"{PRICE_DETAIL_API}/index") if listing_index(url)),
+                          key=listing_index)
+    seen = set()
+    pending = set()
+    for url in listing_urls:
+        html_data = await asyncio.to_thread(cache.get, url)
+        if html_data is None:
+            continue
+        try:
+            base_lst = await get_ccgp_detail(html_data)
+        except Exception as e:
+            failed += 1
+            logging.error(f"Failed to replay listing page {url}, error: {e!r}")
+            continue
+        for base_data in base_lst:
+            if base_data['contract_URL'] in seen:
+                continue
+            seen.add(base_data['contract_URL'])
+            sub_html_data = await asyncio.to_thread(cache.get, base_data['contract_URL'])
+            if sub_html_data is None:
+                logging.warning(f"Detail page not cached, url: {base_data['contract_URL']}")
+                continue
+            if len(pending) >= max(parse_workers, 1) * 2:
+                _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            pending.add(asyncio.create_task(replay_detail(base_data, sub_html_data)))
+    await asyncio.gather(*pending)
+
+    await write_queue.put(None)
     await writer_task
 
+    if parse_executor is not None:
+        parse_executor.shutdown(wait=True)
+    cache.close()
+    logging.info(f"Replay finished, listing pages: {len(listing_urls)}, contracts: {len(seen)}, failed: {failed}")
+
 
 if __name__ == '__main__':
+    # 日志由后台线程写入, 不阻塞事件循环
+    log_set(logging.INFO, True, "ccgp.log", use_queue=True)
     asyncio.run(main())
@@ -0,0 +1,304 @@
+"""
+离线基准测试: 在本地启动模拟合同公示站点的 aiohttp 服务, 不访问 htgs.ccgp.gov.cn
+
+python -m benchmark.bench --pages 20 --latency 0.05 --error-rate 0.02
+python -m benchmark.bench --compare benchmark/results/<旧提交>.json
+python -m benchmark.bench --recheck-ratio 0.1
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, Optional, Set
+
+from aiohttp import web
+
+import async_main
+from tools.logging_utils import log_set
+from tools.parser import PARSER_BACKENDS, check_mapper, check_parity, parse_contract_layout
+from tools.records import ContractRecord
+from tools.retry import RetryPolicy
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+RESULT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+STUB_PATH = "/GS8/contractpublish"
+# 模拟合同变更: 修改正文中的合同金额
+CHANGES = {"new": ("375,000.00", "376,000.00"), "old": ("86.5 万元", "87.5 万元")}
+
+
+def load_fixture(name: str) -> str:
+    with open(os.path.join(FIXTURE_DIR, name), encoding="utf-8") as file:
+        return file.read()
+
+
+class StubSite:
+    """
+    模拟合同公示站点: index / index_N 为列表页 (每页20条), detail/{页码}/{序号}.shtml 为详情页,
+    序号为偶数时返回 content_2020 版式, 奇数时返回 queryTable 版式
+
+    每个请求随机延迟 latency * [0.5, 1.5) 秒, 并以 error_rate 的概率返回 503;
+    conditional 时详情页返回 ETag 并支持 If-None-Match, changed 中的详情页 ({页码}/{序号}) 返回变更后的内容
+    """
+
+    def __init__(self, pages: int = 10, latency: float = 0.0, error_rate: float = 0.0, seed: int = 0,
+                 conditional: bool = True):
+        self.pages = pages
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.listing = load_fixture("listing.html").replace("{pages}", str(pages))
+        self.details = {"new": load_fixture("detail_new.html"), "old": load_fixture("detail_old.html")}
+        self.conditional = conditional
+        self.changed: Set[str] = set()
+        self.requests = 0
+        self.errors = 0
+        self.not_modified = 0
+        self._runner: Optional[web.AppRunner] = None
+
+    @web.middleware
+    async def _simulate(self, request: web.Request, handler):
+        self.requests += 1
+        if self.latency > 0:
+            await asyncio.sleep(self.latency * self.random.uniform(0.5, 1.5))
+        if self.random.random() < self.error_rate:
+            self.errors += 1
+            raise web.HTTPServiceUnavailable()
+        return await handler(request)
+
+    async def _listing(self, request: web.Request) -> web.Response:
+        page = int(request.match_info.get("page", 1))
+        if not 1 <= page <= self.pages:
+            raise web.HTTPNotFound()
+        # 模板中含有 {size:...} 等花括号, 不能使用 str.format
+        return web.Response(text=self.listing.replace("{page}", str(page)), content_type="text/html")
+
+    async def _detail(self, request: web.Request) -> web.Response:
+        layout = "new" if int(request.match_info["index"]) % 2 == 0 else "old"
+        text = self.details[layout]
+        if f"{request.match_info['page']}/{request.match_info['index']}" in self.changed:
+            text = text.replace(*CHANGES[layout])
+        if not self.conditional:
+            return web.Response(text=text, content_type="text/html")
+        etag = f'"{hashlib.md5(text.encode("utf-8")).hexdigest()}"'
+        if request.headers.get("If-None-Match") == etag:
+            self.not_modified += 1
+            return web.Response(status=304, headers={"ETag": etag})
+        return web.Response(text=text, content_type="text/html", headers={"ETag": etag})
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """启动服务, 返回可直接赋值给 PRICE_DETAIL_API 的地址"""
+        app = web.Application(middlewares=[self._simulate])
+        app.router.add_get(f"{STUB_PATH}/index", self._listing)
+        app.router.add_get(STUB_PATH + r"/index_{page:\d+}", self._listing)
+        app.router.add_get(STUB_PATH + r"/detail/{page:\d+}/{index:\d+}.shtml", self._detail)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return f"http://{host}:{port}{STUB_PATH}"
+
+    async def close(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+async def bench_crawl(pages: int, latency: float, error_rate: float, workdir: str, detail_workers: int = 10,
+                      parse_workers: int = 0, parser_backend: str = "bs4",
+                      max_inflight_bytes: Optional[int] = None) -> Dict:
+    """端到端: 列表页 -> 详情页 -> 解析 -> 写入CSV"""
+    stub = StubSite(pages=pages, latency=latency, error_rate=error_rate)
+    async_main.PRICE_DETAIL_API = await stub.start()
+    export_path = os.path.join(workdir, "crawl.csv")
+    start = time.perf_counter()
+    try:
+        await async_main.main(
+            export_path=export_path, max_pages=pages, detail_workers=detail_workers, parse_workers=parse_workers,
+            parser_backend=parser_backend, initial_rate=1000.0, max_rate=1000.0,
+            listing_retry=RetryPolicy(max_attempts=8, base_delay=0.05, retry_all_errors=True),
+            detail_retry=RetryPolicy(max_attempts=8, base_delay=0.05),
+            dead_letter_path=os.path.join(workdir, "dead_letter.jsonl"), retry_dead_letter=False,
+            stats_interval=3600.0, max_inflight_bytes=max_inflight_bytes,
+        )
+    finally:
+        await stub.close()
+    elapsed = time.perf_counter() - start
+    with open(export_path, encoding="utf-8") as file:
+        rows = sum(1 for _ in file) - 1
+    return {
+        "pages": pages, "rows": rows, "seconds": round(elapsed, 3),
+        # 只计入成功完成的列表页与详情页, 注入的 503 及其重试不算
+        "pages_per_sec": round((pages + rows) / elapsed, 1), "rows_per_sec": round(rows / elapsed, 1),
+        "requests": stub.requests, "injected_errors": stub.errors,
+    }
+
+
+async def bench_recheck(pages: int, changed_ratio: float, workdir: str, conditional: bool = True) -> Dict:
+    """变更检查: 首次爬取后修改 changed_ratio 的详情页, 再以 recheck 模式重新检查全部合同"""
+    stub = StubSite(pages=pages, conditional=conditional)
+    async_main.PRICE_DETAIL_API = await stub.start()
+    state_path = os.path.join(workdir, f"recheck_{conditional}.db")
+    options = dict(max_pages=pages, state_path=state_path, initial_rate=1000.0, max_rate=1000.0,
+                   dead_letter_path=os.path.join(workdir, "dead_letter.jsonl"), retry_dead_letter=False,
+                   stats_interval=3600.0)
+    try:
+        await async_main.main(export_path=os.path.join(workdir, f"recheck_{conditional}_0.csv"), **options)
+        keys = [f"{page}/{index}" for page in range(1, pages + 1) for index in range(1, 21)]
+        stub.changed = set(random.Random(0).sample(keys, int(len(keys) * changed_ratio)))
+        stub.requests = 0
+        start = time.perf_counter()
+        await async_main.main(export_path=os.path.join(workdir, f"recheck_{conditional}_1.csv"), recheck=True,
+                              **options)
+        elapsed = time.perf_counter() - start
+    finally:
+        await stub.close()
+    update_path = os.path.join(workdir, f"recheck_{conditional}_1.csv")
+    rows = 0
+    if os.path.exists(update_path):
+        with open(update_path, encoding="utf-8") as file:
+            rows = sum(1 for _ in file) - 1
+    return {"seconds": round(elapsed, 3), "requests": stub.requests, "not_modified": stub.not_modified,
+            "changed": len(stub.changed), "update_rows": rows}
+
+
+def bench_parse(iterations: int = 200) -> Dict:
+    """每个解析后端 / 版式的单文档解析耗时 (µs), /strict 为 pydantic 严格校验模式"""
+    results = {}
+    for backend in PARSER_BACKENDS:
+        for layout, name in (("new", "detail_new.html"), ("old", "detail_old.html")):
+            html_data = load_fixture(name)
+            for strict in (False, True):
+                parsed_layout, record = parse_contract_layout(html_data, backend, strict)
+                if parsed_layout != layout or record is None:
+                    raise RuntimeError(f"Fixture {name} parsed as {parsed_layout} by {backend}")
+                start = time.perf_counter()
+                for _ in range(iterations):
+                    parse_contract_layout(html_data, backend, strict)
+                key = f"{backend}/{layout}/strict" if strict else f"{backend}/{layout}"
+                results[key] = round((time.perf_counter() - start) / iterations * 1e6, 1)
+    return results
+
+
+async def bench_write(rows: int, workdir: str) -> Dict:
+    """write_csv 的写入吞吐"""
+    _, record = parse_contract_layout(load_fixture("detail_new.html"), "bs4")
+    record.update({"signing_date": "2024-05-06", "contract_title": ""})
+    queue = asyncio.Queue(maxsize=1000)
+    export_path = os.path.join(workdir, "write.csv")
+    start = time.perf_counter()
+    writer_task = asyncio.create_task(async_main.write_csv(export_path, queue))
+    for index in range(rows):
+        row = ContractRecord.from_row(record.row)
+        await queue.put(row.update({"contract_URL": f"{STUB_PATH}/detail/0/{index}.shtml"}))
+    await queue.put(None)
+    await writer_task
+    elapsed = time.perf_counter() - start
+    return {"rows": rows, "seconds": round(elapsed, 3), "rows_per_sec": round(rows / elapsed, 1),
+            "bytes": os.path.getsize(export_path)}
+
+
+def peak_rss_mb() -> float:
+    """当前进程的峰值常驻内存 (Linux 下 ru_maxrss 单位为 KB, macOS 下为字节)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024, 1)
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(FIXTURE_DIR)).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current: Dict, baseline: Dict) -> None:
+    """与之前保存的结果对比, 输出各指标的变化"""
+    metrics = [("crawl.pages_per_sec", True), ("crawl.rows_per_sec", True), ("write.rows_per_sec", True),
+               ("peak_rss_mb", False)]
+    metrics += [(f"parse_us.{key}", False) for key in current["parse_us"]]
+    print(f"compare with {baseline.get('commit')}:")
+    for path, higher_is_better in metrics:
+        old, new = baseline, current
+        for key in path.split("."):
+            old, new = (old or {}).get(key), (new or {}).get(key)
+        if not old or new is None:
+            continue
+        change = (new - old) / old * 100
+        better = change >= 0 if higher_is_better else change <= 0
+        print(f"  {path:<28} {old:>10} -> {new:<10} {change:+6.1f}% {'' if better else '(regression)'}")
+
+
+async def run(args) -> Dict:
+    result = {
+        "commit": git_commit(), "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(), "platform": platform.platform(),
+        "config": {"pages": args.pages, "latency": args.latency, "error_rate": args.error_rate,
+                   "detail_workers": args.detail_workers, "parse_workers": args.parse_workers,
+                   "parser_backend": args.parser_backend, "parse_iterations": args.parse_iterations,
+                   "write_rows": args.write_rows, "max_inflight_bytes": args.max_inflight_bytes},
+    }
+    with tempfile.TemporaryDirectory() as workdir:
+        fixtures = [load_fixture("detail_new.html"), load_fixture("detail_old.html")]
+        result["parity"] = check_parity(fixtures)
+        result["mapper_parity"] = check_mapper(fixtures)
+        result["parse_us"] = bench_parse(args.parse_iterations)
+        result["write"] = await bench_write(args.write_rows, workdir)
+        result["crawl"] = await bench_crawl(args.pages, args.latency, args.error_rate, workdir,
+                                            detail_workers=args.detail_workers, parse_workers=args.parse_workers,
+                                            parser_backend=args.parser_backend,
+                                            max_inflight_bytes=args.max_inflight_bytes)
+        if args.recheck_ratio is not None:
+            result["recheck"] = await bench_recheck(args.pages, args.recheck_ratio, workdir)
+            result["recheck_hash_only"] = await bench_recheck(args.pages, args.recheck_ratio, workdir,
+                                                              conditional=False)
+    result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ccgp_spider offline benchmark")
+    parser.add_argument("--pages", type=int, default=10, help="列表页数量, 每页20个详情页")
+    parser.add_argument("--latency", type=float, default=0.0, help="模拟的平均响应延迟 (秒)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 503 的概率")
+    parser.add_argument("--detail-workers", type=int, default=10)
+    parser.add_argument("--parse-workers", type=int, default=0)
+    parser.add_argument("--parser-backend", default="bs4", choices=list(PARSER_BACKENDS))
+    parser.add_argument("--parse-iterations", type=int, default=200)
+    parser.add_argument("--write-rows", type=int, default=20000)
+    parser.add_argument("--max-inflight-bytes", type=int, help="在途详情页 HTML 字节预算")
+    parser.add_argument("--recheck-ratio", type=float, help="测量变更检查: 首次爬取后修改该比例的详情页再重新检查")
+    parser.add_argument("--output", help="结果JSON路径, 默认 benchmark/results/<commit>.json")
+    parser.add_argument("--compare", help="与之前保存的结果JSON对比")
+    parser.add_argument("--verbose", action="store_true", help="输出爬虫日志 (注入的错误会产生大量重试警告)")
+    args = parser.parse_args()
+
+    if args.verbose:
+        log_set(logging.INFO, use_queue=True)
+    else:
+        logging.disable(logging.WARNING)
+    result = asyncio.run(run(args))
+    logging.disable(logging.NOTSET)
+
+    output = args.output or os.path.join(RESULT_DIR, f"{(result['commit'] or 'unknown')[:12]}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, mode="w", encoding="utf-8") as file:
+        json.dump(result, file, ensure_ascii=False, indent=2)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    print(f"saved to {output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            compare(result, json.load(file))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+import logging
+import unittest
+from pathlib import Path
+
+from tools.parser import check_mapper, check_parity, parse_contract_layout
+
+ROOT = Path(__file__).resolve().parent.parent
+# 按站点原始版式整理的详情页, 以及同一页面逐层缩进 (节点之间为换行+空格) 后的版本
+CORPUS = sorted(ROOT.glob("benchmark/fixtures/detail_*.html")) + sorted(ROOT.glob("tests/fixtures/detail_*.html"))
+
+
+def load_corpus() -> dict:
+    return {path.name: path.read_text(encoding="utf-8") for path in CORPUS}
+
+
+class ParserParityTest(unittest.TestCase):
+    """lxml 后端与 bs4 后端的输出必须一致"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.corpus = load_corpus()
+        # 含 Windows 换行的版本
+        cls.corpus.update({f"{name} (crlf)": html.replace("\n", "\r\n") for name, html in list(cls.corpus.items())})
+
+    def test_corpus_layouts(self):
+        for name, html in self.corpus.items():
+            for backend in ("bs4", "lxml"):
+                with self.subTest(name=name, backend=backend):
+                    layout, record = parse_contract_layout(html, backend)
+                    self.assertIn(layout, ("new", "old"))
+                    self.assertIsNotNone(record)
+                    self.assertTrue(record.get("contract_id"))
+
+    def test_backend_parity(self):
+        names = list(self.corpus)
+        mismatched = check_parity([self.corpus[name] for name in names])
+        self.assertEqual([names[index] for index in mismatched], [])
+
+    def test_mapper_parity(self):
+        names = list(self.corpus)
+        for backend in ("bs4", "lxml"):
+            with self.subTest(backend=backend):
+                mismatched = check_mapper([self.corpus[name] for name in names], backend)
+                self.assertEqual([names[index] for index in mismatched], [])
+
+    def test_indented_file_info(self):
+        # 缩进的 <li class="fileInfo"> 中, 文件名取自 <span> 而不是换行
+        for name in ("detail_new_indented.html", "detail_old_indented.html"):
+            with self.subTest(name=name):
+                results = [parse_contract_layout(self.corpus[name], backend)[1] for backend in ("bs4", "lxml")]
+                self.assertEqual(results[0], results[1])
+                self.assertTrue(results[1].get("attachment_filename"))
+                self.assertTrue(results[1].get("winning_bid_filename"))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.ERROR)
+    unittest.main()
@@ -0,0 +1,85 @@
+import asyncio
+import logging
+import os
+import tempfile
+import unittest
+
+from aiohttp import ClientResponseError
+
+import async_main
+from benchmark.bench import StubSite
+from tools.fetcher import Fetcher
+from tools.retry import DeadLetter, RetryPolicy
+from tools.sink import read_records
+from tools.state import CrawlState
+
+
+class PipelineTest(unittest.IsolatedAsyncioTestCase):
+    """使用本地模拟站点 (benchmark.bench.StubSite) 运行完整流水线"""
+
+    async def asyncSetUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.stub = StubSite(pages=3)
+        self.api = async_main.PRICE_DETAIL_API
+        async_main.PRICE_DETAIL_API = await self.stub.start()
+
+    async def asyncTearDown(self):
+        async_main.PRICE_DETAIL_API = self.api
+        await self.stub.close()
+        self.workdir.cleanup()
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.workdir.name, name)
+
+    async def crawl(self, **kwargs):
+        options = dict(max_pages=self.stub.pages, initial_rate=1000.0, max_rate=1000.0,
+                       detail_retry=RetryPolicy(max_attempts=2, base_delay=0.01),
+                       dead_letter_path=self.path("dead_letter.jsonl"), stats_interval=3600.0)
+        options.update(kwargs)
+        # 流水线卡住时测试失败而不是一直等待
+        return await asyncio.wait_for(async_main.main(**options), timeout=60)
+
+    async def test_writer_failure_stops_pipeline(self):
+        # 写入端第一次写入即失败, 写入队列很快被占满; 流水线应立即停止并抛出写入端的异常
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        with self.assertRaises(FileNotFoundError):
+            await self.crawl(export_path=self.path("missing/ccgp.csv"), queue_size=2, write_batch_size=1)
+        self.assertLess(loop.time() - start, 30)
+
+    async def test_dead_letter_details_not_duplicated(self):
+        # 上次运行失败的详情页 (同一合同失败了两次), 重新运行 (未启用 state) 时它们同时出现在第 1 页列表中
+        async with Fetcher() as fetcher:
+            base_lst = await async_main.fetch_listing(fetcher, 1)
+        dead_letter = DeadLetter(self.path("dead_letter.jsonl"))
+        for base_data in (base_lst[0], base_lst[0], base_lst[1]):
+            dead_letter.add("detail", base_data, RuntimeError("503"))
+
+        export_path = self.path("ccgp.csv")
+        await self.crawl(export_path=export_path)
+        urls = [record["contract_URL"] for record in read_records(export_path)]
+        self.assertEqual(len(urls), self.stub.pages * 20)
+        self.assertEqual(len(set(urls)), len(urls))
+        self.assertFalse(os.path.exists(dead_letter.path))
+        self.assertFalse(os.path.exists(dead_letter.retry_path))
+
+    async def test_discover_failure_keeps_run_unfinished(self):
+        # 第 1 页始终失败时无法得知总页数: 抛出异常, 本次运行不记为完成, 上次的 dead letter 保留
+        dead_letter = DeadLetter(self.path("dead_letter.jsonl"))
+        dead_letter.add("listing", 2, RuntimeError("503"))
+        self.stub.error_rate = 1.0
+        state_path = self.path("state.db")
+        with self.assertRaises(ClientResponseError):
+            await self.crawl(export_path=self.path("ccgp.csv"), max_pages=None, state_path=state_path,
+                             listing_retry=RetryPolicy(max_attempts=2, base_delay=0.01, retry_all_errors=True))
+        state = CrawlState(state_path)
+        try:
+            self.assertEqual(state.conn.execute("SELECT finished_at FROM runs").fetchall(), [(None,)])
+        finally:
+            state.close()
+        self.assertTrue(os.path.exists(dead_letter.retry_path))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.ERROR)
+    unittest.main()
@@ -0,0 +1,208 @@
+import asyncio
+import logging
+import random
+import time
+import unittest
+from datetime import datetime
+from typing import List, Optional
+
+from aiohttp import ClientResponseError, web
+
+from tools.IP_proxy import ProxyPool
+from tools.fetcher import Fetcher
+
+HOST = "127.0.0.1"
+
+
+def expire_time(seconds: float) -> str:
+    """seconds 秒后过期, 格式与代理商接口一致"""
+    return datetime.fromtimestamp(time.time() + seconds).strftime("%Y-%m-%d %H:%M:%S")
+
+
+class StubApp:
+    """本地 aiohttp 服务, 所有路径都由 handle 处理"""
+
+    def __init__(self):
+        self.port: Optional[int] = None
+        self.requests = 0
+        self._runner = None
+
+    async def handle(self, request: web.Request) -> web.Response:
+        raise NotImplementedError
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        return await self.handle(request)
+
+    async def start(self) -> str:
+        app = web.Application()
+        app.router.add_route("*", "/{tail:.*}", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, HOST, 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return f"http://{HOST}:{self.port}"
+
+    async def close(self) -> None:
+        await self._runner.cleanup()
+
+
+class MockProvider(StubApp):
+    """代理商接口: 依次返回 batches 中的一批代理, 用完后重复最后一批"""
+
+    def __init__(self, batches: List[List[dict]]):
+        super().__init__()
+        self.batches = batches
+
+    async def handle(self, request: web.Request) -> web.Response:
+        batch = self.batches[min(self.requests, len(self.batches)) - 1]
+        return web.json_response({"code": 0, "success": True, "data": batch})
+
+
+class MockProxy(StubApp):
+    """
+    模拟 HTTP 代理: aiohttp 通过代理请求 http:// 地址时发送完整 URL, 这里直接充当目标站点作答;
+    status 为返回的状态码, delay 为响应延迟
+    """
+
+    def __init__(self, status: int = 200, delay: float = 0.0):
+        super().__init__()
+        self.status = status
+        self.delay = delay
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        return web.Response(status=self.status, text="ok")
+
+
+class ProxyPoolTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.apps: List[StubApp] = []
+
+    async def asyncTearDown(self):
+        for app in self.apps:
+            await app.close()
+
+    async def serve(self, app: StubApp) -> str:
+        self.apps.append(app)
+        return await app.start()
+
+    async def new_pool(self, batches: List[List[dict]], **kwargs) -> ProxyPool:
+        provider_url = await self.serve(MockProvider(batches))
+        options = dict(min_size=1, check_interval=3600.0, min_refill_interval=0.0)
+        options.update(kwargs)
+        pool = ProxyPool(provider_url, **options)
+        self.addAsyncCleanup(pool.close)
+        return pool
+
+    @staticmethod
+    def item(port: int, expire_in: Optional[float] = 3600.0) -> dict:
+        return {"ip": HOST, "port": port, "expire_time": expire_time(expire_in) if expire_in is not None else None}
+
+    async def test_refill_before_expire_time(self):
+        # 第一个代理 20 秒后过期, 已在 refill_margin (30 秒) 内, 后台任务提前补充
+        pool = await self.new_pool([[self.item(10001, 20)], [self.item(10002, 3600)]], refill_margin=30.0)
+        await pool.start()
+        self.assertEqual(list(pool.proxies), [f"http://{HOST}:10001"])
+        await asyncio.sleep(0.2)
+        self.assertEqual(sorted(pool.proxies), [f"http://{HOST}:10001", f"http://{HOST}:10002"])
+        # 即将过期的代理在真正过期前仍可使用
+        self.assertFalse(pool.proxies[f"http://{HOST}:10001"].expired(time.time()))
+
+    async def test_expired_proxy_evicted(self):
+        pool = await self.new_pool([[self.item(10001, -10), self.item(10002)]])
+        await pool.start()
+        self.assertEqual(await pool.acquire(), f"http://{HOST}:10002")
+        pool.evict()
+        self.assertEqual(list(pool.proxies), [f"http://{HOST}:10002"])
+
+    async def test_empty_pool_refills_on_acquire(self):
+        pool = await self.new_pool([[self.item(10001)]])
+        self.assertEqual(len(pool), 0)
+        await pool.start()
+        pool.proxies.clear()
+        self.assertEqual(await pool.acquire(), f"http://{HOST}:10001")
+
+    async def test_scoring(self):
+        pool = await self.new_pool([[self.item(10001), self.item(10002)]])
+        await pool.start()
+        fast, slow = f"http://{HOST}:10001", f"http://{HOST}:10002"
+        pool.report(fast, ok=True, latency=0.2)
+        pool.report(slow, ok=True, latency=0.5)
+        # 两个代理时总是比较两者, 选延迟低的
+        self.assertEqual({await pool.acquire() for _ in range(10)}, {fast})
+        # 错误率计入分数: 0.2 * (1 + 4 * 0.5) > 0.5 * (1 + 4 * 0)
+        pool.report(fast, ok=False)
+        self.assertAlmostEqual(pool.proxies[fast].score, 0.6)
+        self.assertEqual({await pool.acquire() for _ in range(10)}, {slow})
+
+    async def test_rotation(self):
+        random.seed(0)
+        ports = (10001, 10002, 10003)
+        pool = await self.new_pool([[self.item(port) for port in ports]])
+        await pool.start()
+        for port, latency in zip(ports, (0.1, 0.2, 0.3)):
+            pool.report(f"http://{HOST}:{port}", ok=True, latency=latency)
+        chosen = [await pool.acquire() for _ in range(100)]
+        # 每次从两个随机代理中选较好的一个: 负载分散到前两个代理, 最差的代理不会被选中
+        self.assertIn(f"http://{HOST}:10001", chosen)
+        self.assertIn(f"http://{HOST}:10002", chosen)
+        self.assertNotIn(f"http://{HOST}:10003", chosen)
+
+    async def test_evict_after_consecutive_failures(self):
+        pool = await self.new_pool([[self.item(10001), self.item(10002)]], max_failures=3)
+        await pool.start()
+        proxy = f"http://{HOST}:10001"
+        pool.report(proxy, ok=False)
+        pool.report(proxy, ok=False)
+        # 成功一次后重新计数
+        pool.report(proxy, ok=True, latency=0.1)
+        pool.report(proxy, ok=False)
+        pool.report(proxy, ok=False)
+        self.assertIn(proxy, pool.proxies)
+        pool.report(proxy, ok=False)
+        self.assertNotIn(proxy, pool.proxies)
+        self.assertIn(f"http://{HOST}:10002", pool.proxies)
+
+    async def test_health_check(self):
+        good, bad = MockProxy(200), MockProxy(407)
+        await self.serve(good)
+        await self.serve(bad)
+        pool = await self.new_pool([[self.item(good.port), self.item(bad.port)]], check_url="http://target.test/check",
+                                   max_failures=1)
+        await pool.start()
+        await pool.health_check()
+        self.assertEqual(list(pool.proxies), [f"http://{HOST}:{good.port}"])
+        self.assertIsNotNone(pool.proxies[f"http://{HOST}:{good.port}"].latency_ewma)
+        self.assertEqual((good.requests, bad.requests), (1, 1))
+
+    async def test_fetcher_reports(self):
+        good, rejecting = MockProxy(200, delay=0.05), MockProxy(407)
+        await self.serve(good)
+        await self.serve(rejecting)
+        pool = await self.new_pool([[self.item(good.port)], [self.item(rejecting.port)]], max_failures=2)
+        await pool.start()
+        good_url = f"http://{HOST}:{good.port}"
+        async with Fetcher(proxy_pool=pool) as fetcher:
+            self.assertEqual(await fetcher.get_text("http://target.test/a"), "ok")
+            stats = pool.proxies[good_url]
+            self.assertEqual((stats.successes, stats.failures), (1, 0))
+            self.assertGreaterEqual(stats.latency_ewma, 0.05)
+
+            # 只剩返回 407 的代理: 每次失败都回报给代理池, 连续失败 max_failures 次后剔除
+            del pool.proxies[good_url]
+            await pool.refill()
+            rejecting_url = f"http://{HOST}:{rejecting.port}"
+            for _ in range(2):
+                with self.assertRaises(ClientResponseError):
+                    await fetcher.get_text("http://target.test/b")
+            self.assertNotIn(rejecting_url, pool.proxies)
+            self.assertEqual(rejecting.requests, 2)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.ERROR)
+    unittest.main()
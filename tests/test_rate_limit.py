@@ -0,0 +1,200 @@
+import asyncio
+import logging
+import unittest
+from typing import List
+
+from aiohttp import ClientResponseError, web
+
+from tools.fetcher import Fetcher
+from tools.rate_limit import AIMDRateController
+
+HOST = "127.0.0.1"
+
+
+class FakeClock:
+    """手动推进的时钟, 用于测试冷却时间"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class StubServer:
+    """/status/{code} 返回指定状态码, /slow 超过客户端超时才返回, /order/{name} 按到达顺序记录请求"""
+
+    def __init__(self):
+        self.arrivals: List[str] = []
+        self._runner = None
+
+    async def _status(self, request: web.Request) -> web.Response:
+        return web.Response(status=int(request.match_info["code"]), text="ok")
+
+    async def _slow(self, request: web.Request) -> web.Response:
+        await asyncio.sleep(1)
+        return web.Response(text="ok")
+
+    async def _order(self, request: web.Request) -> web.Response:
+        self.arrivals.append(request.match_info["name"])
+        return web.Response(text="ok")
+
+    async def start(self) -> str:
+        app = web.Application()
+        app.router.add_get("/status/{code:\\d+}", self._status)
+        app.router.add_get("/slow", self._slow)
+        app.router.add_get("/order/{name}", self._order)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, HOST, 0)
+        await site.start()
+        return f"http://{HOST}:{site._server.sockets[0].getsockname()[1]}"
+
+    async def close(self) -> None:
+        await self._runner.cleanup()
+
+
+class AIMDRateControllerTest(unittest.TestCase):
+    """直接调用 record 的速率调整规则"""
+
+    def test_additive_increase_capped_at_max_rate(self):
+        controller = AIMDRateController(initial_rate=1.0, max_rate=5.0, increase=1.0)
+        controller.record(HOST, 200, 0.1)
+        self.assertAlmostEqual(controller.rate(HOST), 2.0)
+        for _ in range(100):
+            controller.record(HOST, 200, 0.1)
+        self.assertEqual(controller.rate(HOST), 5.0)
+
+    def test_not_modified_counts_as_success(self):
+        controller = AIMDRateController(initial_rate=1.0, increase=1.0)
+        controller.record(HOST, 304, 0.1)
+        self.assertAlmostEqual(controller.rate(HOST), 2.0)
+
+    def test_multiplicative_decrease(self):
+        for status, timeout in ((429, False), (500, False), (503, False), (None, False), (None, True)):
+            with self.subTest(status=status, timeout=timeout):
+                controller = AIMDRateController(initial_rate=8.0, decrease_factor=0.5, cooldown=0.0)
+                controller.record(HOST, status, 0.1, timeout=timeout)
+                self.assertAlmostEqual(controller.rate(HOST), 4.0)
+
+    def test_client_error_keeps_rate(self):
+        controller = AIMDRateController(initial_rate=8.0)
+        controller.record(HOST, 404, 0.1)
+        self.assertEqual(controller.rate(HOST), 8.0)
+
+    def test_decrease_capped_at_min_rate(self):
+        controller = AIMDRateController(initial_rate=8.0, min_rate=0.5, cooldown=0.0)
+        for _ in range(20):
+            controller.record(HOST, 503, 0.1)
+        self.assertEqual(controller.rate(HOST), 0.5)
+
+    def test_cooldown(self):
+        clock = FakeClock()
+        controller = AIMDRateController(initial_rate=8.0, cooldown=1.0, clock=clock)
+        clock.now = 10.0
+        controller.record(HOST, 503, 0.1)
+        controller.record(HOST, 503, 0.1)
+        # 冷却时间内只降低一次
+        self.assertAlmostEqual(controller.rate(HOST), 4.0)
+        clock.now = 11.5
+        controller.record(HOST, 503, 0.1)
+        self.assertAlmostEqual(controller.rate(HOST), 2.0)
+
+    def test_latency_spike(self):
+        controller = AIMDRateController(initial_rate=8.0, increase=0.0, latency_spike_ratio=3.0, latency_floor=1.0,
+                                        cooldown=0.0)
+        controller.record(HOST, 200, 0.5)
+        controller.record(HOST, 200, 5.0)
+        self.assertAlmostEqual(controller.rate(HOST), 4.0)
+
+    def test_hosts_are_independent(self):
+        controller = AIMDRateController(initial_rate=8.0, cooldown=0.0)
+        controller.record("a.example", 503, 0.1)
+        self.assertAlmostEqual(controller.rate("a.example"), 4.0)
+        self.assertEqual(controller.rate("b.example"), 8.0)
+
+    def test_proxies_have_separate_rates(self):
+        controller = AIMDRateController(initial_rate=8.0, cooldown=0.0)
+        controller.record(HOST, 503, 0.1, proxy="http://proxy-a:8000")
+        self.assertAlmostEqual(controller.rate(HOST, proxy="http://proxy-a:8000"), 4.0)
+        self.assertEqual(controller.rate(HOST, proxy="http://proxy-b:8000"), 8.0)
+        self.assertEqual(controller.rate(HOST), 8.0)
+
+
+class PriorityAcrossProxiesTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_priority_is_per_host(self):
+        # 代理 b 的令牌已用完, 列表页请求在等待; 代理 a 还有令牌, 但同一 host 的详情页请求要让列表页先走
+        controller = AIMDRateController(initial_rate=10.0, max_rate=10.0, burst=1.0)
+        await controller.acquire(HOST, 0, proxy="http://proxy-b:8000")
+        listing = asyncio.create_task(controller.acquire(HOST, 0, proxy="http://proxy-b:8000"))
+        await asyncio.sleep(0)
+        detail = asyncio.create_task(controller.acquire(HOST, 1, proxy="http://proxy-a:8000"))
+        await asyncio.sleep(0.05)
+        self.assertFalse(listing.done())
+        self.assertFalse(detail.done())
+        await asyncio.wait_for(asyncio.gather(listing, detail), timeout=5)
+        # 其他 host 不受影响
+        await asyncio.wait_for(controller.acquire("other.example", 1, proxy="http://proxy-a:8000"), timeout=0.01)
+
+
+class FetcherRateLimitTest(unittest.IsolatedAsyncioTestCase):
+    """通过 Fetcher 请求本地 aiohttp 服务, 响应状态/超时回报给限速器"""
+
+    async def asyncSetUp(self):
+        self.server = StubServer()
+        self.base_url = await self.server.start()
+
+    async def asyncTearDown(self):
+        await self.server.close()
+
+    async def test_ramp_up(self):
+        controller = AIMDRateController(initial_rate=50.0, max_rate=60.0, increase=10.0)
+        async with Fetcher(rate_controller=controller) as fetcher:
+            for _ in range(20):
+                await fetcher.get_text(f"{self.base_url}/status/200")
+        self.assertGreater(controller.rate(HOST), 50.0)
+        self.assertLessEqual(controller.rate(HOST), 60.0)
+
+    async def test_backoff_on_error_status(self):
+        for status in (429, 500, 503):
+            with self.subTest(status=status):
+                controller = AIMDRateController(initial_rate=50.0, decrease_factor=0.5, cooldown=0.0)
+                async with Fetcher(rate_controller=controller) as fetcher:
+                    with self.assertRaises(ClientResponseError):
+                        await fetcher.get_text(f"{self.base_url}/status/{status}")
+                self.assertAlmostEqual(controller.rate(HOST), 25.0)
+
+    async def test_backoff_on_timeout(self):
+        controller = AIMDRateController(initial_rate=50.0, decrease_factor=0.5, cooldown=0.0)
+        async with Fetcher(rate_controller=controller, total_timeout=0.2) as fetcher:
+            with self.assertRaises(asyncio.TimeoutError):
+                await fetcher.get_text(f"{self.base_url}/slow")
+        self.assertAlmostEqual(controller.rate(HOST), 25.0)
+
+    async def test_min_rate(self):
+        controller = AIMDRateController(initial_rate=50.0, min_rate=10.0, cooldown=0.0)
+        async with Fetcher(rate_controller=controller) as fetcher:
+            for _ in range(5):
+                with self.assertRaises(ClientResponseError):
+                    await fetcher.get_text(f"{self.base_url}/status/503")
+        self.assertEqual(controller.rate(HOST), 10.0)
+
+    async def test_priority_ordering(self):
+        # 速率固定, 令牌依次发放: 第一个详情页请求取走初始令牌, 之后等待中的列表页请求 (priority 0) 先于详情页
+        controller = AIMDRateController(initial_rate=20.0, max_rate=20.0, burst=1.0)
+        async with Fetcher(rate_controller=controller) as fetcher:
+            tasks = [asyncio.create_task(fetcher.get_text(f"{self.base_url}/order/detail{index}", priority=1))
+                     for index in range(3)]
+            await asyncio.sleep(0)
+            tasks += [asyncio.create_task(fetcher.get_text(f"{self.base_url}/order/listing{index}", priority=0))
+                      for index in range(3)]
+            await asyncio.gather(*tasks)
+        self.assertEqual(self.server.arrivals[0], "detail0")
+        self.assertEqual(sorted(self.server.arrivals[1:4]), ["listing0", "listing1", "listing2"])
+        self.assertEqual(sorted(self.server.arrivals[4:]), ["detail1", "detail2"])
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.ERROR)
+    unittest.main()
@@ -2,9 +2,15 @@
 IP池: https://www.zmhttp.com/users_getapi/
 """
 
-from typing import Optional, List
+import asyncio
+import logging
+import random
+import time
+from datetime import datetime
+from typing import Dict, Optional, List
 
 import requests
+from aiohttp import ClientSession, ClientTimeout
 from pydantic import BaseModel, Field
 
 
@@ -39,5 +45,190 @@ def get_proxy(url: str) -> str:
     response.raise_for_status()
     response = LetecsProxysResponse(**response.json())
     if response.success:
-        print(len(response.data))
+        logging.debug("Proxies returned: %d", len(response.data))
         return f"http://{response.data[0].ip}:{response.data[0].port}"
+
+
+class ProxyStats:
+    """单个代理的健康状态"""
+
+    def __init__(self, url: str, expire_at: Optional[float] = None):
+        self.url = url
+        self.expire_at = expire_at
+        self.latency_ewma: Optional[float] = None
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+
+    @property
+    def error_rate(self) -> float:
+        total = self.successes + self.failures
+        return self.failures / total if total else 0.0
+
+    @property
+    def score(self) -> float:
+        """越小越好: 平均延迟 * (1 + 4 * 错误率), 未测量的代理按 1 秒计"""
+        latency = self.latency_ewma if self.latency_ewma is not None else 1.0
+        return latency * (1 + 4 * self.error_rate)
+
+    def expired(self, now: float, margin: float = 0.0) -> bool:
+        return self.expire_at is not None and now + margin >= self.expire_at
+
+
+def parse_expire_time(expire_time: Optional[str], time_format: str = "%Y-%m-%d %H:%M:%S") -> Optional[float]:
+    """过期时间字符串 -> 时间戳, 无法解析时视为不过期"""
+    if not expire_time:
+        return None
+    try:
+        return datetime.strptime(expire_time, time_format).timestamp()
+    except ValueError:
+        logging.warning(f"Unknown proxy expire_time format: {expire_time}")
+        return None
+
+
+class ProxyPool:
+    """
+    异步代理池
+
+    - 后台任务在池大小低于 min_size 或代理即将过期 (refill_margin 秒内) 时从 provider_url 补充代理
+    - 定期通过 check_url 做健康检查, 按延迟与错误率打分; 每次请求在两个随机代理中选分数更好的一个
+    - 过期或连续失败 max_failures 次的代理会被剔除
+    """
+
+    def __init__(self, provider_url: str, check_url: str = "http://htgs.ccgp.gov.cn/GS8/contractpublish/index",
+                 min_size: int = 5, refill_margin: float = 30.0, check_interval: float = 30.0,
+                 check_timeout: float = 10.0, max_failures: int = 3, ewma_alpha: float = 0.3,
+                 min_refill_interval: float = 5.0):
+        self.provider_url = provider_url
+        self.check_url = check_url
+        self.min_size = min_size
+        self.refill_margin = refill_margin
+        self.check_interval = check_interval
+        self.check_timeout = check_timeout
+        self.max_failures = max_failures
+        self.ewma_alpha = ewma_alpha
+        # 两次请求代理商接口的最小间隔, 避免池为空时频繁请求
+        self.min_refill_interval = min_refill_interval
+        self._last_refill: Optional[float] = None
+        self.proxies: Dict[str, ProxyStats] = {}
+        self._session: Optional[ClientSession] = None
+        self._refill_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    async def __aenter__(self) -> "ProxyPool":
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def start(self) -> None:
+        self._session = ClientSession(trust_env=False, timeout=ClientTimeout(total=self.check_timeout))
+        await self.refill()
+        self._task = asyncio.create_task(self._maintain())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def __len__(self) -> int:
+        return len(self.proxies)
+
+    async def refill(self) -> int:
+        """从代理商接口补充代理, 返回新增数量"""
+        async with self._refill_lock:
+            if self._last_refill is not None and time.monotonic() - self._last_refill < self.min_refill_interval:
+                return 0
+            self._last_refill = time.monotonic()
+            try:
+                async with self._session.get(self.provider_url) as response:
+                    response.raise_for_status()
+                    result = LetecsProxysResponse(**await response.json(content_type=None))
+            except Exception as e:
+                logging.warning(f"Failed to refill proxy pool: {e!r}")
+                return 0
+            if not result.success and result.code != 0:
+                logging.warning(f"Proxy provider error, code: {result.code}, msg: {result.msg}")
+                return 0
+            added = 0
+            for item in result.data:
+                url = f"http://{item.ip}:{item.port}"
+                if url not in self.proxies:
+                    self.proxies[url] = ProxyStats(url, parse_expire_time(item.expire_time))
+                    added += 1
+            logging.info(f"Proxy pool refilled, added: {added}, size: {len(self.proxies)}")
+            return added
+
+    def evict(self, now: Optional[float] = None) -> None:
+        """剔除过期或连续失败的代理"""
+        now = time.time() if now is None else now
+        for url, stats in list(self.proxies.items()):
+            if stats.expired(now) or stats.consecutive_failures >= self.max_failures:
+                logging.debug("Evict proxy: %s, failures: %d", url, stats.consecutive_failures)
+                del self.proxies[url]
+
+    def _needs_refill(self, now: float) -> bool:
+        alive = [stats for stats in self.proxies.values() if not stats.expired(now, self.refill_margin)]
+        return len(alive) < self.min_size
+
+    async def acquire(self) -> Optional[str]:
+        """选择一个代理, 池为空且补充失败时返回None (直连)"""
+        now = time.time()
+        candidates = [stats for stats in self.proxies.values() if not stats.expired(now)]
+        if not candidates:
+            await self.refill()
+            candidates = [stats for stats in self.proxies.values() if not stats.expired(now)]
+            if not candidates:
+                return None
+        # power of two choices
+        return min(random.sample(candidates, min(2, len(candidates))), key=lambda stats: stats.score).url
+
+    def report(self, proxy: str, ok: bool, latency: Optional[float] = None) -> None:
+        """记录一次使用结果"""
+        stats = self.proxies.get(proxy)
+        if stats is None:
+            return
+        if ok:
+            stats.successes += 1
+            stats.consecutive_failures = 0
+            if latency is not None:
+                stats.latency_ewma = latency if stats.latency_ewma is None else \
+                    self.ewma_alpha * latency + (1 - self.ewma_alpha) * stats.latency_ewma
+        else:
+            stats.failures += 1
+            stats.consecutive_failures += 1
+            if stats.consecutive_failures >= self.max_failures:
+                self.evict()
+
+    async def _check(self, stats: ProxyStats) -> None:
+        start = time.monotonic()
+        try:
+            async with self._session.get(self.check_url, proxy=stats.url) as response:
+                await response.read()
+                ok = response.status < 400
+        except Exception:
+            ok = False
+        self.report(stats.url, ok, time.monotonic() - start)
+
+    async def health_check(self) -> None:
+        await asyncio.gather(*(self._check(stats) for stats in list(self.proxies.values())))
+        self.evict()
+
+    async def _maintain(self) -> None:
+        last_check = time.monotonic()
+        while True:
+            self.evict()
+            if self._needs_refill(time.time()):
+                await self.refill()
+            if time.monotonic() - last_check >= self.check_interval:
+                await self.health_check()
+                last_check = time.monotonic()
+            await asyncio.sleep(1.0)
@@ -0,0 +1,246 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import time
+from typing import Dict, List, Optional, Set
+from urllib.parse import parse_qs, urlparse
+
+from aiohttp import ClientPayloadError, ClientSession, ClientTimeout, TCPConnector
+
+from tools.metrics import metrics
+from tools.parser import DOWNLOAD_API
+from tools.retry import DeadLetter, RetryPolicy, with_retry
+from tools.tools import headers_list
+
+# (类型, 链接字段, 文件名字段)
+LINK_FIELDS = (("attachment", "attachment_link", "attachment_filename"),
+               ("winning_bid", "winning_bid_link", "winning_bid_filename"))
+
+_UUID_RE = re.compile(r"^[0-9A-Za-z_-]+$")
+_CONTENT_RANGE_RE = re.compile(r"bytes\s+\d+-\d+/(\d+)")
+
+
+def oss_uuid(url: Optional[str]) -> Optional[str]:
+    """download.ccgp.gov.cn/oss/download?uuid=... 中的 uuid, 其他链接 (如旧版的中标公告页面) 返回None"""
+    if not url or not url.startswith(DOWNLOAD_API):
+        return None
+    uuid = parse_qs(urlparse(url).query).get("uuid", [None])[0]
+    return uuid if uuid and _UUID_RE.match(uuid) else None
+
+
+def _hash_file(path: str, chunk_size: int = 1024 * 1024):
+    """续传时先计算已下载部分的哈希"""
+    hasher = hashlib.sha256()
+    with open(path, mode="rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            hasher.update(chunk)
+    return hasher
+
+
+class AttachmentDownloader:
+    """
+    合同附件下载: 流式分块写入磁盘, 不在内存中保存整个文件
+
+    - 按 OSS uuid 去重, manifest (JSON lines) 中已有且文件存在的附件不再下载
+    - 未完成的下载保存为 .part, 重试或下次运行时用 Range 请求续传
+    - 使用独立的连接池与 worker 数量, 不占用列表页/详情页的连接与限速
+    - manifest 每行: uuid / url / path / size / sha256 / filename / kind / contract_URL / content_type / downloaded_at
+    """
+
+    def __init__(self, root: str = "ccgp_attachments", workers: int = 4, queue_size: int = 1000,
+                 chunk_size: int = 256 * 1024, manifest_path: Optional[str] = None,
+                 retry: Optional[RetryPolicy] = None, dead_letter: Optional[DeadLetter] = None,
+                 connect_timeout: float = 10.0, read_timeout: float = 60.0, trust_env: bool = False):
+        self.root = root
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.manifest_path = manifest_path or os.path.join(root, "manifest.jsonl")
+        self.retry = retry or RetryPolicy(max_attempts=5, base_delay=2.0)
+        self.dead_letter = dead_letter
+        # 大文件下载时间不可预估, 不设置总超时, 只限制连接与两次读取之间的间隔
+        self.timeout = ClientTimeout(total=None, sock_connect=connect_timeout, sock_read=read_timeout)
+        self.trust_env = trust_env
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.manifest: Dict[str, dict] = {}
+        self._queued: Set[str] = set()
+        self._session: Optional[ClientSession] = None
+        self._manifest_file = None
+        self._tasks: List[asyncio.Task] = []
+
+    def _load_manifest(self) -> None:
+        if not os.path.exists(self.manifest_path):
+            return
+        with open(self.manifest_path, encoding="utf-8") as file:
+            for line in file:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if os.path.exists(os.path.join(self.root, entry["path"])):
+                    self.manifest[entry["uuid"]] = entry
+
+    async def start(self) -> None:
+        os.makedirs(self.root, exist_ok=True)
+        self._load_manifest()
+        self._manifest_file = open(self.manifest_path, mode="a", encoding="utf-8")
+        self._session = ClientSession(connector=TCPConnector(limit=self.workers, ttl_dns_cache=300),
+                                      timeout=self.timeout, trust_env=self.trust_env,
+                                      # 续传依赖字节偏移, 不接受压缩传输
+                                      headers={"Accept-Encoding": "identity"})
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logging.info(f"Attachment downloader started, dir: {self.root}, known files: {len(self.manifest)}")
+
+    async def close(self, drain: bool = True) -> None:
+        """
+        关闭下载器: drain 时等待队列中的附件下载完成; 否则 (出错或被取消时) 立即取消 worker,
+        正在下载及队列中剩余的附件写入 dead letter, 下次运行时续传
+        """
+        if drain:
+            for _ in self._tasks:
+                await self.queue.put(None)
+            await asyncio.gather(*self._tasks)
+        else:
+            for task in self._tasks:
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            while not self.queue.empty():
+                item = self.queue.get_nowait()
+                self.queue.task_done()
+                if item is not None:
+                    self._queued.discard(item["uuid"])
+                    if self.dead_letter is not None:
+                        self.dead_letter.add("attachment", item, asyncio.CancelledError())
+        self._tasks = []
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+        if self._manifest_file is not None:
+            self._manifest_file.close()
+            self._manifest_file = None
+
+    async def submit(self, record: dict) -> None:
+        """提交一条合同记录中的附件链接, 队列满时等待"""
+        for kind, link_field, name_field in LINK_FIELDS:
+            uuid = oss_uuid(record.get(link_field))
+            if uuid is None:
+                continue
+            await self.put({"uuid": uuid, "url": record[link_field], "filename": record.get(name_field),
+                            "kind": kind, "contract_URL": record.get("contract_URL")})
+
+    async def put(self, item: dict) -> None:
+        """加入下载队列, 已下载或已在队列中的 uuid 跳过"""
+        if item["uuid"] in self.manifest or item["uuid"] in self._queued:
+            metrics.inc("attachments_total", status="skipped")
+            return
+        self._queued.add(item["uuid"])
+        await self.queue.put(item)
+
+    def path_for(self, item: dict) -> str:
+        """相对 root 的保存路径: uuid 前两位分目录, 扩展名取自文件名"""
+        ext = os.path.splitext(item.get("filename") or "")[1].lower()
+        if not re.fullmatch(r"\.[0-9a-z]{1,8}", ext):
+            ext = ""
+        return os.path.join(item["uuid"][:2], f"{item['uuid']}{ext}")
+
+    async def _worker(self) -> None:
+        while True:
+            item = await self.queue.get()
+            try:
+                if item is None:
+                    break
+                try:
+                    await with_retry(self._download, item, policy=self.retry,
+                                     desc=f"Download attachment {item['uuid']}")
+                    metrics.inc("attachments_total", status="downloaded")
+                except asyncio.CancelledError as e:
+                    # close(drain=False): 已下载的部分保留为 .part
+                    if self.dead_letter is not None:
+                        self.dead_letter.add("attachment", item, e)
+                    raise
+                except Exception as e:
+                    logging.error(f"Failed to download attachment {item['url']}, error: {e!r}")
+                    metrics.inc("attachments_total", status="failed")
+                    if self.dead_letter is not None:
+                        self.dead_letter.add("attachment", item, e)
+                finally:
+                    self._queued.discard(item["uuid"])
+            finally:
+                self.queue.task_done()
+
+    async def _download(self, item: dict) -> dict:
+        relative_path = self.path_for(item)
+        path = os.path.join(self.root, relative_path)
+        part_path = f"{path}.part"
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+
+        headers = dict(random.choice(headers_list))
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+        async with self._session.get(item["url"], headers=headers) as response:
+            content_type = response.content_type
+            if response.status == 416 and offset:
+                # 上次已下载完整, 只差改名
+                hasher = await asyncio.to_thread(_hash_file, part_path)
+            else:
+                response.raise_for_status()
+                if response.status == 206:
+                    match = _CONTENT_RANGE_RE.match(response.headers.get("Content-Range", ""))
+                    expected = int(match.group(1)) if match else None
+                else:
+                    # 服务器忽略了 Range, 从头下载
+                    offset = 0
+                    expected = response.content_length
+                if offset:
+                    logging.debug("Resume attachment %s from %d bytes", item["uuid"], offset)
+                    hasher = await asyncio.to_thread(_hash_file, part_path)
+                else:
+                    hasher = hashlib.sha256()
+                with open(part_path, mode="ab" if offset else "wb") as file:
+                    async for chunk in response.content.iter_chunked(self.chunk_size):
+                        hasher.update(chunk)
+                        await asyncio.to_thread(file.write, chunk)
+                        metrics.inc("attachment_bytes_total", len(chunk))
+                size = os.path.getsize(part_path)
+                if expected is not None and size != expected:
+                    # 保留 .part, 重试时续传
+                    raise ClientPayloadError(f"Incomplete attachment {item['uuid']}: {size}/{expected} bytes")
+
+        os.replace(part_path, path)
+        entry = {**item, "path": relative_path, "size": os.path.getsize(path), "sha256": hasher.hexdigest(),
+                 "content_type": content_type, "downloaded_at": time.time()}
+        self._manifest_file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._manifest_file.flush()
+        self.manifest[item["uuid"]] = entry
+        logging.info("Attachment downloaded: %s, size: %d", relative_path, entry["size"])
+        return entry
+
+
+async def download_from_output(inputs: List[str], root: str = "ccgp_attachments", workers: int = 4) -> int:
+    """从已有的输出文件 (csv / parquet / sqlite, 含分片) 中读取附件链接并下载, 返回新下载的数量"""
+    from tools.sink import output_files, read_records
+
+    downloader = AttachmentDownloader(root, workers=workers)
+    await downloader.start()
+    known = len(downloader.manifest)
+    for path in inputs:
+        for file_path in output_files(path):
+            for record in read_records(file_path):
+                await downloader.submit(record)
+    await downloader.close()
+    return len(downloader.manifest) - known
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="下载输出文件中的合同附件")
+    parser.add_argument("inputs", nargs="+")
+    parser.add_argument("--dir", default="ccgp_attachments")
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    print(f"downloaded: {asyncio.run(download_from_output(args.inputs, args.dir, args.workers))}")
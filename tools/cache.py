@@ -0,0 +1,121 @@
+import gzip
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Optional
+
+
+class ResponseCache:
+    """
+    内容寻址的本地响应缓存
+
+    响应体按内容 sha256 压缩存储在 root 目录下 (相同内容只存一份),
+    SQLite 索引记录 URL + 抓取时间 -> 内容摘要; 总大小超过 max_bytes 时按最近访问时间淘汰
+    """
+
+    def __init__(self, root: str = "ccgp_cache", max_bytes: int = 2 * 1024 ** 3, compress_level: int = 6):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.compress_level = compress_level
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(os.path.join(root, "index.db"), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS responses (
+                url TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                digest TEXT NOT NULL,
+                PRIMARY KEY (url, fetched_at)
+            );
+            CREATE INDEX IF NOT EXISTS idx_responses_digest ON responses (digest);
+            CREATE TABLE IF NOT EXISTS blobs (
+                digest TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_blobs_access ON blobs (last_access);
+        """)
+        self.conn.commit()
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], f"{digest}.gz")
+
+    def get(self, url: str, max_age: Optional[float] = None) -> Optional[str]:
+        """取得 URL 最新的缓存内容, max_age (秒) 为 None 时不限制缓存时间"""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT digest, fetched_at FROM responses WHERE url = ? ORDER BY fetched_at DESC LIMIT 1",
+                (url,)).fetchone()
+            if row is None or (max_age is not None and time.time() - row[1] > max_age):
+                return None
+            digest = row[0]
+            self.conn.execute("UPDATE blobs SET last_access = ? WHERE digest = ?", (time.time(), digest))
+            self.conn.commit()
+        try:
+            with gzip.open(self._blob_path(digest), "rt", encoding="utf-8") as file:
+                return file.read()
+        except FileNotFoundError:
+            logging.warning(f"Cache blob missing, url: {url}, digest: {digest}")
+            return None
+
+    def put(self, url: str, content: str, fetched_at: Optional[float] = None) -> str:
+        """写入缓存, 返回内容摘要"""
+        data = content.encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._blob_path(digest)
+        now = time.time()
+        with self._lock:
+            exists = self.conn.execute("SELECT 1 FROM blobs WHERE digest = ?", (digest,)).fetchone() is not None
+            if not exists:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.tmp"
+                with gzip.open(tmp_path, "wb", compresslevel=self.compress_level) as file:
+                    file.write(data)
+                os.replace(tmp_path, path)
+                size = os.path.getsize(path)
+                self.conn.execute("INSERT INTO blobs (digest, size, last_access) VALUES (?, ?, ?)", (digest, size, now))
+                self.total_bytes += size
+            else:
+                self.conn.execute("UPDATE blobs SET last_access = ? WHERE digest = ?", (now, digest))
+            self.conn.execute("INSERT OR REPLACE INTO responses (url, fetched_at, digest) VALUES (?, ?, ?)",
+                              (url, fetched_at or now, digest))
+            self.conn.commit()
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+        return digest
+
+    def _evict(self) -> None:
+        """按最近访问时间淘汰, 直到总大小降到上限的 90%"""
+        target = int(self.max_bytes * 0.9)
+        rows = self.conn.execute("SELECT digest, size FROM blobs ORDER BY last_access ASC").fetchall()
+        evicted = 0
+        for digest, size in rows:
+            if self.total_bytes <= target:
+                break
+            try:
+                os.remove(self._blob_path(digest))
+            except FileNotFoundError:
+                pass
+            self.conn.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+            self.conn.execute("DELETE FROM responses WHERE digest = ?", (digest,))
+            self.total_bytes -= size
+            evicted += 1
+        self.conn.commit()
+        logging.info(f"Cache evicted {evicted} blobs, total bytes: {self.total_bytes}")
+
+    def urls(self, prefix: str = "") -> List[str]:
+        """列出缓存中的 URL"""
+        with self._lock:
+            rows = self.conn.execute("SELECT DISTINCT url FROM responses WHERE url LIKE ? ESCAPE '\\' ORDER BY url",
+                                     (prefix.replace("%", r"\%").replace("_", r"\_") + "%",))
+            return [row[0] for row in rows]
+
+    def close(self) -> None:
+        with self._lock:
+            self.conn.commit()
+            self.conn.close()
@@ -0,0 +1,419 @@
+import argparse
+import asyncio
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple
+
+try:
+    import redis
+    from redis.exceptions import WatchError
+except ImportError:  # 可选依赖
+    redis = WatchError = None
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class Lease:
+    """一个列表页范围 [start_page, end_page] 的租约, token 每次被领取时递增, 用于识别过期后被他人接管的租约"""
+
+    def __init__(self, range_id: int, start_page: int, end_page: int, worker_id: str, token: int, expires_at: float):
+        self.range_id = range_id
+        self.start_page = start_page
+        self.end_page = end_page
+        self.worker_id = worker_id
+        self.token = token
+        self.expires_at = expires_at
+        # 尚未处理完成的页码
+        self.pending = set(self.pages)
+
+    @property
+    def pages(self) -> range:
+        return range(self.start_page, self.end_page + 1)
+
+    def __repr__(self) -> str:
+        return f"Lease({self.range_id}: {self.start_page}-{self.end_page}, {self.worker_id}#{self.token})"
+
+
+class LeaseStore:
+    """
+    租约存储接口, 所有方法都是同步阻塞的, 由 LeaseWorker 放到线程中调用
+
+    列表页按 range_pages 页划分为若干范围, 由第一个调用 setup 的节点写入; 之后各节点 claim 领取未完成或已过期的范围,
+    定期 renew 续约, 完成后 complete, 退出时 release 未完成的租约以便其他节点立即接管
+    """
+
+    def setup(self, max_pages: int, range_pages: int) -> None:
+        raise NotImplementedError
+
+    def claim(self, worker_id: str, ttl: float) -> Optional[Lease]:
+        raise NotImplementedError
+
+    def renew(self, lease: Lease, ttl: float) -> bool:
+        raise NotImplementedError
+
+    def complete(self, lease: Lease) -> None:
+        raise NotImplementedError
+
+    def release(self, lease: Lease) -> None:
+        raise NotImplementedError
+
+    def outstanding(self, worker_id: str) -> Tuple[int, int]:
+        """(未完成的范围数, 其中由 worker_id 持有且未过期的数量)"""
+        raise NotImplementedError
+
+    def status(self) -> List[dict]:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+def split_ranges(max_pages: int, range_pages: int) -> List[Tuple[int, int, int]]:
+    """[(range_id, start_page, end_page)], 页码从1开始, 按页码升序领取"""
+    return [(range_id, start, min(start + range_pages - 1, max_pages))
+            for range_id, start in enumerate(range(1, max_pages + 1, range_pages))]
+
+
+class SqliteLeaseStore(LeaseStore):
+    """
+    SQLite 租约存储, 领取在 BEGIN IMMEDIATE 事务中完成
+
+    适用于同一台机器上的多个进程, 或文件锁可靠的共享文件系统; 跨机器部署建议使用 RedisLeaseStore
+    """
+
+    def __init__(self, db_path: str = "ccgp_leases.db", job: str = "ccgp", timeout: float = 30.0):
+        self.db_path = db_path
+        self.job = job
+        self.conn = sqlite3.connect(db_path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS leases (
+                job TEXT NOT NULL,
+                range_id INTEGER NOT NULL,
+                start_page INTEGER NOT NULL,
+                end_page INTEGER NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                worker_id TEXT,
+                token INTEGER NOT NULL DEFAULT 0,
+                expires_at REAL,
+                updated_at REAL,
+                PRIMARY KEY (job, range_id)
+            )
+        """)
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.conn
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+
+    def setup(self, max_pages: int, range_pages: int) -> None:
+        with self._transaction() as conn:
+            conn.executemany("INSERT OR IGNORE INTO leases (job, range_id, start_page, end_page) VALUES (?, ?, ?, ?)",
+                             [(self.job, *item) for item in split_ranges(max_pages, range_pages)])
+
+    def claim(self, worker_id: str, ttl: float) -> Optional[Lease]:
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT range_id, start_page, end_page, token FROM leases WHERE job = ? AND "
+                "(status = 'pending' OR (status = 'leased' AND expires_at < ?)) ORDER BY range_id LIMIT 1",
+                (self.job, now)).fetchone()
+            if row is None:
+                return None
+            range_id, start_page, end_page, token = row
+            conn.execute("UPDATE leases SET status = 'leased', worker_id = ?, token = ?, expires_at = ?, "
+                         "updated_at = ? WHERE job = ? AND range_id = ?",
+                         (worker_id, token + 1, now + ttl, now, self.job, range_id))
+        return Lease(range_id, start_page, end_page, worker_id, token + 1, now + ttl)
+
+    def renew(self, lease: Lease, ttl: float) -> bool:
+        now = time.time()
+        with self._transaction() as conn:
+            renewed = conn.execute(
+                "UPDATE leases SET expires_at = ?, updated_at = ? WHERE job = ? AND range_id = ? AND token = ? "
+                "AND status = 'leased'", (now + ttl, now, self.job, lease.range_id, lease.token)).rowcount
+        if renewed:
+            lease.expires_at = now + ttl
+        return bool(renewed)
+
+    def complete(self, lease: Lease) -> None:
+        # 租约过期被他人接管时数据也已写入本节点输出, 同样记为完成
+        with self._transaction() as conn:
+            conn.execute("UPDATE leases SET status = 'done', expires_at = NULL, updated_at = ? "
+                         "WHERE job = ? AND range_id = ?", (time.time(), self.job, lease.range_id))
+
+    def release(self, lease: Lease) -> None:
+        with self._transaction() as conn:
+            conn.execute("UPDATE leases SET status = 'pending', worker_id = NULL, expires_at = NULL, updated_at = ? "
+                         "WHERE job = ? AND range_id = ? AND token = ? AND status = 'leased'",
+                         (time.time(), self.job, lease.range_id, lease.token))
+
+    def outstanding(self, worker_id: str) -> Tuple[int, int]:
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(status = 'leased' AND worker_id = ? AND expires_at >= ?), 0) "
+                "FROM leases WHERE job = ? AND status != 'done'", (worker_id, time.time(), self.job)).fetchone()
+        return row[0], row[1]
+
+    def status(self) -> List[dict]:
+        columns = ["range_id", "start_page", "end_page", "status", "worker_id", "token", "expires_at"]
+        with self._lock:
+            rows = self.conn.execute(f"SELECT {', '.join(columns)} FROM leases WHERE job = ? ORDER BY range_id",
+                                     (self.job,)).fetchall()
+        return [dict(zip(columns, row)) for row in rows]
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+class RedisLeaseStore(LeaseStore):
+    """
+    Redis 租约存储, 可用于多台机器; 任何兼容 redis-py 接口的客户端均可传入 (如 KeyDB / fakeredis 本地替代)
+
+    - {prefix}:ranges   hash, range_id -> "start:end"
+    - {prefix}:done     set, 已完成的 range_id
+    - {prefix}:lease:ID string, "worker_id|token", 带过期时间, 过期后自动可被领取
+    """
+
+    def __init__(self, client, job: str = "ccgp"):
+        if WatchError is None:
+            raise ImportError("redis lease store requires `pip install redis`")
+        self.client = client
+        self.job = job
+        self.prefix = f"ccgp:lease:{job}"
+
+    @classmethod
+    def from_url(cls, url: str, job: str = "ccgp") -> "RedisLeaseStore":
+        if redis is None:
+            raise ImportError("redis lease store requires `pip install redis`")
+        return cls(redis.Redis.from_url(url), job=job)
+
+    def _lease_key(self, range_id: int) -> str:
+        return f"{self.prefix}:lease:{range_id}"
+
+    @staticmethod
+    def _decode(value) -> Optional[str]:
+        return value.decode("utf-8") if isinstance(value, bytes) else value
+
+    def _ranges(self) -> Dict[int, Tuple[int, int]]:
+        ranges = {}
+        for range_id, value in self.client.hgetall(f"{self.prefix}:ranges").items():
+            start, end = self._decode(value).split(":")
+            ranges[int(range_id)] = (int(start), int(end))
+        return ranges
+
+    def _unfinished(self) -> List[int]:
+        done = {int(range_id) for range_id in self.client.smembers(f"{self.prefix}:done")}
+        return sorted(range_id for range_id in self._ranges() if range_id not in done)
+
+    def setup(self, max_pages: int, range_pages: int) -> None:
+        pipe = self.client.pipeline()
+        for range_id, start, end in split_ranges(max_pages, range_pages):
+            pipe.hsetnx(f"{self.prefix}:ranges", range_id, f"{start}:{end}")
+        pipe.execute()
+
+    def claim(self, worker_id: str, ttl: float) -> Optional[Lease]:
+        ranges = self._ranges()
+        unfinished = self._unfinished()
+        if not unfinished:
+            return None
+        holders = self.client.mget([self._lease_key(range_id) for range_id in unfinished])
+        token = self.client.incr(f"{self.prefix}:token")
+        for range_id in (range_id for range_id, holder in zip(unfinished, holders) if holder is None):
+            # SET NX: 租约不存在 (未领取或已过期) 时领取成功, 并发领取时只有一个节点成功
+            if not self.client.set(self._lease_key(range_id), f"{worker_id}|{token}", nx=True, px=int(ttl * 1000)):
+                continue
+            lease = Lease(range_id, *ranges[range_id], worker_id, token, time.time() + ttl)
+            if self.client.sismember(f"{self.prefix}:done", range_id):
+                # 检查与领取之间被其他节点完成
+                self.release(lease)
+                continue
+            return lease
+        return None
+
+    def _compare_and(self, lease: Lease, action) -> bool:
+        """租约仍由 lease 持有时执行 action(pipe)"""
+        key = self._lease_key(lease.range_id)
+        with self.client.pipeline() as pipe:
+            try:
+                pipe.watch(key)
+                if self._decode(pipe.get(key)) != f"{lease.worker_id}|{lease.token}":
+                    pipe.unwatch()
+                    return False
+                pipe.multi()
+                action(pipe, key)
+                pipe.execute()
+                return True
+            except WatchError:
+                return False
+
+    def renew(self, lease: Lease, ttl: float) -> bool:
+        renewed = self._compare_and(lease, lambda pipe, key: pipe.pexpire(key, int(ttl * 1000)))
+        if renewed:
+            lease.expires_at = time.time() + ttl
+        return renewed
+
+    def complete(self, lease: Lease) -> None:
+        self.client.sadd(f"{self.prefix}:done", lease.range_id)
+        self.release(lease)
+
+    def release(self, lease: Lease) -> None:
+        self._compare_and(lease, lambda pipe, key: pipe.delete(key))
+
+    def outstanding(self, worker_id: str) -> Tuple[int, int]:
+        unfinished = self._unfinished()
+        if not unfinished:
+            return 0, 0
+        values = self.client.mget([self._lease_key(range_id) for range_id in unfinished])
+        held = sum(1 for value in values if value is not None and self._decode(value).startswith(f"{worker_id}|"))
+        return len(unfinished), held
+
+    def status(self) -> List[dict]:
+        done = {int(range_id) for range_id in self.client.smembers(f"{self.prefix}:done")}
+        ranges = self._ranges()
+        values = self.client.mget([self._lease_key(range_id) for range_id in sorted(ranges)]) if ranges else []
+        result = []
+        for (range_id, (start, end)), value in zip(sorted(ranges.items()), values):
+            holder = self._decode(value)
+            result.append({"range_id": range_id, "start_page": start, "end_page": end,
+                           "status": "done" if range_id in done else "leased" if holder else "pending",
+                           "worker_id": holder.rsplit("|", 1)[0] if holder else None})
+        return result
+
+    def close(self) -> None:
+        self.client.close()
+
+
+class LeaseWorker:
+    """
+    单个节点的租约领取者, 作为 main() 的页码来源
+
+    pages() 逐个领取租约并产出其中的页码, 页码全部处理完成 (page_done) 后完成租约;
+    后台每 ttl/3 秒续约一次; 没有可领取的范围但其他节点仍持有租约时每 poll_interval 秒重试,
+    以便接管过期的租约; close() 释放未完成的租约
+    """
+
+    def __init__(self, store: LeaseStore, worker_id: Optional[str] = None, ttl: float = 300.0,
+                 poll_interval: float = 10.0):
+        self.store = store
+        self.worker_id = worker_id or default_worker_id()
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+        self.leases: Dict[int, Lease] = {}
+        self.completed = 0
+        self._renew_task: Optional[asyncio.Task] = None
+        self._complete_tasks: Set[asyncio.Task] = set()
+
+    async def pages(self) -> AsyncIterator[int]:
+        if self._renew_task is None:
+            self._renew_task = asyncio.create_task(self._renew_loop())
+        while True:
+            lease = await asyncio.to_thread(self.store.claim, self.worker_id, self.ttl)
+            if lease is None:
+                unfinished, held = await asyncio.to_thread(self.store.outstanding, self.worker_id)
+                if unfinished <= held:
+                    # 全部完成, 或剩余的都由本节点持有
+                    return
+                await asyncio.sleep(self.poll_interval)
+                continue
+            logging.info(f"Lease claimed: {lease}")
+            self.leases[lease.range_id] = lease
+            for page in lease.pages:
+                yield page
+
+    def page_done(self, page: int) -> None:
+        """PageTracker.on_page_done 回调 (同步调用), 完成租约的存储请求在线程中执行, 不阻塞事件循环"""
+        for lease in list(self.leases.values()):
+            if page in lease.pending:
+                lease.pending.discard(page)
+                if not lease.pending:
+                    del self.leases[lease.range_id]
+                    task = asyncio.get_running_loop().create_task(self._complete(lease))
+                    self._complete_tasks.add(task)
+                    task.add_done_callback(self._complete_tasks.discard)
+                return
+
+    async def _complete(self, lease: Lease) -> None:
+        try:
+            await asyncio.to_thread(self.store.complete, lease)
+        except Exception as e:
+            # 租约过期后由其他节点重新处理, 重复的记录在合并时去重
+            logging.warning(f"Failed to complete {lease}, error: {e!r}")
+            return
+        self.completed += 1
+        logging.info(f"Lease completed: {lease}")
+
+    async def _renew_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            for lease in list(self.leases.values()):
+                try:
+                    renewed = await asyncio.to_thread(self.store.renew, lease, self.ttl)
+                except Exception as e:
+                    logging.warning(f"Failed to renew {lease}, error: {e!r}")
+                    continue
+                if not renewed:
+                    # 已被其他节点接管, 继续处理, 重复的记录在合并时去重
+                    logging.warning(f"Lease lost: {lease}")
+
+    async def close(self) -> None:
+        if self._renew_task is not None:
+            self._renew_task.cancel()
+            self._renew_task = None
+        if self._complete_tasks:
+            await asyncio.gather(*self._complete_tasks)
+        for lease in list(self.leases.values()):
+            logging.warning(f"Release unfinished lease: {lease}, pending pages: {len(lease.pending)}")
+            await asyncio.to_thread(self.store.release, lease)
+        self.leases.clear()
+        logging.info(f"Lease worker {self.worker_id} finished, completed leases: {self.completed}")
+
+
+def open_store(target: str, job: str = "ccgp") -> LeaseStore:
+    """redis://... 使用 RedisLeaseStore, 其余视为 SQLite 文件路径"""
+    if target.startswith(("redis://", "rediss://", "unix://")):
+        return RedisLeaseStore.from_url(target, job=job)
+    return SqliteLeaseStore(target, job=job)
+
+
+if __name__ == '__main__':
+    from tools.sink import merge_outputs
+
+    parser = argparse.ArgumentParser(description="分布式爬取: 查看租约状态 / 合并各节点输出")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    status_parser = subparsers.add_parser("status")
+    status_parser.add_argument("store", help="SQLite 文件路径或 redis://host:port/db")
+    status_parser.add_argument("--job", default="ccgp")
+    merge_parser = subparsers.add_parser("merge")
+    merge_parser.add_argument("output")
+    merge_parser.add_argument("inputs", nargs="+", help="各节点的输出文件 (分片输出时传入分片前的路径)")
+    merge_parser.add_argument("--format", default="csv", choices=["csv", "parquet", "sqlite"])
+    merge_parser.add_argument("--compression")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "status":
+        store = open_store(args.store, job=args.job)
+        rows = store.status()
+        for row in rows:
+            print(row)
+        counts = {}
+        for row in rows:
+            counts[row["status"]] = counts.get(row["status"], 0) + 1
+        print(counts)
+        store.close()
+    else:
+        print(f"merged rows: {merge_outputs(args.inputs, args.output, args.format, compression=args.compression)}")
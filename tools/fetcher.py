@@ -0,0 +1,204 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Optional
+
+from aiohttp import ClientResponse, ClientSession, ClientTimeout, TCPConnector
+from yarl import URL
+
+try:
+    from aiohttp.compression_utils import HAS_BROTLI
+except ImportError:  # 旧版本 aiohttp
+    HAS_BROTLI = False
+
+from tools.IP_proxy import ProxyPool
+from tools.cache import ResponseCache
+from tools.memory import BudgetHold
+from tools.metrics import metrics
+from tools.rate_limit import AIMDRateController
+from tools.tools import headers_list
+
+
+# 未安装 Brotli 时 aiohttp 无法解压 br 响应, 不能声明支持
+ACCEPT_ENCODING = "gzip, deflate, br" if HAS_BROTLI else "gzip, deflate"
+
+
+class Page:
+    """一次 GET 的结果: text 为None表示服务器返回 304 (未修改); etag / last_modified 为响应中的校验信息"""
+
+    __slots__ = ("url", "status", "text", "etag", "last_modified")
+
+    def __init__(self, url: str, status: int, text: Optional[str], etag: Optional[str] = None,
+                 last_modified: Optional[str] = None):
+        self.url = url
+        self.status = status
+        self.text = text
+        self.etag = etag
+        self.last_modified = last_modified
+
+    @property
+    def not_modified(self) -> bool:
+        return self.text is None
+
+
+class Fetcher:
+    """
+    共享的 HTTP 客户端, 由 main() 持有, 供列表页与详情页共用
+
+    使用 keep-alive 连接池复用 TCP 连接, 按 host 限制连接数, 缓存 DNS 解析结果,
+    并声明支持 gzip 压缩 (aiohttp 会自动解压响应), 安装了 Brotli 时同时声明支持 br
+
+    指定 cache 时, 所有响应都会写入本地缓存, 并可通过 get_cached 优先读取;
+    指定 rate_controller 时, 每个请求前按 host 等待令牌, 并根据响应状态/延迟调整速率;
+    指定 proxy_pool 且未显式传入 proxy 时, 每个请求从代理池中轮换选择代理, 并回报代理的延迟与错误;
+    get_text 传入 budget 时按在途字节预算分块读取响应体 (见 tools.memory.ByteBudget)
+    """
+
+    def __init__(self, limit: int = 100, limit_per_host: int = 20, dns_cache_ttl: int = 300,
+                 keepalive_timeout: float = 30.0, total_timeout: float = 60.0, connect_timeout: float = 10.0,
+                 read_timeout: float = 30.0, trust_env: bool = False, cache: Optional[ResponseCache] = None,
+                 rate_controller: Optional[AIMDRateController] = None, proxy_pool: Optional[ProxyPool] = None,
+                 chunk_size: int = 64 * 1024):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_cache_ttl = dns_cache_ttl
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = ClientTimeout(total=total_timeout, sock_connect=connect_timeout, sock_read=read_timeout)
+        self.trust_env = trust_env
+        self.cache = cache
+        self.rate_controller = rate_controller
+        self.proxy_pool = proxy_pool
+        self.chunk_size = chunk_size
+        self._session: Optional[ClientSession] = None
+
+    async def __aenter__(self) -> "Fetcher":
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def open(self) -> None:
+        """创建连接池与会话"""
+        if self._session is not None and not self._session.closed:
+            return
+        connector = TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            ttl_dns_cache=self.dns_cache_ttl,
+            use_dns_cache=True,
+            keepalive_timeout=self.keepalive_timeout,
+        )
+        self._session = ClientSession(
+            connector=connector,
+            timeout=self.timeout,
+            trust_env=self.trust_env,
+            headers={"Accept-Encoding": ACCEPT_ENCODING},
+        )
+        logging.debug(f"Fetcher opened, limit: {self.limit}, limit_per_host: {self.limit_per_host}")
+
+    async def close(self) -> None:
+        """关闭会话并释放连接池"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    @property
+    def session(self) -> ClientSession:
+        if self._session is None or self._session.closed:
+            raise RuntimeError("Fetcher is not opened, use `async with Fetcher()` or call `await fetcher.open()`.")
+        return self._session
+
+    async def get_text(self, url: str, proxy: Optional[str] = None, priority: int = 0,
+                       budget: Optional[BudgetHold] = None) -> str:
+        """GET 请求并返回解码后的文本, priority 为限速器中的优先级 (越小越优先)"""
+        return (await self.fetch(url, proxy, priority, budget)).text
+
+    async def fetch(self, url: str, proxy: Optional[str] = None, priority: int = 0,
+                    budget: Optional[BudgetHold] = None, etag: Optional[str] = None,
+                    last_modified: Optional[str] = None) -> Page:
+        """
+        GET 请求, 传入上次响应的 etag / last_modified 时为条件请求 (If-None-Match / If-Modified-Since),
+        服务器返回 304 时不读取响应体, Page.text 为None
+        """
+        headers = dict(random.choice(headers_list))
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        if budget is not None:
+            # 预算用尽时不发起新的请求
+            await budget.reserve()
+        pooled = proxy is None and self.proxy_pool is not None
+        if pooled:
+            proxy = await self.proxy_pool.acquire()
+        # 使用代理时按 (host, 代理) 分别限速, 优先级按 host 比较
+        host = URL(url).host
+        if self.rate_controller is not None:
+            await self.rate_controller.acquire(host, priority, proxy=proxy)
+
+        start, status = time.monotonic(), None
+        try:
+            async with self.session.get(url=url, headers=headers, proxy=proxy) as response:
+                status = response.status
+                metrics.inc("http_responses_total", status=status)
+                response.raise_for_status()
+                # 记录响应状态码和头信息
+                logging.debug("Response Status: %s", response.status)
+                logging.debug("Response Headers: %s", response.headers)
+                validators = (response.headers.get("ETag"), response.headers.get("Last-Modified"))
+
+                if status == 304:
+                    html_data = None
+                elif budget is None:
+                    metrics.inc("downloaded_bytes_total", len(await response.read()))
+                    html_data = await response.text()
+                else:
+                    html_data = await self._read_budgeted(response, budget)
+        except Exception as e:
+            if budget is not None:
+                budget.release()
+            latency = time.monotonic() - start
+            if status is None:
+                metrics.inc("http_errors_total", error=type(e).__name__)
+            if self.rate_controller is not None:
+                self.rate_controller.record(host, status, latency, timeout=isinstance(e, asyncio.TimeoutError),
+                                            proxy=proxy)
+            if pooled and proxy is not None:
+                # 连接失败/超时以及 403/407/429 视为代理问题
+                self.proxy_pool.report(proxy, ok=status is not None and status not in (403, 407, 429),
+                                       latency=latency)
+            raise
+        latency = time.monotonic() - start
+        if self.rate_controller is not None:
+            self.rate_controller.record(host, status, latency, proxy=proxy)
+        if pooled and proxy is not None:
+            self.proxy_pool.report(proxy, ok=True, latency=latency)
+
+        if self.cache is not None and html_data is not None:
+            # 压缩及磁盘写入放到线程中, 不阻塞事件循环
+            await asyncio.to_thread(self.cache.put, url, html_data)
+        return Page(url, status, html_data, *validators)
+
+    async def _read_budgeted(self, response: ClientResponse, budget: BudgetHold) -> str:
+        """分块读取响应体: 已知长度且未压缩时按 Content-Length 预留, 否则按平均页面大小预留, 超出部分边读边计入"""
+        length = response.content_length if "Content-Encoding" not in response.headers else None
+        await budget.reserve(length if length is not None else budget.budget.expected)
+        chunks, size = [], 0
+        async for chunk in response.content.iter_chunked(self.chunk_size):
+            chunks.append(chunk)
+            size += len(chunk)
+            if size > budget.size:
+                budget.charge(size - budget.size)
+        body = b"".join(chunks)
+        del chunks
+        budget.resize(len(body))
+        metrics.inc("downloaded_bytes_total", len(body))
+        return body.decode(response.get_encoding())
+
+    async def get_cached(self, url: str, max_age: Optional[float] = None) -> Optional[str]:
+        """读取缓存, 未启用缓存或未命中时返回None"""
+        if self.cache is None:
+            return None
+        return await asyncio.to_thread(self.cache.get, url, max_age)
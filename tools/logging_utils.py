@@ -1,4 +1,12 @@
+import atexit
+import json
 import logging
+import logging.handlers
+import multiprocessing
+import queue
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
 
 
 class ColorHandler(logging.StreamHandler):
@@ -12,28 +20,176 @@ class ColorHandler(logging.StreamHandler):
         self.stream.write(f"{color}{message}\033[0m\n")
 
 
-def log_set(log_level=logging.INFO, log_save: bool = False, save_path: str = "log.log", save_level=None):
+# LogRecord 的标准属性, 其余属性 (logging 的 extra 参数) 作为 JSON 字段输出
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """JSON lines 格式: {"time", "level", "logger", "message", ...extra}"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {"time": record.created, "level": record.levelname, "logger": record.name,
+                "message": record.getMessage()}
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                data[key] = value
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    只把 LogRecord 放入队列, 消息格式化 (msg % args) 与写入都在后台线程中完成
+
+    标准 QueueHandler 会在调用线程中先格式化消息; 这里不做格式化, 因此日志参数在记录后不应再被修改
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+# log_set 安装的 handler / 后台线程, 重复调用时先移除
+_installed: List[logging.Handler] = []
+_listener: Optional[logging.handlers.QueueListener] = None
+# 子进程日志的跨进程队列及其后台线程, 由 pool_logging 按需创建
+_worker_queue = None
+_worker_listener: Optional[logging.handlers.QueueListener] = None
+
+
+@atexit.register
+def stop_logging() -> None:
+    """停止后台日志线程, 写完队列中剩余的日志"""
+    global _listener, _worker_queue, _worker_listener
+    if _worker_listener is not None:
+        _worker_listener.stop()
+        _worker_listener = _worker_queue = None
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+def _init_worker_logging(log_queue, level: int) -> None:
+    """
+    进程池的 initializer: fork 出的子进程继承了 LazyQueueHandler, 但后台线程只在父进程中运行,
+    子进程的日志会留在本进程的队列中; 改为放入跨进程队列, 由父进程的后台线程写出
+    """
+    global _listener
+    _listener = None
     logger = logging.getLogger()
-    logger.setLevel(logging.DEBUG)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    _installed.clear()
+    # 标准 QueueHandler 在子进程中格式化消息, 日志参数不需要能被 pickle
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    logger.setLevel(level)
+
+
+def pool_logging() -> Tuple[Optional[Callable], tuple]:
+    """
+    ProcessPoolExecutor 的 (initializer, initargs): log_set(use_queue=True) 时子进程的日志经跨进程队列交给
+    父进程的 handler; 否则子进程直接使用继承的 handler, 返回 (None, ())
+    """
+    global _worker_queue, _worker_listener
+    if _listener is None:
+        return None, ()
+    if _worker_listener is None:
+        _worker_queue = multiprocessing.Queue()
+        _worker_listener = logging.handlers.QueueListener(_worker_queue, *_listener.handlers,
+                                                          respect_handler_level=True)
+        _worker_listener.start()
+    return _init_worker_logging, (_worker_queue, logging.getLogger().level)
+
+
+def log_set(log_level=logging.INFO, log_save: bool = False, save_path: str = "log.log", save_level=None,
+            json_lines: bool = False, use_queue: bool = False):
+    """
+    配置根 logger: 控制台 + 可选的文件输出
+
+    json_lines 时文件输出为 JSON lines; use_queue 时所有 handler 由后台线程执行, 事件循环中记录日志只是入队;
+    根 logger 的等级设为各 handler 的最低等级, 低于该等级的日志在调用处直接丢弃, 不会格式化参数
+    """
+    global _listener
+    logger = logging.getLogger()
+    for handler in _installed:
+        logger.removeHandler(handler)
+    _installed.clear()
+    stop_logging()
+
+    handlers = []
     # console
     handler = ColorHandler()
     handler.setLevel(log_level)
     formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s", datefmt='%Y-%m-%d %H:%M:%S')
     handler.setFormatter(formatter)
-    logger.addHandler(handler)
+    handlers.append(handler)
     # file
     if log_save:
         file_header = logging.FileHandler(save_path, encoding="utf-8")
         file_header.setLevel(log_level if save_level is None else save_level)
-        file_header.setFormatter(formatter)
-        logger.addHandler(file_header)
+        file_header.setFormatter(JsonFormatter() if json_lines else formatter)
+        handlers.append(file_header)
+    logger.setLevel(min(handler.level for handler in handlers))
+
+    if use_queue:
+        log_queue = queue.SimpleQueue()
+        _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        handlers = [LazyQueueHandler(log_queue)]
+    for handler in handlers:
+        logger.addHandler(handler)
+        _installed.append(handler)
+
+
+class SuccessLog:
+    """
+    成功请求的采样日志: 每 interval 秒内每类最多逐条输出 max_per_interval 条 URL, 其余只计数,
+    每个周期结束时输出一行汇总; 避免高并发时每个请求一行 INFO 日志
+    """
+
+    def __init__(self, interval: float = 10.0, max_per_interval: int = 3, level: int = logging.INFO,
+                 logger: Optional[logging.Logger] = None):
+        self.interval = interval
+        self.max_per_interval = max_per_interval
+        self.level = level
+        self.logger = logger or logging.getLogger()
+        self._counts: Dict[str, int] = {}
+        self._window_start = time.monotonic()
+        self._lock = threading.Lock()
+
+    def record(self, kind: str, url: str) -> None:
+        with self._lock:
+            count = self._counts.get(kind, 0) + 1
+            self._counts[kind] = count
+            expired = time.monotonic() - self._window_start >= self.interval
+        if count <= self.max_per_interval and self.logger.isEnabledFor(self.level):
+            self.logger.log(self.level, "Successfully get %s, url: %s", kind, url, extra={"kind": kind, "url": url})
+        if expired:
+            self.flush()
+
+    def flush(self) -> None:
+        """输出当前周期的汇总并开始新周期"""
+        with self._lock:
+            counts, self._counts = self._counts, {}
+            elapsed = time.monotonic() - self._window_start
+            self._window_start = time.monotonic()
+        if counts:
+            self.logger.log(self.level, "Successfully get %s in %.1fs",
+                            ", ".join(f"{count} {kind}" for kind, count in sorted(counts.items())), elapsed,
+                            extra={"counts": counts})
 
 
 if __name__ == '__main__':
-    log_set(logging.DEBUG, log_save=True)
+    log_set(logging.DEBUG, log_save=True, json_lines=True, use_queue=True)
     # logging test
     logging.debug("debug msg")
     logging.info("info msg")
     logging.warning("warning msg")
     logging.error("error msg")
     logging.critical("critical msg")
+    success_log = SuccessLog(interval=0.0, max_per_interval=1)
+    for index in range(5):
+        success_log.record("detail", f"http://example.com/{index}")
+    success_log.flush()
@@ -0,0 +1,99 @@
+import asyncio
+import logging
+import tracemalloc
+from typing import Optional, Tuple
+
+
+class ByteBudget:
+    """
+    全局的在途 HTML 字节预算: 已下载但尚未解析完成的详情页总字节数不超过 max_bytes
+
+    - 开始请求前等待预算未用尽; 已知 Content-Length (未压缩) 时先按其预留, 预留不下时等待
+    - 未知长度 (压缩/分块传输) 时先按近期页面的平均大小预留, 超出预留的部分边读边计入, 不等待
+    - 预算为空时总是允许预留, 单个大于 max_bytes 的页面不会永远等待
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.used = 0
+        self.peak = 0
+        # 近期页面大小的指数移动平均, 用于未知长度时的预留
+        self.expected = 0
+        self._released = asyncio.Event()
+
+    def _fits(self, size: int) -> bool:
+        return self.used == 0 or self.used + max(size, 1) <= self.max_bytes
+
+    async def reserve(self, size: int = 0) -> None:
+        """等待直到可以预留 size 字节; size 为 0 时只等待预算未用尽"""
+        while not self._fits(size):
+            await self._released.wait()
+        self.charge(size)
+
+    def charge(self, size: int) -> None:
+        """计入已读取的字节, 不等待"""
+        self.used += size
+        self.peak = max(self.peak, self.used)
+
+    def observe(self, size: int, alpha: float = 0.2) -> None:
+        self.expected = size if not self.expected else int(alpha * size + (1 - alpha) * self.expected)
+
+    def release(self, size: int) -> None:
+        if not size:
+            return
+        self.used -= size
+        # 唤醒所有等待者重新检查, 之后的等待者使用新的 Event
+        self._released.set()
+        self._released = asyncio.Event()
+
+    def hold(self) -> "BudgetHold":
+        return BudgetHold(self)
+
+
+class BudgetHold:
+    """单个页面在预算中占用的字节, 页面解析完成 (或请求失败) 后 release"""
+
+    def __init__(self, budget: ByteBudget):
+        self.budget = budget
+        self.size = 0
+
+    async def reserve(self, size: int = 0) -> None:
+        await self.budget.reserve(size)
+        self.size += size
+
+    def charge(self, size: int) -> None:
+        self.budget.charge(size)
+        self.size += size
+
+    def resize(self, size: int) -> None:
+        """按实际读取的字节数修正预留的大小"""
+        self.budget.observe(size)
+        if size > self.size:
+            self.charge(size - self.size)
+        elif size < self.size:
+            self.budget.release(self.size - size)
+            self.size = size
+
+    def release(self) -> None:
+        self.budget.release(self.size)
+        self.size = 0
+
+
+def start_tracing(frames: int = 1) -> None:
+    """开始 tracemalloc 跟踪 (会降低运行速度, 仅用于排查内存)"""
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+
+
+def stop_tracing(top: int = 5) -> Optional[Tuple[int, int]]:
+    """输出 Python 分配内存的峰值及占用最多的代码位置, 停止跟踪并返回 (当前, 峰值) 字节数"""
+    if not tracemalloc.is_tracing():
+        return None
+    current, peak = tracemalloc.get_traced_memory()
+    stats = tracemalloc.take_snapshot().filter_traces(
+        (tracemalloc.Filter(False, tracemalloc.__file__),)).statistics("lineno")
+    tracemalloc.stop()
+    logging.info(f"Traced memory: current {current / 1024 ** 2:.1f}MB, peak {peak / 1024 ** 2:.1f}MB")
+    for stat in stats[:top]:
+        logging.info(f"  {stat}")
+    return current, peak
@@ -0,0 +1,183 @@
+import asyncio
+import bisect
+import logging
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional, Tuple
+
+from aiohttp import web
+
+# 秒, 覆盖 parse 的亚毫秒级到详情页下载的数十秒
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def _key(name: str, labels: dict) -> LabelKey:
+    return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...], **extra) -> str:
+    items = list(labels) + [(key, str(value)) for key, value in extra.items()]
+    if not items:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in items) + "}"
+
+
+class Histogram:
+    """固定分桶的延迟直方图"""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0.0
+
+
+class Metrics:
+    """
+    进程内的计数器/直方图/仪表盘注册表, 可渲染为 Prometheus 文本格式
+
+    - stage_seconds{stage=listing_fetch|detail_fetch|parse|write}: 各阶段耗时
+    - http_responses_total{status}, downloaded_bytes_total, rows_written_total
+    - parse_failures_total{layout}: 校验失败或版式未知, 解析时抛出异常的 layout 为 error
+    - queue_depth{queue}: 由回调函数提供的队列长度
+    """
+
+    def __init__(self, prefix: str = "ccgp"):
+        self.prefix = prefix
+        self.counters: Dict[LabelKey, float] = {}
+        self.histograms: Dict[LabelKey, Histogram] = {}
+        self.gauges: Dict[LabelKey, Callable[[], float]] = {}
+        self.started_at = time.time()
+        self._rows_at_start = 0.0
+
+    def start(self) -> None:
+        """运行开始时调用: summary 中的行数与速率从此刻起计算, 不包含导入/初始化的时间及之前的运行"""
+        self.started_at = time.time()
+        self._rows_at_start = self.counter("rows_written_total")
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = _key(name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = _key(name, labels)
+        if key not in self.histograms:
+            self.histograms[key] = Histogram()
+        self.histograms[key].observe(value)
+
+    def set_gauge(self, name: str, func: Callable[[], float], **labels) -> None:
+        self.gauges[_key(name, labels)] = func
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def counter(self, name: str, **labels) -> float:
+        """按名称 (及部分标签) 求和"""
+        wanted = {(key, str(value)) for key, value in labels.items()}
+        return sum(value for (counter_name, counter_labels), value in self.counters.items()
+                   if counter_name == name and wanted.issubset(counter_labels))
+
+    def histogram(self, name: str, **labels) -> Optional[Histogram]:
+        return self.histograms.get(_key(name, labels))
+
+    def reset(self) -> None:
+        self.counters.clear()
+        self.histograms.clear()
+        self.gauges.clear()
+        self.started_at = time.time()
+        self._rows_at_start = 0.0
+
+    def render(self) -> str:
+        """Prometheus 文本格式"""
+        lines = []
+        typed = set()
+        for (name, labels), value in sorted(self.counters.items()):
+            if name not in typed:
+                lines.append(f"# TYPE {self.prefix}_{name} counter")
+                typed.add(name)
+            lines.append(f"{self.prefix}_{name}{_format_labels(labels)} {value}")
+        for (name, labels), func in sorted(self.gauges.items()):
+            if name not in typed:
+                lines.append(f"# TYPE {self.prefix}_{name} gauge")
+                typed.add(name)
+            try:
+                lines.append(f"{self.prefix}_{name}{_format_labels(labels)} {func()}")
+            except Exception as e:
+                logging.debug(f"Failed to read gauge {name}: {e!r}")
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            if name not in typed:
+                lines.append(f"# TYPE {self.prefix}_{name} histogram")
+                typed.add(name)
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f"{self.prefix}_{name}_bucket{_format_labels(labels, le=bound)} {cumulative}")
+            lines.append(f"{self.prefix}_{name}_bucket{_format_labels(labels, le='+Inf')} {histogram.count}")
+            lines.append(f"{self.prefix}_{name}_sum{_format_labels(labels)} {histogram.sum}")
+            lines.append(f"{self.prefix}_{name}_count{_format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> str:
+        """单行汇总"""
+        elapsed = max(time.time() - self.started_at, 1e-9)
+        rows = self.counter("rows_written_total") - self._rows_at_start
+        parts = [f"rows: {int(rows)} ({rows / elapsed:.1f}/s)",
+                 f"downloaded: {self.counter('downloaded_bytes_total') / 1024 ** 2:.1f}MB",
+                 f"parse failures: {int(self.counter('parse_failures_total'))}"]
+        for stage in ("listing_fetch", "detail_fetch", "parse", "write"):
+            histogram = self.histogram("stage_seconds", stage=stage)
+            if histogram is not None and histogram.count:
+                parts.append(f"{stage}: {histogram.count}x{histogram.mean * 1000:.1f}ms")
+        depths = []
+        for (name, labels), func in sorted(self.gauges.items()):
+            if name == "queue_depth":
+                try:
+                    depths.append(f"{dict(labels).get('queue')}={func()}")
+                except Exception:
+                    pass
+        if depths:
+            parts.append(f"queues: {' '.join(depths)}")
+        return ", ".join(parts)
+
+
+# 全局实例, 各模块直接导入使用
+metrics = Metrics()
+
+
+async def start_metrics_server(port: int = 9108, host: str = "127.0.0.1",
+                               registry: Metrics = metrics) -> web.AppRunner:
+    """在本地启动 /metrics 接口 (Prometheus 文本格式), 返回 runner, 结束时调用 runner.cleanup()"""
+
+    async def handle(_request: web.Request) -> web.Response:
+        return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info(f"Metrics endpoint: http://{host}:{port}/metrics")
+    return runner
+
+
+async def log_summary(interval: float = 30.0, registry: Metrics = metrics) -> None:
+    """定期输出汇总日志, 作为后台任务运行直到被取消"""
+    while True:
+        await asyncio.sleep(interval)
+        logging.info(f"Crawl stats: {registry.summary()}")
@@ -0,0 +1,412 @@
+import hashlib
+import logging
+import time
+from itertools import islice
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from bs4 import BeautifulSoup, SoupStrainer, Tag, NavigableString
+from lxml import etree
+
+from tools.pydantic_types import ContractModel, ConversionOldContractModel
+from tools.records import ContractRecord, map_contract
+from tools.tools import clean_contents, match_info, get_fileid, flatten_dict, match_clean
+
+DOWNLOAD_API = "https://download.ccgp.gov.cn/oss/download"
+
+
+def _download_href(onclick: str) -> Optional[str]:
+    """从 onclick 中提取文件 uuid 并拼接下载地址"""
+    href = get_fileid(onclick)
+    if href:
+        href = f"{DOWNLOAD_API}?uuid={href}"
+    return href
+
+
+def _merge_sub_item(result_lst: List[dict], text: str) -> None:
+    """新版: 将次级条目合并到上一个主键"""
+    # 取得上一位主键
+    target = result_lst[-1]
+    if isinstance(target["value"], dict):
+        matched = match_info(match_clean(text))
+        if matched["key"] != "本合同对应的中标成交公告":
+            if matched["key"] != "附件":
+                if matched["key"] not in target["value"].keys():
+                    target["value"][matched["key"]] = matched["value"]
+                else:
+                    target["value"][f"{matched['key']}_2"] = matched["value"]
+            else:
+                result_lst.append(matched)
+        logging.debug("p_tag: %s", matched)
+
+
+def _set_file_info(result_lst: List[dict], filename: str, href: Optional[str]) -> None:
+    """新版: 文件信息写入上一个主键"""
+    target = result_lst[-1]
+    if isinstance(target["value"], dict):
+        target["value"]["filename"] = filename
+        target["value"]["href"] = href
+    logging.debug("filename: %s, href: %s", filename, href)
+
+
+def _append_old_file_info(result_lst: List[dict], key: str, filename: str, href: Optional[str]) -> None:
+    """旧版: 文件信息作为独立条目"""
+    if key == "中标、成交公告":
+        result_lst.append({"key": "中标、成交公告", "value": {"filename": filename, "href": href}})
+    else:
+        result_lst.append({"key": "合同附件", "value": {"filename": filename, "href": href}})
+    logging.debug("key: %s, filename: %s, href: %s", key, filename, href)
+
+
+def _build_new_contract(result_lst: List[dict]) -> Optional[ContractModel]:
+    """新版: 条目列表 -> ContractModel, 校验失败时返回None"""
+    # 使用key和value构建字典
+    export_dict = {item["key"]: item["value"] for item in result_lst}
+    export_dict["中标合同"] = export_dict.pop("其他补充事宜")  # 重命名
+
+    # 展平字典
+    try:
+        contract_dict = ContractModel(**flatten_dict(export_dict))
+        logging.debug(contract_dict)
+        return contract_dict
+    except Exception as e:
+        logging.error(f"Failed to parse contract: {e}")
+        return None
+
+
+def _build_old_contract(result_lst: List[dict]) -> Optional[ContractModel]:
+    """旧版: 条目列表 -> ConversionOldContractModel, 校验失败时返回None"""
+    # 使用key和value构建字典
+    export_dict = {item["key"]: item["value"] for item in result_lst}
+    # 展平字典
+    export_dict = flatten_dict(export_dict)
+    try:
+        contract_dict = ConversionOldContractModel(**flatten_dict(export_dict))
+        logging.debug(contract_dict)
+        return contract_dict
+    except Exception as e:
+        logging.error(f"Failed to parse contract: {e}")
+        return None
+
+
+def _parse_bs4(_html_content: str) -> Tuple[str, Optional[List[dict]]]:
+    """BeautifulSoup 后端"""
+    # 使用 BeautifulSoup 解析 HTML
+    soup = BeautifulSoup(_html_content, 'lxml', parse_only=SoupStrainer("div", attrs={"class": "vT_detail_main"}))
+    try:
+        return _parse_bs4_soup(soup)
+    finally:
+        # 节点之间互相引用, 不拆除时要等到循环垃圾回收才释放
+        soup.decompose()
+
+
+def _parse_bs4_soup(soup: BeautifulSoup) -> Tuple[str, Optional[List[dict]]]:
+    result_lst = []
+
+    if soup.find("div", attrs={"class": "content_2020"}):
+        for tag in soup.find("div", attrs={"class": "content_2020"}).contents:
+            if isinstance(tag, Tag):
+                # 过滤空内容
+                tag_text = match_clean(tag.text)
+                if tag_text == "" or "免责声明" in tag_text:
+                    continue
+                tag_contents = clean_contents(tag.contents)
+                if isinstance(tag_contents[0], NavigableString):
+                    _merge_sub_item(result_lst, tag.text)
+                elif isinstance(tag_contents[0], Tag):
+                    # 主健
+                    if tag.name == "p":
+                        # 主键
+                        try:
+                            matched = match_info(match_clean(tag.strong.text))
+                            result_lst.append(matched)
+                            logging.debug(matched)
+                        except Exception as e:
+                            logging.error(f"Failed to match_info: {e}")
+                    elif tag.name == "ul":
+                        # 文件下载
+                        li_body = tag.find("li", attrs={"class": "fileInfo"})
+                        cleaned_contents = clean_contents(li_body.contents)
+                        if len(cleaned_contents) == 1:
+                            # 直接提取文件名和 href
+                            filename = li_body.find("a").text
+                            href = li_body.find("a")["href"]
+                        else:
+                            # 提取文件名和 href
+                            filename = match_clean(cleaned_contents[0].text)
+                            href = _download_href(li_body.find("a")["onclick"])
+                        _set_file_info(result_lst, filename, href)
+
+        return "new", result_lst
+
+    elif soup.find("table", attrs={"id": "queryTable"}):
+        # 旧版
+        for tr in soup.find("table", attrs={"id": "queryTable"}).find_all("tr"):
+            matched_info = match_info(match_clean(tr.text))
+            if "免责声明" not in matched_info["key"]:
+                if matched_info["key"] not in ["中标、成交公告", "合同附件"]:
+                    result_lst.append(matched_info)
+                    logging.debug("matched_info: %s", matched_info)
+                if tr.find("li", attrs={"class": "fileInfo"}):
+                    # 文件下载
+                    li_body = tr.find("li", attrs={"class": "fileInfo"})
+                    cleaned_contents = clean_contents(li_body.contents)
+                    if len(cleaned_contents) == 1:
+                        # 直接提取文件名和 href
+                        filename = li_body.find("a").text
+                        href = li_body.find("a")["href"]
+                    else:
+                        # 提取文件名和 href
+                        filename = match_clean(cleaned_contents[0].text)
+                        href = _download_href(li_body.find("a")["onclick"])
+                    _append_old_file_info(result_lst, matched_info["key"], filename, href)
+
+        return "old", result_lst
+
+    return "unknown", None
+
+
+# lxml 后端: 直接在 lxml 树上使用预编译 XPath, 文本/子节点语义与 bs4 保持一致
+_HTML_PARSER = etree.HTMLParser(encoding="utf-8")
+
+
+def _has_class(name: str) -> str:
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+_XP_CONTENT_2020 = etree.XPath(
+    f"(//div[{_has_class('vT_detail_main')}]/descendant-or-self::div[{_has_class('content_2020')}])[1]")
+_XP_QUERY_TABLE = etree.XPath(
+    f"(//div[{_has_class('vT_detail_main')}]/descendant-or-self::table[@id='queryTable'])[1]")
+_XP_DETAIL_MAIN = etree.XPath(f"(//div[{_has_class('vT_detail_main')}])[1]")
+_XP_FILE_INFO = etree.XPath(f"(.//li[{_has_class('fileInfo')}])[1]")
+# bs4 的 .text 不包含注释以及 script/style/template/rt/rp 内的字符串
+_XP_TEXT = etree.XPath(
+    ".//text()[not(ancestor::script or ancestor::style or ancestor::template or ancestor::rt or ancestor::rp)]")
+
+
+def _is_tag(node) -> bool:
+    """元素节点 (注释/处理指令的 tag 不是字符串, 与 bs4 中的 NavigableString 对应)"""
+    return not isinstance(node, str) and isinstance(node.tag, str)
+
+
+# bs4 把只含 ASCII 空白的字符串折叠为 "\n" (含换行时) 或 " ", pre/textarea 内除外
+_ASCII_SPACES = dict.fromkeys(map(ord, "\x20\x0a\x09\x0c\x0d"))
+_PRESERVE_WHITESPACE_TAGS = {"pre", "textarea"}
+
+
+def _preserves_whitespace(element) -> bool:
+    return any(node.tag in _PRESERVE_WHITESPACE_TAGS for node in element.iterancestors()) \
+        or element.tag in _PRESERVE_WHITESPACE_TAGS
+
+
+def _bs4_string(text: str, parent) -> str:
+    """等价于 bs4 中的 NavigableString: parent 为包含该字符串的元素"""
+    if not text or text.translate(_ASCII_SPACES) or _preserves_whitespace(parent):
+        return text
+    return "\n" if "\n" in text else " "
+
+
+def _text(element) -> str:
+    """等价于 bs4 的 Tag.text"""
+    texts = _XP_TEXT(element)
+    for index, text in enumerate(texts):
+        if text and not text.translate(_ASCII_SPACES):
+            # XPath 返回的尾部文本 (tail) 的 getparent() 是其前一个元素
+            texts[index] = _bs4_string(text, text.getparent().getparent() if text.is_tail else text.getparent())
+    return "".join(texts)
+
+
+def _node_text(node) -> str:
+    """等价于 bs4 中任意子节点的 .text (文本节点需先经过 _contents 的空白折叠)"""
+    if isinstance(node, str):
+        return node
+    return _text(node) if isinstance(node.tag, str) else ""
+
+
+def _contents(element) -> Iterator:
+    """等价于 bs4 的 Tag.contents: 文本节点为 str (空白按 bs4 折叠), 其余为 lxml 节点"""
+    if element.text is not None:
+        yield _bs4_string(element.text, element)
+    for child in element:
+        yield child
+        if child.tail is not None:
+            yield _bs4_string(child.tail, element)
+
+
+def _clean_contents(element) -> Iterator:
+    """等价于 tools.clean_contents, 惰性求值"""
+    return (node for node in _contents(element) if _node_text(node) != "\n")
+
+
+def _first(nodes: list):
+    return nodes[0] if nodes else None
+
+
+def _lxml_file_info(li_body):
+    """提取文件名和 href"""
+    head = list(islice(_clean_contents(li_body), 2))
+    a_tag = li_body.find(".//a")
+    if len(head) == 1:
+        # 直接提取文件名和 href
+        return _text(a_tag), a_tag.attrib["href"]
+    # 提取文件名和 href
+    return match_clean(_node_text(head[0])), _download_href(a_tag.attrib["onclick"])
+
+
+def _parse_lxml(_html_content: str) -> Tuple[str, Optional[List[dict]]]:
+    """lxml 后端"""
+    try:
+        root = etree.fromstring(_html_content.encode("utf-8"), _HTML_PARSER)
+    except etree.XMLSyntaxError:
+        root = None
+    if root is None:
+        return "unknown", None
+
+    result_lst = []
+
+    content = _first(_XP_CONTENT_2020(root))
+    if content is not None:
+        for tag in _contents(content):
+            if not _is_tag(tag):
+                continue
+            # 过滤空内容
+            text = _text(tag)
+            tag_text = match_clean(text)
+            if tag_text == "" or "免责声明" in tag_text:
+                continue
+            first_content = next(_clean_contents(tag))
+            if not _is_tag(first_content):
+                _merge_sub_item(result_lst, text)
+            elif tag.tag == "p":
+                # 主键
+                try:
+                    matched = match_info(match_clean(_text(tag.find(".//strong"))))
+                    result_lst.append(matched)
+                    logging.debug(matched)
+                except Exception as e:
+                    logging.error(f"Failed to match_info: {e}")
+            elif tag.tag == "ul":
+                # 文件下载
+                filename, href = _lxml_file_info(_first(_XP_FILE_INFO(tag)))
+                _set_file_info(result_lst, filename, href)
+
+        return "new", result_lst
+
+    table = _first(_XP_QUERY_TABLE(root))
+    if table is not None:
+        # 旧版
+        for tr in table.iter("tr"):
+            matched_info = match_info(match_clean(_text(tr)))
+            if "免责声明" not in matched_info["key"]:
+                if matched_info["key"] not in ["中标、成交公告", "合同附件"]:
+                    result_lst.append(matched_info)
+                    logging.debug("matched_info: %s", matched_info)
+                li_body = _first(_XP_FILE_INFO(tr))
+                if li_body is not None:
+                    # 文件下载
+                    filename, href = _lxml_file_info(li_body)
+                    _append_old_file_info(result_lst, matched_info["key"], filename, href)
+
+        return "old", result_lst
+
+    return "unknown", None
+
+
+def detail_fragment_hash(_html_content: str) -> str:
+    """
+    详情页正文 (vT_detail_main) 的 sha256, 用于判断合同是否有变更; 正文之外 (导航/脚本/访问计数等) 的变化不影响结果,
+    找不到正文时对整页计算. 只做 lxml 解析, 比完整解析快得多
+    """
+    data = _html_content.encode("utf-8")
+    try:
+        root = etree.fromstring(data, _HTML_PARSER)
+    except etree.XMLSyntaxError:
+        root = None
+    node = _first(_XP_DETAIL_MAIN(root)) if root is not None else None
+    if node is not None:
+        data = etree.tostring(node, encoding="utf-8", with_tail=False)
+    return hashlib.sha256(data).hexdigest()
+
+
+PARSER_BACKENDS: Dict[str, Callable[[str], Tuple[str, Optional[List[dict]]]]] = {
+    "bs4": _parse_bs4,
+    "lxml": _parse_lxml,
+}
+
+_MODEL_BUILDERS: Dict[str, Callable[[List[dict]], Optional[ContractModel]]] = {
+    "new": _build_new_contract,
+    "old": _build_old_contract,
+}
+
+
+def parse_contract_items(_html_content: str, backend: str = "bs4") -> Tuple[str, Optional[List[dict]]]:
+    """解析详情页 HTML 为条目列表, 返回 (版式, 条目): 版式为 new (content_2020) / old (queryTable) / unknown"""
+    if backend not in PARSER_BACKENDS:
+        raise ValueError(f"Unknown parser backend: {backend}, expected one of {list(PARSER_BACKENDS)}")
+    return PARSER_BACKENDS[backend](_html_content)
+
+
+def parse_contract_layout(_html_content: str, backend: str = "bs4",
+                          strict: bool = False) -> Tuple[str, Optional[ContractRecord]]:
+    """
+    解析详情页 HTML, backend 可选 bs4 / lxml
+
+    默认使用预编译的别名映射直接填充 ContractRecord; strict 时经过 pydantic 完整校验, 校验失败时结果为None
+    (默认模式下缺失的值保留为None, 不会使整条记录失效). 两种模式都会将金额转为 Decimal、日期转为 ISO 格式
+    返回 (版式, 结果), 版式未知时结果为None
+    """
+    layout, result_lst = parse_contract_items(_html_content, backend)
+    if result_lst is None:
+        return layout, None
+    if strict:
+        contract = _MODEL_BUILDERS[layout](result_lst)
+        return layout, None if contract is None else ContractRecord.from_model(contract).normalize()
+    return layout, map_contract(result_lst, layout)
+
+
+def parse_contract_task(_html_content: str, backend: str = "bs4",
+                        strict: bool = False) -> Tuple[str, Optional[ContractRecord], float]:
+    """进程池任务: 返回 (版式, ContractRecord 或None, 解析耗时秒)"""
+    start = time.perf_counter()
+    layout, record = parse_contract_layout(_html_content, backend, strict)
+    return layout, record, time.perf_counter() - start
+
+
+def check_parity(html_lst: List[str], backend: str = "lxml", reference: str = "bs4",
+                 strict: bool = False) -> List[int]:
+    """对比两个后端的解析结果, 返回结果不一致的下标"""
+    mismatched = []
+    for index, html_content in enumerate(html_lst):
+        expected = parse_contract_layout(html_content, reference, strict)
+        actual = parse_contract_layout(html_content, backend, strict)
+        if expected != actual:
+            logging.error(f"Parser mismatch at index {index}: {reference}={expected}, {backend}={actual}")
+            mismatched.append(index)
+    return mismatched
+
+
+def check_mapper(html_lst: List[str], backend: str = "bs4") -> List[int]:
+    """对比预编译映射与 pydantic 严格校验的结果 (严格模式校验失败的文档除外), 返回结果不一致的下标"""
+    mismatched = []
+    for index, html_content in enumerate(html_lst):
+        strict = parse_contract_layout(html_content, backend, strict=True)
+        if strict[1] is None:
+            continue
+        fast = parse_contract_layout(html_content, backend)
+        if fast != strict:
+            logging.error(f"Mapper mismatch at index {index}: strict={strict}, mapper={fast}")
+            mismatched.append(index)
+    return mismatched
+
+
+if __name__ == '__main__':
+    # 用法: python -m tools.parser <html 目录>, 对比 bs4 与 lxml 两个后端的输出, 以及预编译映射与 pydantic 校验的输出
+    import sys
+    from pathlib import Path
+
+    logging.basicConfig(level=logging.INFO)
+    files = sorted(Path(sys.argv[1] if len(sys.argv) > 1 else ".").rglob("*.html"))
+    html_lst = [file.read_text(encoding="utf-8") for file in files]
+    mismatch = sorted(set(check_parity(html_lst)) | set(check_mapper(html_lst)))
+    logging.info(f"Checked {len(files)} documents, mismatched: {[str(files[i]) for i in mismatch]}")
+    sys.exit(1 if mismatch else 0)
@@ -0,0 +1,125 @@
+import asyncio
+import logging
+import time
+from typing import Callable, Dict, Optional
+
+
+class HostRate:
+    """单个限速键 (host 或 host@代理) 的令牌桶与速率"""
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = now
+        self.latency_ewma: Optional[float] = None
+        self.last_decrease = 0.0
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+
+class HostQueue:
+    """单个 host 上等待令牌的请求, 使用代理时包含经过所有代理的请求"""
+
+    def __init__(self):
+        # 优先级 -> 正在等待令牌的请求数
+        self.waiting: Dict[int, int] = {}
+
+    def outranked(self, priority: int) -> bool:
+        """是否有更高优先级 (数值更小) 的请求在等待"""
+        return any(count and waiting < priority for waiting, count in self.waiting.items())
+
+
+class AIMDRateController:
+    """
+    按 host 的自适应限速器 (令牌桶 + AIMD)
+
+    - 响应为 2xx 且延迟正常时加性增加速率: 每秒约增加 increase 个请求/秒
+    - 遇到 429/5xx、超时或延迟突增时乘性降低速率, cooldown 秒内只降低一次
+    - 同一 host 的请求按 priority 分配令牌, 列表页优先于详情页
+    - 传入 proxy 时按 (host, 代理) 分别维护令牌桶与速率, 代理越多可用的总速率越高;
+      优先级仍在同一 host 的全部请求之间比较, 不受代理影响
+    """
+
+    def __init__(self, initial_rate: float = 2.0, min_rate: float = 0.2, max_rate: float = 20.0,
+                 increase: float = 0.5, decrease_factor: float = 0.5, burst: float = 1.0,
+                 latency_spike_ratio: float = 3.0, latency_floor: float = 1.0, ewma_alpha: float = 0.2,
+                 cooldown: float = 1.0, clock: Callable[[], float] = time.monotonic):
+        self.initial_rate = initial_rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.burst = burst
+        self.latency_spike_ratio = latency_spike_ratio
+        self.latency_floor = latency_floor
+        self.ewma_alpha = ewma_alpha
+        self.cooldown = cooldown
+        self.clock = clock
+        # 限速键 (host 或 host@代理) -> 令牌桶
+        self._hosts: Dict[str, HostRate] = {}
+        self._queues: Dict[str, HostQueue] = {}
+
+    @staticmethod
+    def _key(host: str, proxy: Optional[str] = None) -> str:
+        return host if proxy is None else f"{host}@{proxy}"
+
+    def _host(self, key: str) -> HostRate:
+        if key not in self._hosts:
+            self._hosts[key] = HostRate(self.initial_rate, self.burst, self.clock())
+        return self._hosts[key]
+
+    def rate(self, host: str, proxy: Optional[str] = None) -> float:
+        """当前速率 (请求/秒)"""
+        return self._host(self._key(host, proxy)).rate
+
+    def rates(self) -> Dict[str, float]:
+        return {key: state.rate for key, state in self._hosts.items()}
+
+    async def acquire(self, host: str, priority: int = 0, proxy: Optional[str] = None) -> None:
+        """等待令牌, priority 越小越优先: 同一 host 有更高优先级的请求在等待时, 令牌留给高优先级请求"""
+        state = self._host(self._key(host, proxy))
+        queue = self._queues.setdefault(host, HostQueue())
+        queue.waiting[priority] = queue.waiting.get(priority, 0) + 1
+        try:
+            while True:
+                state.refill(self.clock())
+                if queue.outranked(priority):
+                    delay = 1 / state.rate
+                elif state.tokens >= 1:
+                    state.tokens -= 1
+                    return
+                else:
+                    delay = (1 - state.tokens) / state.rate
+                await asyncio.sleep(delay)
+        finally:
+            queue.waiting[priority] -= 1
+
+    def record(self, host: str, status: Optional[int], latency: float, timeout: bool = False,
+               proxy: Optional[str] = None) -> None:
+        """记录一次请求结果并调整速率, status 为 None 表示连接错误"""
+        key = self._key(host, proxy)
+        state = self._host(key)
+        spike = (state.latency_ewma is not None and latency > self.latency_floor
+                 and latency > state.latency_ewma * self.latency_spike_ratio)
+        if not timeout:
+            state.latency_ewma = latency if state.latency_ewma is None else \
+                self.ewma_alpha * latency + (1 - self.ewma_alpha) * state.latency_ewma
+
+        if timeout or status is None or status == 429 or status >= 500 or spike:
+            self._decrease(key, state)
+        elif 200 <= status < 300 or status == 304:
+            # 每个成功请求增加 increase / rate, 即每秒约增加 increase
+            state.rate = min(self.max_rate, state.rate + self.increase / state.rate)
+
+    def _decrease(self, key: str, state: HostRate) -> None:
+        now = self.clock()
+        if now - state.last_decrease < self.cooldown:
+            return
+        state.last_decrease = now
+        state.rate = max(self.min_rate, state.rate * self.decrease_factor)
+        # 降速后清空积攒的令牌
+        state.tokens = min(state.tokens, 0.0)
+        logging.info(f"Rate limit backoff, host: {key}, rate: {state.rate:.2f}/s")
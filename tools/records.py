@@ -0,0 +1,174 @@
+import re
+from decimal import Decimal, InvalidOperation
+from operator import attrgetter
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Type, Union
+
+from pydantic import BaseModel
+
+from tools.pydantic_types import ContractModel, ConversionOldContractModel, MainContractModel
+
+# 输出列, 顺序与 MainContractModel 一致
+COLUMNS: Tuple[str, ...] = tuple(MainContractModel.model_fields.keys())
+
+AMOUNT_COLUMNS = ("unit_price", "contract_amount")
+DATE_COLUMNS = ("contract_sign_date", "contract_announce_date", "signing_date", "publish_date")
+
+_AMOUNT_UNITS = {None: Decimal(1), "万": Decimal(10000), "亿": Decimal(100000000)}
+_AMOUNT_RE = re.compile(r"^(?:人民币)?[￥¥]?([+-]?\d+(?:\.\d+)?)(万|亿)?元?(?:人民币)?$")
+_DATE_RE = re.compile(r"^(\d{4})\s*[年/.-]\s*(\d{1,2})\s*[月/.-]\s*(\d{1,2})\s*日?")
+
+
+def normalize_amount(value):
+    """金额 -> Decimal (单位: 元), 如 '12,500.00元' -> 12500.00, '86.5万元' -> 865000.0; 无法识别时保留原文"""
+    if not isinstance(value, str):
+        return value
+    match = _AMOUNT_RE.match(value.replace(",", "").replace("，", "").replace(" ", ""))
+    if not match:
+        return value
+    try:
+        return Decimal(match.group(1)) * _AMOUNT_UNITS[match.group(2)]
+    except InvalidOperation:
+        return value
+
+
+def normalize_date(value):
+    """日期 -> ISO 格式 (YYYY-MM-DD), 如 '2024年5月6日' -> '2024-05-06'; 无法识别时保留原文"""
+    if not isinstance(value, str):
+        return value
+    match = _DATE_RE.match(value.strip())
+    if not match:
+        return value
+    year, month, day = (int(group) for group in match.groups())
+    return f"{year:04d}-{month:02d}-{day:02d}"
+
+
+class ContractRecord:
+    """
+    轻量的合同记录, 每列一个 slot, 替代 dict / pydantic 模型在流水线中传递
+
+    兼容 dict 的读取接口 (record["contract_URL"] / record.get(...)), row 为按 COLUMNS 排列的定长元组
+    """
+
+    __slots__ = COLUMNS
+
+    _row_getter = attrgetter(*COLUMNS)
+
+    def __init__(self, **values):
+        for name in COLUMNS:
+            setattr(self, name, None)
+        for name, value in values.items():
+            setattr(self, name, value)
+
+    @property
+    def row(self) -> tuple:
+        return self._row_getter(self)
+
+    @classmethod
+    def from_row(cls, row) -> "ContractRecord":
+        record = cls.__new__(cls)
+        for name, value in zip(COLUMNS, row):
+            setattr(record, name, value)
+        return record
+
+    @classmethod
+    def from_model(cls, model: BaseModel) -> "ContractRecord":
+        record = cls()
+        for name in type(model).model_fields:
+            setattr(record, name, getattr(model, name))
+        return record
+
+    def __reduce__(self):
+        # 进程池返回结果时只序列化元组
+        return ContractRecord.from_row, (self.row,)
+
+    def update(self, values: dict) -> "ContractRecord":
+        """按字段名合并 (如列表页的基础信息), 未知字段忽略"""
+        for name, value in values.items():
+            if name in _COLUMN_SET:
+                setattr(self, name, value)
+        return self
+
+    def normalize(self) -> "ContractRecord":
+        for name in AMOUNT_COLUMNS:
+            setattr(self, name, normalize_amount(getattr(self, name)))
+        for name in DATE_COLUMNS:
+            setattr(self, name, normalize_date(getattr(self, name)))
+        return self
+
+    def __getitem__(self, name: str):
+        if name not in _COLUMN_SET:
+            raise KeyError(name)
+        return getattr(self, name)
+
+    def get(self, name: str, default=None):
+        return getattr(self, name) if name in _COLUMN_SET else default
+
+    def keys(self) -> Tuple[str, ...]:
+        return COLUMNS
+
+    def to_dict(self) -> dict:
+        return dict(zip(COLUMNS, self.row))
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, ContractRecord) and self.row == other.row
+
+    def __repr__(self) -> str:
+        return f"ContractRecord({self.to_dict()})"
+
+
+_COLUMN_SET = frozenset(COLUMNS)
+
+
+def _alias_fields(model: Type[BaseModel]) -> Dict[str, Tuple[str, ...]]:
+    """别名 -> 字段名; 旧版中 '所属地域' 同时对应采购人与供应商地址"""
+    mapping: Dict[str, List[str]] = {}
+    for name, field in model.model_fields.items():
+        mapping.setdefault(field.alias or name, []).append(name)
+    return {alias: tuple(names) for alias, names in mapping.items()}
+
+
+# 各版式预编译的 别名 -> 字段 映射, 与 pydantic 按别名取值的结果一致
+LAYOUT_FIELDS: Dict[str, Dict[str, Tuple[str, ...]]] = {
+    "new": _alias_fields(ContractModel),
+    "old": _alias_fields(ConversionOldContractModel),
+}
+
+
+def _flatten(d: dict, parent_key: str = "") -> Iterator[Tuple[str, object]]:
+    """与 flatten_dict 相同的展平规则, 逐项产出而不构建中间字典"""
+    for key, value in d.items():
+        new_key = f"{parent_key}_{key}" if parent_key else key
+        if isinstance(value, dict):
+            yield from _flatten(value, new_key)
+        else:
+            yield new_key, value
+
+
+def map_contract(result_lst: List[dict], layout: str) -> ContractRecord:
+    """条目列表 -> ContractRecord, 不经过 pydantic 校验"""
+    export_dict = {item["key"]: item["value"] for item in result_lst}
+    if layout == "new":
+        export_dict["中标合同"] = export_dict.pop("其他补充事宜")  # 重命名
+    fields = LAYOUT_FIELDS[layout]
+    record = ContractRecord()
+    for key, value in export_dict.items():
+        if not isinstance(value, dict):
+            items = ((key, value),)
+        elif any(isinstance(sub_value, dict) for sub_value in value.values()):
+            items = _flatten(value, key)
+        else:
+            # 常见情况只有一层, 不走递归
+            items = ((f"{key}_{sub_key}", sub_value) for sub_key, sub_value in value.items())
+        for alias, item_value in items:
+            for name in fields.get(alias, ()):
+                setattr(record, name, item_value)
+    return record.normalize()
+
+
+def to_row(record: Union[ContractRecord, dict], headers: Optional[Sequence[str]] = None) -> tuple:
+    """写入端使用的定长行, Decimal 转为字符串"""
+    if isinstance(record, ContractRecord) and (headers is None or tuple(headers) == COLUMNS):
+        values = record.row
+    else:
+        values = tuple(record.get(name) for name in headers or COLUMNS)
+    return tuple(str(value) if isinstance(value, Decimal) else value for value in values)
@@ -0,0 +1,161 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from typing import Awaitable, Callable, Iterable, List, Optional
+
+from aiohttp import ClientError, ClientResponseError
+
+
+def is_retryable(error: BaseException) -> bool:
+    """网络错误、超时、408/429/5xx 可重试, 其余 4xx 直接失败"""
+    if isinstance(error, ClientResponseError):
+        return error.status in (408, 429) or error.status >= 500
+    return isinstance(error, (ClientError, asyncio.TimeoutError))
+
+
+class RetryPolicy:
+    """指数退避 + full jitter 的重试策略"""
+
+    def __init__(self, max_attempts: int = 5, base_delay: float = 1.0, max_delay: float = 60.0,
+                 multiplier: float = 2.0, retry_all_errors: bool = False):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        # 为 True 时解析等非网络错误也重试 (如列表页返回了异常页面)
+        self.retry_all_errors = retry_all_errors
+
+    def delay(self, attempt: int) -> float:
+        """第 attempt 次 (从0开始) 失败后的等待时间"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * self.multiplier ** attempt))
+
+    def should_retry(self, error: BaseException) -> bool:
+        return self.retry_all_errors or is_retryable(error)
+
+
+class CircuitBreaker:
+    """
+    熔断器: 连续 failure_threshold 次站点级错误后打开, 所有请求暂停 recovery_time 秒;
+    之后进入半开状态, 只放行一个探测请求, 成功则关闭, 失败则再次打开
+    """
+
+    def __init__(self, failure_threshold: int = 10, recovery_time: float = 60.0):
+        self.failure_threshold = failure_threshold
+        self.recovery_time = recovery_time
+        self.state = "closed"
+        self.failures = 0
+        self.open_until = 0.0
+        self._probing = False
+
+    async def wait(self) -> None:
+        """熔断打开时等待"""
+        while True:
+            now = time.monotonic()
+            if self.state == "open":
+                if now < self.open_until:
+                    await asyncio.sleep(self.open_until - now)
+                    continue
+                self.state = "half_open"
+            if self.state == "half_open":
+                if self._probing:
+                    await asyncio.sleep(min(1.0, self.recovery_time))
+                    continue
+                self._probing = True
+            return
+
+    def record_success(self) -> None:
+        if self.state != "closed":
+            logging.info("Circuit breaker closed.")
+        self.state = "closed"
+        self.failures = 0
+        self._probing = False
+
+    def record_failure(self, error: BaseException) -> None:
+        if not is_retryable(error):
+            # 404 等页面级错误不代表站点不可用
+            self._probing = False
+            return
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                logging.warning(f"Circuit breaker opened for {self.recovery_time}s after {self.failures} failures.")
+            self.state = "open"
+            self.open_until = time.monotonic() + self.recovery_time
+            self._probing = False
+
+
+async def with_retry(coro_func: Callable[..., Awaitable], *args, policy: RetryPolicy = None,
+                     breaker: Optional[CircuitBreaker] = None, desc: str = "", **kwargs):
+    """按重试策略执行协程, 重试耗尽或不可重试时抛出最后一次的异常"""
+    policy = policy or RetryPolicy()
+    for attempt in range(policy.max_attempts):
+        if breaker is not None:
+            await breaker.wait()
+        try:
+            result = await coro_func(*args, **kwargs)
+        except Exception as e:
+            if breaker is not None:
+                breaker.record_failure(e)
+            if attempt + 1 >= policy.max_attempts or not policy.should_retry(e):
+                logging.error(f"{desc} failed after {attempt + 1} attempts, error: {e!r}")
+                raise
+            delay = policy.delay(attempt)
+            logging.warning(f"{desc} failed, attempt: {attempt + 1}/{policy.max_attempts}, "
+                            f"retry in {delay:.1f}s, error: {e!r}")
+            await asyncio.sleep(delay)
+        else:
+            if breaker is not None:
+                breaker.record_success()
+            return result
+
+
+class DeadLetter:
+    """
+    失败记录 (JSON lines), 后续运行可重新处理
+
+    每行: {"kind": "listing" | "detail" | "attachment", "payload": ..., "error": ..., "time": ...}
+    """
+
+    def __init__(self, path: str = "ccgp_dead_letter.jsonl"):
+        self.path = path
+        self.retry_path = f"{path}.retry"
+        # take() 取出 (将要重新处理) 的记录, 以及未取出、done() 时放回的记录; 未调用 take() 时为None
+        self._taken: Optional[List[dict]] = None
+        self._kept: List[dict] = []
+
+    def add(self, kind: str, payload, error: BaseException) -> None:
+        with open(self.path, mode="a", encoding="utf-8") as file:
+            file.write(json.dumps({"kind": kind, "payload": payload, "error": repr(error), "time": time.time()},
+                                  ensure_ascii=False) + "\n")
+
+    def take(self, kinds: Optional[Iterable[str]] = None) -> List[dict]:
+        """
+        取出待重试的记录, kinds 指定时只取出这些类型; 文件先移动到 .retry, 运行结束后调用 done() 删除,
+        未取出的记录在 done() 时放回 dead letter
+        """
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as src, open(self.retry_path, mode="a", encoding="utf-8") as dst:
+                dst.write(src.read())
+            os.remove(self.path)
+        entries = []
+        if os.path.exists(self.retry_path):
+            with open(self.retry_path, encoding="utf-8") as file:
+                entries = [json.loads(line) for line in file if line.strip()]
+        kinds = set(kinds) if kinds is not None else None
+        self._taken = [entry for entry in entries if kinds is None or entry["kind"] in kinds]
+        self._kept = [entry for entry in entries if kinds is not None and entry["kind"] not in kinds]
+        return self._taken
+
+    def done(self) -> None:
+        """已取出的记录处理完成 (再次失败的已重新写入 dead letter): 删除 .retry, 未取出的记录放回; 未调用 take() 时不做处理"""
+        if self._taken is None:
+            return
+        if self._kept:
+            with open(self.path, mode="a", encoding="utf-8") as file:
+                file.writelines(json.dumps(entry, ensure_ascii=False) + "\n" for entry in self._kept)
+        if os.path.exists(self.retry_path):
+            os.remove(self.retry_path)
+        self._taken, self._kept = None, []
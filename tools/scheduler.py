@@ -0,0 +1,134 @@
+import asyncio
+import datetime
+import logging
+import re
+from typing import AsyncIterable, AsyncIterator, Awaitable, Callable, Dict, Generic, Iterable, List, Optional, Tuple, \
+    TypeVar, Union
+
+from tools.records import normalize_date
+
+T = TypeVar("T")
+
+_ISO_DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+
+def _iso_date(value) -> Optional[str]:
+    """str / date -> 'YYYY-MM-DD', 无法识别时返回None"""
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        value = value.strftime("%Y-%m-%d")
+    value = normalize_date(value)
+    return value if isinstance(value, str) and _ISO_DATE_RE.match(value) else None
+
+
+class DateWindow:
+    """
+    按列表页每行的 signing_date 过滤的日期窗口 [start, end], 两端均含, None 表示不限
+
+    列表页按发布时间倒序, 整页的签订日期都早于 start 时, 之后的列表页也都在窗口之外;
+    无法识别的日期保留, 不参与判断
+    """
+
+    def __init__(self, start=None, end=None):
+        self.start = self._bound(start)
+        self.end = self._bound(end)
+
+    @staticmethod
+    def _bound(value) -> Optional[str]:
+        if value is None:
+            return None
+        date = _iso_date(value)
+        if date is None:
+            raise ValueError(f"Invalid date: {value!r}")
+        return date
+
+    def filter(self, rows: List[dict]) -> Tuple[List[dict], bool]:
+        """返回窗口内的行, 以及整页是否都早于 start"""
+        kept, older = [], 0
+        for row in rows:
+            date = _iso_date(row.get("signing_date"))
+            if date is None:
+                kept.append(row)
+            elif self.start is not None and date < self.start:
+                older += 1
+            elif self.end is None or date <= self.end:
+                kept.append(row)
+        return kept, bool(rows) and older == len(rows)
+
+    def __repr__(self) -> str:
+        return f"DateWindow({self.start} ~ {self.end})"
+
+
+class ListingScheduler(Generic[T]):
+    """
+    列表页调度器: 按页码来源的顺序逐页产出 (页码, 结果), 后台预取之后的 lookahead 页
+
+    - 页码来源可以是普通或异步迭代器 (如 LeaseWorker.pages()), 由独立的任务读取, 不阻塞已完成页的产出
+    - 同时请求的列表页不超过 concurrency 个, 已请求但未被消费的列表页不超过 lookahead 个
+    - 开始请求前检查 should_stop, 已停止翻页时不再请求; 结果为None表示跳过或请求失败
+    """
+
+    def __init__(self, fetch: Callable[[int], Awaitable[Optional[T]]],
+                 pages: Union[Iterable[int], AsyncIterable[int]], lookahead: int = 4, concurrency: int = 2,
+                 should_stop: Optional[Callable[[int], bool]] = None):
+        self.fetch = fetch
+        self.pages = pages
+        self.concurrency = max(concurrency, 1)
+        self.lookahead = max(lookahead, self.concurrency)
+        self.should_stop = should_stop
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._seeded: Dict[int, T] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._error: Optional[BaseException] = None
+
+    def seed(self, page: int, result: T) -> None:
+        """已获取的列表页 (如读取总页数时请求的第 1 页), 不再重复请求"""
+        self._seeded[page] = result
+
+    def buffered(self) -> int:
+        """已请求但未被消费的列表页数量"""
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def _run(self, page: int) -> Optional[T]:
+        if page in self._seeded:
+            return self._seeded.pop(page)
+        async with self._semaphore:
+            if self.should_stop is not None and self.should_stop(page):
+                return None
+            return await self.fetch(page)
+
+    async def _page_source(self) -> AsyncIterator[int]:
+        if hasattr(self.pages, "__aiter__"):
+            async for page in self.pages:
+                yield page
+        else:
+            for page in self.pages:
+                yield page
+
+    async def _produce(self) -> None:
+        try:
+            async for page in self._page_source():
+                # 队列满时在此等待, 预取的页数不超过 lookahead
+                await self._queue.put((page, asyncio.create_task(self._run(page))))
+        except Exception as e:
+            logging.error(f"Listing page source failed, error: {e!r}")
+            self._error = e
+        await self._queue.put(None)
+
+    async def __aiter__(self) -> AsyncIterator[Tuple[int, Optional[T]]]:
+        self._queue = asyncio.Queue(maxsize=self.lookahead)
+        producer = asyncio.create_task(self._produce())
+        try:
+            while True:
+                item = await self._queue.get()
+                if item is None:
+                    break
+                page, task = item
+                yield page, await task
+            if self._error is not None:
+                raise self._error
+        finally:
+            producer.cancel()
+            while not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is not None:
+                    item[1].cancel()
@@ -0,0 +1,315 @@
+import argparse
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import Counter
+from decimal import Decimal
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+from tools.metrics import metrics
+from tools.records import normalize_amount, normalize_date
+
+# 建立倒排索引的文本字段, 在 postings 中以下标表示
+INDEX_FIELDS: Tuple[str, ...] = ("supplier", "purchaser", "item_name", "project_name")
+_FIELD_IDS = {name: index for index, name in enumerate(INDEX_FIELDS)}
+
+# 文本末尾追加的哨兵字符, 使每个字符都是某个二元组的首字符, 单字查询可以按前缀范围检索
+_SENTINEL = "\x1f"
+_MAX_CHAR = "\U0010ffff"
+# 查询时最多使用文档频率最低的几个二元组求交集, 其余由原文校验
+_MAX_QUERY_GRAMS = 3
+
+
+def normalize_text(value) -> str:
+    """全角/半角统一 (NFKC), 转小写并去掉空白, 如 '华为技术有限公司（深圳）' 与 '华为技术有限公司(深圳)' 一致"""
+    if value is None:
+        return ""
+    return "".join(unicodedata.normalize("NFKC", str(value)).lower().split())
+
+
+def ngrams(text: str) -> Set[str]:
+    """字符二元组 (适合中文名称), 文本需先 normalize_text"""
+    if not text:
+        return set()
+    text += _SENTINEL
+    return {text[index:index + 2] for index in range(len(text) - 1)}
+
+
+def _query_grams(query: str) -> Set[str]:
+    """查询串的二元组, 不含哨兵 (查询串可以出现在文本中间)"""
+    return {query[index:index + 2] for index in range(len(query) - 1)}
+
+
+def _amount(value) -> Optional[float]:
+    value = normalize_amount(value)
+    if isinstance(value, (Decimal, int, float)):
+        return float(value)
+    return None
+
+
+def _date(value) -> Optional[str]:
+    value = normalize_date(value)
+    return value if isinstance(value, str) and len(value) == 10 and value[4] == "-" else None
+
+
+class SearchIndex:
+    """
+    合同检索索引 (SQLite), 按 contract_URL 增量更新, 同一合同重复写入时只更新变化的部分
+
+    - postings: (二元组, 字段, 文档) 倒排表, 覆盖 supplier / purchaser / item_name / project_name
+    - gram_stats: 每个二元组的文档频率, 查询时只用最稀有的几个二元组求交集
+    - docs: 文档原文及金额 (元) / 签订日期 (ISO) 边表, 金额与日期建有索引, 用于范围过滤;
+      候选文档用原文做子串校验, 结果与逐行扫描一致
+    """
+
+    def __init__(self, path: str = "ccgp_index.db"):
+        self.path = path
+        self._lock = threading.Lock()
+        # 由线程池中不同的线程调用
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(f"""
+            CREATE TABLE IF NOT EXISTS docs (
+                doc_id INTEGER PRIMARY KEY,
+                url TEXT NOT NULL UNIQUE,
+                {", ".join(f"{name} TEXT" for name in INDEX_FIELDS)},
+                contract_amount REAL,
+                contract_sign_date TEXT,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_docs_amount ON docs (contract_amount);
+            CREATE INDEX IF NOT EXISTS idx_docs_date ON docs (contract_sign_date);
+            CREATE TABLE IF NOT EXISTS postings (
+                gram TEXT NOT NULL,
+                field INTEGER NOT NULL,
+                doc_id INTEGER NOT NULL,
+                PRIMARY KEY (gram, field, doc_id)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS gram_stats (
+                gram TEXT NOT NULL,
+                field INTEGER NOT NULL,
+                df INTEGER NOT NULL,
+                PRIMARY KEY (gram, field)
+            ) WITHOUT ROWID;
+        """)
+        self.conn.commit()
+
+    @staticmethod
+    def _postings(values: Sequence) -> Set[Tuple[str, int]]:
+        return {(gram, field) for field, value in enumerate(values) for gram in ngrams(normalize_text(value))}
+
+    def add(self, records: Iterable) -> int:
+        """写入/更新一批记录 (ContractRecord 或 dict), 返回处理的记录数"""
+        # 同一批中重复的 URL 只保留最后一条
+        latest = {}
+        for record in records:
+            if record.get("contract_URL"):
+                latest[record.get("contract_URL")] = record
+        added, removed, df = [], [], Counter()
+        now = time.time()
+        columns = ", ".join(INDEX_FIELDS)
+        with self._lock, self.conn:
+            for url, record in latest.items():
+                values = tuple(record.get(name) for name in INDEX_FIELDS)
+                sidecars = (_amount(record.get("contract_amount")), _date(record.get("contract_sign_date")))
+                row = self.conn.execute(f"SELECT doc_id, {columns} FROM docs WHERE url = ?", (url,)).fetchone()
+                if row is None:
+                    doc_id = self.conn.execute(
+                        f"INSERT INTO docs (url, {columns}, contract_amount, contract_sign_date, updated_at) "
+                        f"VALUES (?, {', '.join('?' * len(INDEX_FIELDS))}, ?, ?, ?)",
+                        (url, *values, *sidecars, now)).lastrowid
+                    old = set()
+                else:
+                    doc_id = row[0]
+                    self.conn.execute(
+                        f"UPDATE docs SET {', '.join(f'{name} = ?' for name in INDEX_FIELDS)}, contract_amount = ?, "
+                        f"contract_sign_date = ?, updated_at = ? WHERE doc_id = ?", (*values, *sidecars, now, doc_id))
+                    old = self._postings(row[1:])
+                new = self._postings(values)
+                for gram, field in new - old:
+                    added.append((gram, field, doc_id))
+                    df[gram, field] += 1
+                for gram, field in old - new:
+                    removed.append((gram, field, doc_id))
+                    df[gram, field] -= 1
+            # 按主键顺序插入, B 树页的访问更集中
+            added.sort()
+            self.conn.executemany("INSERT OR IGNORE INTO postings (gram, field, doc_id) VALUES (?, ?, ?)", added)
+            self.conn.executemany("DELETE FROM postings WHERE gram = ? AND field = ? AND doc_id = ?", removed)
+            self.conn.executemany(
+                "INSERT INTO gram_stats (gram, field, df) VALUES (?, ?, ?) "
+                "ON CONFLICT(gram, field) DO UPDATE SET df = df + excluded.df",
+                [(gram, field, delta) for (gram, field), delta in df.items() if delta])
+        return len(latest)
+
+    def _candidates(self, fields: Tuple[int, ...], query: str) -> Optional[Tuple[str, list]]:
+        """候选文档的子查询 (SQL, 参数); 查询串中有不存在的二元组时返回None"""
+        field_sql = f"field IN ({', '.join('?' * len(fields))})"
+        if len(query) == 1:
+            return (f"SELECT doc_id FROM postings WHERE gram >= ? AND gram < ? AND {field_sql}",
+                    [query, query + _MAX_CHAR, *fields])
+        frequencies = []
+        for gram in _query_grams(query):
+            row = self.conn.execute(f"SELECT COALESCE(SUM(df), 0) FROM gram_stats WHERE gram = ? AND {field_sql}",
+                                    (gram, *fields)).fetchone()
+            if not row[0]:
+                return None
+            frequencies.append((row[0], gram))
+        grams = [gram for _, gram in sorted(frequencies)[:_MAX_QUERY_GRAMS]]
+        sql = " INTERSECT ".join(f"SELECT doc_id FROM postings WHERE gram = ? AND {field_sql}" for _ in grams)
+        params = [param for gram in grams for param in (gram, *fields)]
+        return sql, params
+
+    def _iter(self, text_filters: Dict[Tuple[str, ...], str], min_amount: Optional[float],
+              max_amount: Optional[float], signed_after, signed_before) -> Iterator[dict]:
+        conditions, params, checks = [], [], []
+        for names, query in text_filters.items():
+            query = normalize_text(query)
+            if not query:
+                continue
+            fields = tuple(_FIELD_IDS[name] for name in names)
+            candidates = self._candidates(fields, query)
+            if candidates is None:
+                return
+            conditions.append(f"doc_id IN ({candidates[0]})")
+            params.extend(candidates[1])
+            checks.append((names, query))
+        for column, operator, value in (("contract_amount", ">=", _amount(min_amount)),
+                                        ("contract_amount", "<=", _amount(max_amount)),
+                                        ("contract_sign_date", ">=", _date(signed_after)),
+                                        ("contract_sign_date", "<=", _date(signed_before))):
+            if value is not None:
+                conditions.append(f"{column} {operator} ?")
+                params.append(value)
+
+        sql = (f"SELECT url, {', '.join(INDEX_FIELDS)}, contract_amount, contract_sign_date FROM docs"
+               f"{' WHERE ' + ' AND '.join(conditions) if conditions else ''} "
+               f"ORDER BY contract_sign_date DESC, doc_id DESC")
+        columns = ("contract_URL", *INDEX_FIELDS, "contract_amount", "contract_sign_date")
+        for row in self.conn.execute(sql, params):
+            doc = dict(zip(columns, row))
+            # 二元组交集可能有误报 (如二元组出现在不同位置), 用原文确认
+            if all(any(query in normalize_text(doc[name]) for name in names) for names, query in checks):
+                yield doc
+
+    def search(self, supplier: Optional[str] = None, purchaser: Optional[str] = None, item_name: Optional[str] = None,
+               project_name: Optional[str] = None, keyword: Optional[str] = None, min_amount=None, max_amount=None,
+               signed_after=None, signed_before=None, limit: Optional[int] = 100) -> List[dict]:
+        """
+        按子串检索 (忽略全半角/大小写/空白), 各条件之间为 AND; keyword 匹配任一索引字段;
+        金额单位为元, 日期为 ISO 格式或 '2024年5月6日' 等可识别的格式; 结果按签订日期倒序
+        """
+        text_filters = {(name,): value for name, value in (("supplier", supplier), ("purchaser", purchaser),
+                                                           ("item_name", item_name), ("project_name", project_name))
+                        if value}
+        if keyword:
+            text_filters[INDEX_FIELDS] = keyword
+        results = []
+        with self._lock:
+            for doc in self._iter(text_filters, min_amount, max_amount, signed_after, signed_before):
+                results.append(doc)
+                if limit is not None and len(results) >= limit:
+                    break
+        return results
+
+    def stats(self) -> dict:
+        with self._lock:
+            docs = self.conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+            grams = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(df), 0) FROM gram_stats").fetchone()
+        return {"docs": docs, "grams": grams[0], "postings": grams[1]}
+
+    def close(self) -> None:
+        with self._lock:
+            self.conn.commit()
+            self.conn.close()
+
+
+async def index_records(queue: asyncio.Queue, index: SearchIndex, batch_size: int = 400) -> int:
+    """
+    索引阶段: 从队列中取出解析后的记录更新索引, None 为结束信号; 更新在线程中执行, 不阻塞事件循环
+
+    队列中没有更多记录或满 batch_size 条时提交一批, 返回处理的记录数
+    """
+    batch, total = [], 0
+    while True:
+        record = await queue.get()
+        if record is not None:
+            batch.append(record)
+        if batch and (record is None or len(batch) >= batch_size or queue.empty()):
+            with metrics.timer("stage_seconds", stage="index"):
+                await asyncio.to_thread(index.add, batch)
+            metrics.inc("rows_indexed_total", len(batch))
+            total += len(batch)
+            batch = []
+        queue.task_done()
+        if record is None:
+            return total
+
+
+def build_index(inputs: List[str], path: str = "ccgp_index.db", batch_size: int = 10000) -> int:
+    """从已有的输出文件 (csv / parquet / sqlite, 含分片) 建立或更新索引, 返回处理的记录数"""
+    from tools.sink import output_files, read_records
+
+    index = SearchIndex(path)
+    batch, total = [], 0
+    for input_path in inputs:
+        for file_path in output_files(input_path):
+            for record in read_records(file_path):
+                batch.append(record)
+                if len(batch) >= batch_size:
+                    total += index.add(batch)
+                    batch = []
+            logging.info(f"Indexed {file_path}, records: {total + len(batch)}")
+    if batch:
+        total += index.add(batch)
+    index.close()
+    return total
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="合同检索索引: 建立 / 查询")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="从输出文件建立或更新索引")
+    build_parser.add_argument("index")
+    build_parser.add_argument("inputs", nargs="+")
+    query_parser = subparsers.add_parser("query", help="查询, 每行输出一条 JSON")
+    query_parser.add_argument("index")
+    query_parser.add_argument("--supplier")
+    query_parser.add_argument("--purchaser")
+    query_parser.add_argument("--item", dest="item_name")
+    query_parser.add_argument("--project", dest="project_name")
+    query_parser.add_argument("--keyword", help="匹配任一字段")
+    query_parser.add_argument("--min-amount", type=float, help="元")
+    query_parser.add_argument("--max-amount", type=float, help="元")
+    query_parser.add_argument("--after", dest="signed_after", help="签订日期下限, 如 2024-01-01")
+    query_parser.add_argument("--before", dest="signed_before", help="签订日期上限")
+    query_parser.add_argument("--limit", type=int, default=100, help="0 表示不限")
+    query_parser.add_argument("--count", action="store_true", help="只输出数量")
+    stats_parser = subparsers.add_parser("stats")
+    stats_parser.add_argument("index")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "build":
+        print(f"indexed: {build_index(args.inputs, args.index)}")
+    elif args.command == "query":
+        search_index = SearchIndex(args.index)
+        start = time.perf_counter()
+        docs = search_index.search(supplier=args.supplier, purchaser=args.purchaser, item_name=args.item_name,
+                                   project_name=args.project_name, keyword=args.keyword, min_amount=args.min_amount,
+                                   max_amount=args.max_amount, signed_after=args.signed_after,
+                                   signed_before=args.signed_before, limit=None if args.count else args.limit or None)
+        if args.count:
+            print(len(docs))
+        else:
+            for doc in docs:
+                print(json.dumps(doc, ensure_ascii=False))
+        logging.info(f"{len(docs)} results in {(time.perf_counter() - start) * 1000:.1f}ms")
+        search_index.close()
+    else:
+        print(json.dumps(SearchIndex(args.index).stats(), ensure_ascii=False))
@@ -0,0 +1,373 @@
+import asyncio
+import csv
+import glob
+import gzip
+import io
+import logging
+import os
+import re
+import sqlite3
+from typing import Callable, Iterable, Iterator, List, Optional
+
+try:
+    import zstandard
+except ImportError:  # 可选依赖
+    zstandard = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # 可选依赖
+    pa = pq = None
+
+from tools.metrics import metrics
+from tools.records import COLUMNS, to_row
+
+
+def contract_columns() -> List[str]:
+    """输出列, 顺序与 MainContractModel().model_dump() 一致"""
+    return list(COLUMNS)
+
+
+class Sink:
+    """
+    批量写入端基类, 所有方法都是同步阻塞的, 由 write_records 放到线程中调用
+
+    记录可以是 ContractRecord 或 dict, 写入时按 headers 转为定长行
+
+    路径形如 ccgp.csv.gz, 设置 max_rows / max_bytes 时按 ccgp-00000.csv.gz 分片轮转,
+    分片编号接在已有分片之后, 不会覆盖之前的输出
+    """
+
+    def __init__(self, path: str, max_rows: Optional[int] = None, max_bytes: Optional[int] = None):
+        self.path = path
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.sharded = max_rows is not None or max_bytes is not None
+        directory, filename = os.path.split(path)
+        stem, dot, suffix = filename.partition(".")
+        self._stem = os.path.join(directory, stem)
+        self._suffix = f"{dot}{suffix}"
+        self.shard_index = self._last_shard_index() + 1 if self.sharded else 0
+        self.shard_rows = 0
+
+    def _last_shard_index(self) -> int:
+        pattern = re.compile(re.escape(os.path.basename(self._stem)) + r"-(\d{5})" + re.escape(self._suffix) + "$")
+        indexes = [int(match.group(1)) for match in map(pattern.search, glob.glob(f"{self._stem}-*{self._suffix}"))
+                   if match]
+        return max(indexes, default=-1)
+
+    @property
+    def shard_path(self) -> str:
+        return f"{self._stem}-{self.shard_index:05d}{self._suffix}" if self.sharded else self.path
+
+    def _should_rotate(self) -> bool:
+        if not self.sharded:
+            return False
+        if self.max_rows is not None and self.shard_rows >= self.max_rows:
+            return True
+        return self.max_bytes is not None and os.path.getsize(self.shard_path) >= self.max_bytes
+
+    def _rotate(self) -> List[dict]:
+        durable = self._close_shard()
+        logging.info(f"Output shard finished: {self.shard_path}, rows: {self.shard_rows}")
+        self.shard_index += 1
+        self.shard_rows = 0
+        return durable
+
+    def write_batch(self, records: List[dict]) -> List[dict]:
+        """写入一批记录, 返回已经落盘 (可安全标记为完成) 的记录"""
+        durable = self._write(records)
+        self.shard_rows += len(records)
+        if self._should_rotate():
+            durable = durable + self._rotate()
+        return durable
+
+    def close(self) -> List[dict]:
+        return self._close_shard()
+
+    def _write(self, records: List[dict]) -> List[dict]:
+        raise NotImplementedError
+
+    def _close_shard(self) -> List[dict]:
+        raise NotImplementedError
+
+
+class CsvSink(Sink):
+    """CSV 写入端, compression 可选 None / gzip / zstd, 每批写入后 flush + fsync"""
+
+    def __init__(self, path: str, headers: List[str], compression: Optional[str] = None, append: bool = False,
+                 max_rows: Optional[int] = None, max_bytes: Optional[int] = None, compress_level: int = 6):
+        if compression not in (None, "gzip", "zstd"):
+            raise ValueError(f"Unknown csv compression: {compression}")
+        if compression == "zstd" and zstandard is None:
+            raise ImportError("zstd compression requires `pip install zstandard`")
+        super().__init__(path, max_rows=max_rows, max_bytes=max_bytes)
+        self.headers = tuple(headers)
+        self.compression = compression
+        self.append = append
+        self.compress_level = compress_level
+        self._raw = self._stream = self._text = self._writer = None
+        if compression is not None and append and not self.sharded and os.path.exists(path) \
+                and os.path.getsize(path) > 0:
+            # 上次运行被强制中断时压缩流可能没有结尾, 在其后追加会使整个文件无法解压; 续写到新的分片
+            self.sharded = True
+            self.shard_index = self._last_shard_index() + 1
+            logging.info(f"Compressed output {path} exists, continue in {self.shard_path}")
+
+    def _open(self) -> None:
+        path = self.shard_path
+        # 续爬时追加写入, 已有内容时不再写表头; 压缩输出不会追加到已有文件 (见 __init__)
+        append = self.append and os.path.exists(path) and os.path.getsize(path) > 0
+        self._raw = open(path, mode="ab" if append else "wb")
+        if self.compression == "gzip":
+            self._stream = gzip.GzipFile(fileobj=self._raw, mode="wb", compresslevel=self.compress_level)
+        elif self.compression == "zstd":
+            self._stream = zstandard.ZstdCompressor(level=self.compress_level).stream_writer(self._raw, closefd=False)
+        else:
+            self._stream = self._raw
+        self._text = io.TextIOWrapper(self._stream, encoding="utf-8", newline="")
+        self._writer = csv.writer(self._text)
+        if not append:
+            self._writer.writerow(self.headers)
+
+    def _flush(self) -> None:
+        self._text.flush()
+        if self._stream is not self._raw:
+            self._stream.flush()
+        self._raw.flush()
+        os.fsync(self._raw.fileno())
+
+    def _write(self, records: List[dict]) -> List[dict]:
+        if self._writer is None:
+            self._open()
+        headers = self.headers
+        self._writer.writerows([to_row(record, headers) for record in records])
+        self._flush()
+        return records
+
+    def _close_shard(self) -> List[dict]:
+        if self._writer is None:
+            return []
+        self._flush()
+        self._text.close()
+        if not self._raw.closed:
+            self._raw.close()
+        self._raw = self._stream = self._text = self._writer = None
+        return []
+
+
+class ParquetSink(Sink):
+    """
+    Parquet 写入端, schema 由 MainContractModel 生成 (全部为可空字符串), 每批写为一个 row group
+
+    Parquet 文件在关闭 (写入 footer) 后才可读, 因此记录在分片关闭时才返回为已落盘;
+    未指定分片大小时默认每 100000 行轮转一次
+    """
+
+    def __init__(self, path: str, headers: List[str], compression: str = "zstd",
+                 max_rows: Optional[int] = None, max_bytes: Optional[int] = None):
+        if pa is None:
+            raise ImportError("parquet output requires `pip install pyarrow`")
+        if max_rows is None and max_bytes is None:
+            max_rows = 100000
+        super().__init__(path, max_rows=max_rows, max_bytes=max_bytes)
+        self.headers = tuple(headers)
+        self.schema = pa.schema([pa.field(name, pa.string()) for name in headers])
+        self.compression = compression
+        self._writer = None
+        self._pending: List[dict] = []
+
+    def _write(self, records: List[dict]) -> List[dict]:
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(self.shard_path, self.schema, compression=self.compression)
+        columns = zip(*[to_row(record, self.headers) for record in records])
+        self._writer.write_table(pa.Table.from_arrays([pa.array(column, type=pa.string()) for column in columns],
+                                                      schema=self.schema))
+        self._pending.extend(records)
+        return []
+
+    def _close_shard(self) -> List[dict]:
+        if self._writer is None:
+            return []
+        self._writer.close()
+        self._writer = None
+        durable, self._pending = self._pending, []
+        return durable
+
+
+class SqliteSink(Sink):
+    """
+    SQLite 写入端: 以 contract_URL 为主键 upsert, 重复爬取的合同原地更新而不是追加重复行;
+    每批在一个事务中写入, 并为常用查询字段建立索引
+    """
+
+    INDEX_COLUMNS = ["contract_id", "purchaser", "supplier", "contract_sign_date", "procurement_method"]
+
+    def __init__(self, path: str, headers: List[str], table: str = "contracts"):
+        super().__init__(path)
+        if "contract_URL" not in headers:
+            raise ValueError("sqlite output requires the contract_URL column")
+        self.headers = tuple(headers)
+        self.table = table
+        self._conn: Optional[sqlite3.Connection] = None
+        columns = ", ".join(f'"{name}"' for name in headers)
+        updates = ", ".join(f'"{name}" = excluded."{name}"' for name in headers if name != "contract_URL")
+        self._upsert_sql = (f'INSERT INTO "{table}" ({columns}) VALUES ({", ".join("?" * len(headers))}) '
+                            f'ON CONFLICT("contract_URL") DO UPDATE SET {updates}')
+
+    def _open(self) -> None:
+        # 由线程池中不同的线程调用, 写入由 write_records 串行化
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        columns = ", ".join(f'"{name}" TEXT{" PRIMARY KEY" if name == "contract_URL" else ""}'
+                            for name in self.headers)
+        self._conn.execute(f'CREATE TABLE IF NOT EXISTS "{self.table}" ({columns})')
+        for name in self.INDEX_COLUMNS:
+            if name in self.headers:
+                self._conn.execute(f'CREATE INDEX IF NOT EXISTS "idx_{self.table}_{name}" ON "{self.table}" ("{name}")')
+        self._conn.commit()
+
+    def _write(self, records: List[dict]) -> List[dict]:
+        if self._conn is None:
+            self._open()
+        with self._conn:
+            self._conn.executemany(self._upsert_sql, [to_row(record, self.headers) for record in records])
+        return records
+
+    def _close_shard(self) -> List[dict]:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+        return []
+
+
+def make_sink(path: str, output_format: str = "csv", headers: Optional[List[str]] = None,
+              compression: Optional[str] = None, append: bool = False,
+              max_rows: Optional[int] = None, max_bytes: Optional[int] = None) -> Sink:
+    """output_format: csv / parquet / sqlite; csv 的 compression 可选 gzip / zstd"""
+    headers = headers or contract_columns()
+    if output_format == "csv":
+        return CsvSink(path, headers, compression=compression, append=append, max_rows=max_rows, max_bytes=max_bytes)
+    if output_format == "parquet":
+        return ParquetSink(path, headers, compression=compression or "zstd", max_rows=max_rows, max_bytes=max_bytes)
+    if output_format == "sqlite":
+        return SqliteSink(path, headers)
+    raise ValueError(f"Unknown output format: {output_format}")
+
+
+async def write_records(queue: asyncio.Queue, sink: Sink, batch_size: int = 400, flush_interval: float = 5.0,
+                        on_flush: Optional[Callable[[List[dict]], None]] = None) -> int:
+    """
+    从队列中批量取出记录写入 sink, None 为结束信号; 写入/flush 在线程中执行, 不阻塞事件循环
+
+    满 batch_size 条或距上次写入超过 flush_interval 秒时写入一批, 返回写入的总行数
+    """
+    loop = asyncio.get_running_loop()
+    batch, total, last_flush = [], 0, loop.time()
+
+    async def flush():
+        nonlocal batch, last_flush
+        if batch:
+            with metrics.timer("stage_seconds", stage="write"):
+                durable = await asyncio.to_thread(sink.write_batch, batch)
+            metrics.inc("rows_written_total", len(batch))
+            if on_flush is not None and durable:
+                on_flush(durable)
+        batch, last_flush = [], loop.time()
+
+    while True:
+        try:
+            data = await asyncio.wait_for(queue.get(), timeout=max(0.0, flush_interval - (loop.time() - last_flush)))
+        except asyncio.TimeoutError:
+            await flush()
+            continue
+        if data is None:
+            # None作为结束信号
+            break
+        batch.append(data)
+        total += 1
+        queue.task_done()
+        if len(batch) >= batch_size:
+            await flush()
+
+    await flush()
+    durable = await asyncio.to_thread(sink.close)
+    if on_flush is not None and durable:
+        on_flush(durable)
+    return total
+
+
+def output_files(path: str) -> List[str]:
+    """输出路径对应的已有文件: path 本身及按编号排序的 stem-00000.suffix 分片"""
+    directory, filename = os.path.split(path)
+    stem, dot, suffix = filename.partition(".")
+    pattern = re.compile(re.escape(stem) + r"-(\d{5})" + re.escape(f"{dot}{suffix}") + "$")
+    shards = sorted(file_path for file_path in glob.glob(os.path.join(directory, f"{stem}-*{dot}{suffix}"))
+                    if pattern.search(os.path.basename(file_path)))
+    return ([path] if os.path.exists(path) else []) + shards
+
+
+def read_records(path: str, table: str = "contracts") -> Iterator[dict]:
+    """按扩展名读取 csv / csv.gz / csv.zst / parquet / sqlite 输出文件"""
+    if path.endswith(".parquet"):
+        if pq is None:
+            raise ImportError("parquet input requires `pip install pyarrow`")
+        for batch in pq.ParquetFile(path).iter_batches():
+            yield from batch.to_pylist()
+        return
+    if path.endswith((".db", ".sqlite", ".sqlite3")):
+        conn = sqlite3.connect(path)
+        conn.row_factory = sqlite3.Row
+        try:
+            for row in conn.execute(f'SELECT * FROM "{table}"'):
+                yield dict(row)
+        finally:
+            conn.close()
+        return
+    with open(path, mode="rb") as raw:
+        if path.endswith(".gz"):
+            stream = gzip.GzipFile(fileobj=raw, mode="rb")
+        elif path.endswith(".zst"):
+            if zstandard is None:
+                raise ImportError("zstd input requires `pip install zstandard`")
+            stream = zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True)
+        else:
+            stream = raw
+        try:
+            yield from csv.DictReader(io.TextIOWrapper(stream, encoding="utf-8", newline=""))
+        except (EOFError, *((zstandard.ZstdError,) if zstandard is not None else ())) as e:
+            # 写入时被强制中断, 压缩流没有结尾; 之前每批 flush 的行仍可读取
+            logging.warning(f"Truncated compressed output {path}, rows after the last flush are lost: {e!r}")
+
+
+def merge_outputs(inputs: Iterable[str], export_path: str, output_format: str = "csv",
+                  compression: Optional[str] = None, batch_size: int = 10000) -> int:
+    """
+    合并多个节点 (或多次运行) 的输出为一个文件, 按 contract_URL 去重 (保留先出现的记录);
+    每个输入路径会展开为其全部分片, 返回写入的行数
+    """
+    sink = make_sink(export_path, output_format, compression=compression)
+    seen, batch, total = set(), [], 0
+    for path in inputs:
+        files = output_files(path)
+        if not files:
+            logging.warning(f"No output found for {path}")
+        for file_path in files:
+            for record in read_records(file_path):
+                url = record.get("contract_URL")
+                if url in seen:
+                    continue
+                seen.add(url)
+                batch.append(record)
+                if len(batch) >= batch_size:
+                    sink.write_batch(batch)
+                    total += len(batch)
+                    batch = []
+            logging.info(f"Merged {file_path}, rows: {total + len(batch)}")
+    if batch:
+        sink.write_batch(batch)
+        total += len(batch)
+    sink.close()
+    return total
@@ -0,0 +1,298 @@
+import hashlib
+import logging
+import sqlite3
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+
+def contract_hash(contract_id: Optional[str]) -> Optional[str]:
+    """合同编号哈希, 用于跨 URL 去重"""
+    if not contract_id:
+        return None
+    return hashlib.sha1(contract_id.encode("utf-8")).hexdigest()
+
+
+class PageVersion:
+    """详情页上次的版本: 响应中的 ETag / Last-Modified 及正文哈希 (tools.parser.detail_fragment_hash)"""
+
+    __slots__ = ("etag", "last_modified", "content_hash")
+
+    def __init__(self, etag: Optional[str] = None, last_modified: Optional[str] = None,
+                 content_hash: Optional[str] = None):
+        self.etag = etag
+        self.last_modified = last_modified
+        self.content_hash = content_hash
+
+    def __repr__(self) -> str:
+        return f"PageVersion(etag={self.etag!r}, last_modified={self.last_modified!r}, hash={self.content_hash})"
+
+
+class CrawlState:
+    """
+    持久化的已爬取索引 (SQLite)
+
+    - contracts: 已下载 (fetched) / 已解析并写入 (parsed) 的详情页 URL, 以及合同编号哈希
+    - runs / pages: 每次运行已完成的列表页, 用于中断后断点续爬
+    - versions: 详情页的 ETag / Last-Modified / 正文哈希, 重新检查时用于条件请求与变更判断
+    - changes: 检测到的合同变更 (旧哈希 -> 新哈希)
+    """
+
+    def __init__(self, db_path: str = "ccgp_state.db"):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self._create_tables()
+        self.run_id: Optional[int] = None
+        self.resumed = False
+
+    def _create_tables(self) -> None:
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS contracts (
+                url TEXT PRIMARY KEY,
+                contract_hash TEXT,
+                status TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_contracts_hash ON contracts (contract_hash);
+            CREATE TABLE IF NOT EXISTS runs (
+                run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                started_at REAL NOT NULL,
+                finished_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS pages (
+                run_id INTEGER NOT NULL,
+                page INTEGER NOT NULL,
+                completed_at REAL NOT NULL,
+                PRIMARY KEY (run_id, page)
+            );
+            CREATE TABLE IF NOT EXISTS versions (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                content_hash TEXT,
+                checked_at REAL NOT NULL,
+                changed_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS changes (
+                url TEXT NOT NULL,
+                detected_at REAL NOT NULL,
+                old_hash TEXT,
+                new_hash TEXT,
+                PRIMARY KEY (url, detected_at)
+            );
+        """)
+        self.conn.commit()
+
+    def start_run(self, resume: bool = True) -> int:
+        """开始一次运行, resume 时沿用上一次未完成的运行"""
+        row = self.conn.execute("SELECT run_id, finished_at FROM runs ORDER BY run_id DESC LIMIT 1").fetchone()
+        if resume and row is not None and row[1] is None:
+            self.run_id = row[0]
+            self.resumed = True
+            logging.info(f"Resume unfinished run: {self.run_id}, completed pages: {len(self.completed_pages())}")
+        else:
+            self.run_id = self.conn.execute("INSERT INTO runs (started_at) VALUES (?)", (time.time(),)).lastrowid
+            self.resumed = False
+            self.conn.commit()
+        return self.run_id
+
+    def finish_run(self) -> None:
+        self.conn.execute("UPDATE runs SET finished_at = ? WHERE run_id = ?", (time.time(), self.run_id))
+        self.conn.commit()
+
+    def completed_pages(self) -> Set[int]:
+        rows = self.conn.execute("SELECT page FROM pages WHERE run_id = ?", (self.run_id,))
+        return {row[0] for row in rows}
+
+    def mark_page_done(self, page: int) -> None:
+        self.conn.execute("INSERT OR REPLACE INTO pages (run_id, page, completed_at) VALUES (?, ?, ?)",
+                          (self.run_id, page, time.time()))
+        self.conn.commit()
+
+    def known_urls(self, urls: Iterable[str]) -> Set[str]:
+        """返回已解析并写入的 URL"""
+        urls = list(urls)
+        if not urls:
+            return set()
+        placeholders = ",".join("?" * len(urls))
+        rows = self.conn.execute(
+            f"SELECT url FROM contracts WHERE status = 'parsed' AND url IN ({placeholders})", urls)
+        return {row[0] for row in rows}
+
+    def mark_fetched(self, url: str) -> None:
+        """记录已下载, 与下一次 mark_parsed 一起提交"""
+        self.conn.execute(
+            "INSERT INTO contracts (url, status, updated_at) VALUES (?, 'fetched', ?) "
+            "ON CONFLICT(url) DO UPDATE SET updated_at = excluded.updated_at WHERE status != 'parsed'",
+            (url, time.time()))
+
+    def mark_parsed(self, records: List[dict]) -> None:
+        """批量记录已解析并落盘的记录"""
+        now = time.time()
+        self.conn.executemany(
+            "INSERT INTO contracts (url, contract_hash, status, updated_at) VALUES (?, ?, 'parsed', ?) "
+            "ON CONFLICT(url) DO UPDATE SET contract_hash = excluded.contract_hash, status = 'parsed', "
+            "updated_at = excluded.updated_at",
+            [(record["contract_URL"], contract_hash(record.get("contract_id")), now) for record in records])
+        self.conn.commit()
+
+    def page_version(self, url: str) -> Optional[PageVersion]:
+        row = self.conn.execute("SELECT etag, last_modified, content_hash FROM versions WHERE url = ?",
+                                (url,)).fetchone()
+        return PageVersion(*row) if row is not None else None
+
+    def touch_version(self, url: str, etag: Optional[str] = None, last_modified: Optional[str] = None) -> None:
+        """内容未变: 只更新检查时间 (及新的校验信息), 与下一次 mark_parsed 一起提交"""
+        self.conn.execute(
+            "UPDATE versions SET checked_at = ?, etag = COALESCE(?, etag), "
+            "last_modified = COALESCE(?, last_modified) WHERE url = ?", (time.time(), etag, last_modified, url))
+
+    def save_versions(self, versions: List[Tuple[str, PageVersion, Optional[PageVersion]]]) -> None:
+        """记录已落盘记录的新版本, 旧版本存在且哈希不同时记为一次变更; 参数为 (url, 新版本, 旧版本)"""
+        now = time.time()
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO versions (url, etag, last_modified, content_hash, checked_at, changed_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [(url, version.etag, version.last_modified, version.content_hash, now, now)
+             for url, version, _ in versions])
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO changes (url, detected_at, old_hash, new_hash) VALUES (?, ?, ?, ?)",
+            [(url, now, previous.content_hash, version.content_hash) for url, version, previous in versions
+             if previous is not None and previous.content_hash != version.content_hash])
+        self.conn.commit()
+
+    def changes(self, since: float = 0.0) -> List[Tuple[str, float, Optional[str], Optional[str]]]:
+        """since (时间戳) 之后检测到的变更: (url, detected_at, old_hash, new_hash)"""
+        return self.conn.execute("SELECT url, detected_at, old_hash, new_hash FROM changes WHERE detected_at >= ? "
+                                 "ORDER BY detected_at", (since,)).fetchall()
+
+    def close(self) -> None:
+        self.conn.commit()
+        self.conn.close()
+
+
+class PageTracker:
+    """
+    跟踪每个列表页的详情页是否已全部落盘
+
+    列表页中的全部详情页写入并 flush 后才记为完成, 保证中断后可以从断点继续;
+    遇到全部为已知合同的列表页 (或超出日期窗口, 见 stop_at) 时记录 stop_page, 后续 (更旧的) 列表页不再请求
+
+    on_page_done 可设置为回调函数, 在列表页处理完成 (含放弃) 时以页码调用, 分布式模式下用于完成租约
+
+    recheck 时已爬取的合同也重新检查 (用于发现合同变更), 不因整页已知而停止翻页;
+    详情页的新版本 (stage_version) 在记录落盘后才保存, 中断后不会把未落盘的变更当作已处理
+    """
+
+    def __init__(self, state: Optional[CrawlState] = None, on_page_done: Optional[Callable[[int], None]] = None,
+                 recheck: bool = False):
+        self.state = state
+        self.on_page_done = on_page_done
+        self.recheck = recheck
+        self._versions: Dict[str, Tuple[PageVersion, Optional[PageVersion]]] = {}
+        self.stop_page: Optional[int] = None
+        self._pending: Dict[int, Set[str]] = {}
+        self._url_pages: Dict[str, Set[int]] = {}
+
+    def completed_pages(self) -> Set[int]:
+        return self.state.completed_pages() if self.state is not None else set()
+
+    def should_stop(self, page: int) -> bool:
+        return self.stop_page is not None and page > self.stop_page
+
+    def stop_at(self, page: int, reason: str) -> None:
+        """page 之后的列表页不再请求"""
+        if self.stop_page is None or page < self.stop_page:
+            self.stop_page = page
+            logging.info(f"Listing page {page} {reason}, stop paging.")
+
+    def filter_new(self, page: int, base_lst: List[dict]) -> List[dict]:
+        """过滤已爬取的合同, 并登记该页待完成的 URL"""
+        if self.state is None or self.recheck:
+            new_lst = base_lst
+        else:
+            known = self.state.known_urls(base_data["contract_URL"] for base_data in base_lst)
+            new_lst = [base_data for base_data in base_lst if base_data["contract_URL"] not in known]
+            if base_lst and not new_lst:
+                # 整页都是已知合同, 之后的列表页更旧, 停止翻页
+                self.stop_at(page, "contains only known contracts")
+        if new_lst:
+            self._pending[page] = {base_data["contract_URL"] for base_data in new_lst}
+            fresh = []
+            for base_data in new_lst:
+                # 翻页过程中有新合同发布时, 同一 URL 可能出现在相邻两页: 只返回一次, 但两页都要等它处理完成
+                if base_data["contract_URL"] not in self._url_pages:
+                    fresh.append(base_data)
+                self._url_pages.setdefault(base_data["contract_URL"], set()).add(page)
+            new_lst = fresh
+        else:
+            self._finish_page(page)
+        return new_lst
+
+    def filter_retry(self, base_lst: List[dict]) -> List[dict]:
+        """
+        登记从 dead letter 重新处理的详情页 (不属于任何列表页), 返回去重并过滤已爬取合同后的列表;
+        之后列表页中出现同一 URL 时不再重复返回, 该列表页等它处理完成
+        """
+        if self.state is not None and not self.recheck:
+            known = self.state.known_urls(base_data["contract_URL"] for base_data in base_lst)
+            base_lst = [base_data for base_data in base_lst if base_data["contract_URL"] not in known]
+        fresh = []
+        for base_data in base_lst:
+            if base_data["contract_URL"] not in self._url_pages:
+                self._url_pages[base_data["contract_URL"]] = set()
+                fresh.append(base_data)
+        return fresh
+
+    def mark_fetched(self, url: str) -> None:
+        if self.state is not None:
+            self.state.mark_fetched(url)
+
+    def page_version(self, url: str) -> Optional[PageVersion]:
+        """recheck 时返回已保存的版本, 否则返回None (新合同不需要比较)"""
+        return self.state.page_version(url) if self.state is not None and self.recheck else None
+
+    def stage_version(self, url: str, version: PageVersion, previous: Optional[PageVersion] = None) -> None:
+        if self.state is not None:
+            self._versions[url] = (version, previous)
+
+    def unchanged(self, url: str, etag: Optional[str] = None, last_modified: Optional[str] = None) -> None:
+        """合同未变更, 不会写入, 直接完成"""
+        if self.state is not None:
+            self.state.touch_version(url, etag, last_modified)
+        self.discard(url)
+
+    def on_flush(self, records: List[dict]) -> None:
+        """写入端 flush 之后回调"""
+        if self.state is not None:
+            self.state.mark_parsed(records)
+            versions = [(record["contract_URL"], *self._versions.pop(record["contract_URL"]))
+                        for record in records if record["contract_URL"] in self._versions]
+            if versions:
+                self.state.save_versions(versions)
+        for record in records:
+            self.discard(record["contract_URL"])
+
+    def discard(self, url: str) -> None:
+        """URL 已处理完成 (落盘或放弃), 检查其列表页是否完成"""
+        self._versions.pop(url, None)
+        for page in self._url_pages.pop(url, ()):
+            pending = self._pending.get(page)
+            if pending is None:
+                continue
+            pending.discard(url)
+            if not pending:
+                del self._pending[page]
+                self._finish_page(page)
+
+    def abandon_page(self, page: int) -> None:
+        """列表页被跳过或请求失败 (已写入 dead letter), 不记为完成, 只通知 on_page_done"""
+        if self.on_page_done is not None:
+            self.on_page_done(page)
+
+    def _finish_page(self, page: int) -> None:
+        if self.state is not None:
+            self.state.mark_page_done(page)
+        if self.on_page_done is not None:
+            self.on_page_done(page)
@@ -1,15 +1,20 @@
 import re
 from typing import Optional, Dict, Union
 
+# 预编译正则
+_BLANK_RE = re.compile(r"\s+")
+_INFO_RE = re.compile(r"^(?:(?P<main_key>.)[,、])?(?P<key>.*?)(?:[：:]{1,4}\s*(?P<value>.*))?$")
+_FILEID_RE = re.compile(r"'([^']*)'")
+
 
 def match_clean(string: str) -> str:
     """去除字符串中的所有空白/特殊字符"""
-    return re.sub(r"\s+", "", string.strip())
+    return _BLANK_RE.sub("", string.strip())
 
 
 def match_info(string: str) -> Optional[Dict[str, Union[str, dict]]]:
     """匹配字符串中的信息并返回字典形式"""
-    match = re.match(r"^(?:(?P<main_key>.)[,、])?(?P<key>.*?)(?:[：:]{1,4}\s*(?P<value>.*))?$", string)
+    match = _INFO_RE.match(string)
     # 设置value默认值
     if match:
         match_dict = match.groupdict()
@@ -21,7 +26,7 @@ def match_info(string: str) -> Optional[Dict[str, Union[str, dict]]]:
 
 def get_fileid(onclick_str: str) -> Optional[str]:
     """获取文件id"""
-    match = re.search(r"'([^']*)'", onclick_str)
+    match = _FILEID_RE.search(onclick_str)
     return match.group(1) if match else None
 
 